@@ -0,0 +1,167 @@
+# adtracking.py
+import atexit
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import metrics
+from config import ADS_BUFFER_SIZE, ADS_FLUSH_INTERVAL
+from database.models import db, AdStat, nairobi_tz
+from rollups import UPSERT_INSERTS
+
+logger = logging.getLogger(__name__)
+
+# Beacon event types -> index into an ad-hour's [impressions, clicks]
+EVENT_TYPES = {"impression": 0, "click": 1}
+
+# Ad images, listed by /get_ads and served from /static/ads/
+ADS_FOLDER = "static/ads/"
+AD_EXTENSIONS = (".jpg", ".png", ".jpeg", ".gif")
+
+
+class AdNames:
+    """The ad images in a folder, re-listed only when the folder's mtime changes."""
+
+    def __init__(self):
+        self._cached = {}
+
+    def get(self, folder):
+        version = os.stat(folder).st_mtime_ns
+        cached = self._cached.get(folder)
+        if cached is None or cached[0] != version:
+            # Interned, so every buffered event shares one string per ad
+            names = {name: name for name in map(sys.intern, os.listdir(folder)) if name.endswith(AD_EXTENSIONS)}
+            cached = self._cached[folder] = (version, names)
+        return cached[1]
+
+
+def hour_start(epoch_hour):
+    """The naive Nairobi datetime starting an hour counted since the epoch."""
+    return datetime.fromtimestamp(epoch_hour * 3600, nairobi_tz).replace(tzinfo=None)
+
+
+class AdEventBuffer:
+    """
+    Ring buffer of (ad, event type, epoch hour) beacon events. Producers only
+    ever extend a bounded deque and the flush thread only pops from it, both
+    atomic under the GIL, so taking events needs no lock and never waits on
+    the database. When the buffer is full the oldest events are overwritten
+    and counted in ads.dropped. Every ADS_FLUSH_INTERVAL seconds the events
+    are summed per ad and hour and written as one batched upsert.
+    """
+
+    def __init__(self, size=ADS_BUFFER_SIZE):
+        self._events = deque(maxlen=size)
+        self._flush_lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault("ADS_BUFFER_SIZE", ADS_BUFFER_SIZE)
+        app.config.setdefault("ADS_FLUSH_INTERVAL", ADS_FLUSH_INTERVAL)
+        if app.config["ADS_BUFFER_SIZE"] != self._events.maxlen:
+            self._events = deque(self._events, maxlen=app.config["ADS_BUFFER_SIZE"])
+        # CLI commands don't receive beacons
+        if os.environ.get("FLASK_RUN_FROM_CLI") == "true" or app.config["ADS_FLUSH_INTERVAL"] <= 0:
+            return
+        threading.Thread(target=self._run, args=(app, app.config["ADS_FLUSH_INTERVAL"]),
+                         name="ads-flush", daemon=True).start()
+        atexit.register(self._flush_at_exit, app)
+
+    def add(self, events):
+        """Buffer a batch of events; returns how many older events it pushed out."""
+        events_buffer = self._events
+        # Approximate under concurrent producers, which is all a drop counter needs
+        dropped = max(0, len(events_buffer) + len(events) - events_buffer.maxlen)
+        events_buffer.extend(events)
+        metrics.incr("ads.events_received", len(events))
+        if dropped:
+            metrics.incr("ads.dropped", dropped)
+        return dropped
+
+    def pending(self):
+        return len(self._events)
+
+    def _run(self, app, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    self.flush()
+            except Exception as e:
+                logger.error(f"Ad event flush failed: {e}")
+
+    def _flush_at_exit(self, app):
+        with app.app_context():
+            self.flush()
+
+    def _drain(self):
+        counts = {}
+        pop = self._events.popleft
+        try:
+            while True:
+                ad, kind, epoch_hour = pop()
+                totals = counts.get((ad, epoch_hour))
+                if totals is None:
+                    totals = counts[(ad, epoch_hour)] = [0, 0]
+                totals[kind] += 1
+        except IndexError:
+            return counts
+
+    def flush(self):
+        """Write buffered events as per-ad hourly counters; returns how many events were written."""
+        with self._flush_lock:
+            counts = self._drain()
+            if not counts:
+                return 0
+            start = time.perf_counter()
+            rows = [{"ad": ad, "hour": hour_start(epoch_hour), "impressions": impressions, "clicks": clicks}
+                    for (ad, epoch_hour), (impressions, clicks) in counts.items()]
+            try:
+                self._write(rows)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self._requeue(counts)
+                raise
+            finally:
+                db.session.remove()
+            events = sum(row["impressions"] + row["clicks"] for row in rows)
+            metrics.incr("ads.flushes")
+            metrics.incr("ads.events_flushed", events)
+            metrics.set_gauge("ads.last_flush_ms", round((time.perf_counter() - start) * 1000, 1))
+            metrics.set_gauge("ads.last_flush_rows", len(rows))
+            return events
+
+    def _requeue(self, counts):
+        # Put the events back so the next flush retries them
+        for (ad, epoch_hour), (impressions, clicks) in counts.items():
+            self._events.extend([(ad, 0, epoch_hour)] * impressions + [(ad, 1, epoch_hour)] * clicks)
+
+    @staticmethod
+    def _write(rows):
+        table = AdStat.__table__
+        insert = UPSERT_INSERTS.get(db.session.get_bind().dialect.name)
+        if insert is not None:
+            # One upsert run as executemany: compiled once and cached
+            statement = insert(table)
+            statement = statement.on_conflict_do_update(
+                index_elements=["ad", "hour"],
+                set_={"impressions": table.c.impressions + statement.excluded.impressions,
+                      "clicks": table.c.clicks + statement.excluded.clicks})
+            db.session.execute(statement, rows)
+            return
+
+        for row in rows:
+            stat = db.session.get(AdStat, (row["ad"], row["hour"]))
+            if stat is None:
+                db.session.add(AdStat(**row))
+            else:
+                stat.impressions += row["impressions"]
+                stat.clicks += row["clicks"]
+
+
+ad_names = AdNames()
+ad_events = AdEventBuffer()
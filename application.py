@@ -1,30 +1,108 @@
-from flask import Flask, render_template, jsonify, send_from_directory
-from database.models import db
+from flask import Flask, render_template, jsonify, send_from_directory, request, url_for
+from database.models import db, PaymentTransaction, Client
 from routes import voucher_bp, client_bp
 from routes.mpesa import mpesa_bp
+from routes.reports import reports_bp
+from routes.hls import hls_bp
+from routes.usage import usage_bp
+from routes.ads import ads_bp
+from ratelimit import limiter
+from circuitbreaker import daraja_breaker
+from reconciler import reconcile_command
+from rollups import backfill_command
+from archive import archive_command, archive_report_command
+from readreplica import read_router, replica_database_uri
+from hls import package_command, fetch_hls_js_command, hls_available, HLS_JS
+from catalog import catalog, build_catalog_command
+from profiler import query_profiler
+from voucherfilter import voucher_filter
+from usage import usage_aggregator, portal_mac
+from adtracking import ad_events, ADS_FOLDER
+from edgesync import init_sync
+import metrics
 import os
-from flask_migrate import Migrate
+from jsonprovider import FastJSONProvider, EncodedCache, json_body
+from config import AUTO_CREATE_TABLES, ARCHIVE_DATABASE_URI, HLS_FOLDER, CATALOG_FOLDER, CATALOG_PAGE_SIZE
+
+
+def init_db():
+    """Create missing tables, and indexes that create_all skips on existing tables."""
+    db.create_all()
+    for index in PaymentTransaction.__table__.indexes | Client.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
 
 def create_app():
     app = Flask(__name__)
+    app.json = FastJSONProvider(app)
 
     # Configure the SQLite database
     base_dir = os.path.abspath(os.path.dirname(__file__))
-    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(base_dir, 'instance/application.db')}"
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv(
+        "SQLALCHEMY_DATABASE_URI", f"sqlite:///{os.path.join(base_dir, 'instance/application.db')}")
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    binds = app.config.setdefault("SQLALCHEMY_BINDS", {})
+    if ARCHIVE_DATABASE_URI:
+        # Monthly archives of old payments, vouchers and clients (see archive.py)
+        binds["archive"] = ARCHIVE_DATABASE_URI
+    replica_uri = replica_database_uri(app)
+    if replica_uri:
+        # What the read-only blueprints query: a replica, or a read-only pool on the SQLite file
+        binds["replica"] = replica_uri
 
     # Initialize database (bind db with the Flask app)
     db.init_app(app)
-    migrate = Migrate(app, db)  # enable migration
+    read_router.init_app(app)
+
+    # Migrations only run through the flask CLI (`flask db ...`); WSGI workers
+    # skip the Flask-Migrate/alembic import entirely
+    if os.environ.get("FLASK_RUN_FROM_CLI") == "true":
+        from flask_migrate import Migrate
+        Migrate(app, db)  # enable migration
+
+    limiter.init_app(app)
+    daraja_breaker.init_app(app)
+    query_profiler.init_app(app)
 
     # Register routes/blueprints
     app.register_blueprint(mpesa_bp, url_prefix="/mpesa")
     app.register_blueprint(client_bp, url_prefix='/client')
     app.register_blueprint(voucher_bp, url_prefix='/voucher')
-
-    # Create database tables (if not already created)
-    with app.app_context():
-        db.create_all()
+    app.register_blueprint(reports_bp, url_prefix='/reports')
+    app.register_blueprint(hls_bp, url_prefix='/hls')
+    app.register_blueprint(usage_bp, url_prefix='/usage')
+    app.register_blueprint(ads_bp, url_prefix='/ads')
+
+    app.cli.add_command(reconcile_command)
+    app.cli.add_command(backfill_command)
+    app.cli.add_command(archive_command)
+    app.cli.add_command(archive_report_command)
+    app.cli.add_command(package_command)
+    app.cli.add_command(fetch_hls_js_command)
+    app.cli.add_command(build_catalog_command)
+
+    @app.cli.command("init-db")
+    def init_db_command():
+        """Create database tables and indexes."""
+        init_db()
+
+    # Create database tables (if not already created); respawned workers can
+    # skip this with AUTO_CREATE_TABLES=false once `flask init-db` has run
+    if AUTO_CREATE_TABLES:
+        with app.app_context():
+            init_db()
+
+    # Bloom filter of voucher codes, built in the background once tables exist
+    voucher_filter.init_app(app)
+
+    # Router byte counters, summed in memory and flushed in batches
+    usage_aggregator.init_app(app)
+
+    # Ad impression/click beacons, buffered in memory and flushed as hourly counters
+    ad_events.init_app(app)
+
+    # Edge/central sync (no-op for a standalone portal)
+    init_sync(app)
 
     return app
 
@@ -33,10 +111,13 @@ app = create_app()
 # Configure movie folder
 MOVIE_FOLDER = "static/movies/"
 app.config["MOVIE_FOLDER"] = MOVIE_FOLDER
+app.config["HLS_FOLDER"] = HLS_FOLDER
+app.config["CATALOG_FOLDER"] = CATALOG_FOLDER
 
 @app.route("/")
 def home():
-    return render_template("login.html")
+    # The gateway's redirect names the device, so the login can bind the voucher to its MAC
+    return render_template("login.html", client_mac=portal_mac(request.args))
 
 @app.route("/buy")
 def buy():
@@ -52,17 +133,60 @@ def list_routes():
     routes = [str(rule) for rule in app.url_map.iter_rules()]
     return {"routes": routes}
 
+@app.route("/metrics")
+def get_metrics():
+    return jsonify(metrics.snapshot())
+
+ads_cache = EncodedCache("ads_cache", max_entries=1)
+
 @app.route("/get_ads")
 def get_ads():
-    ads_folder = "static/ads/"
-    images = [f for f in os.listdir(ads_folder) if f.endswith((".jpg", ".png", ".jpeg", ".gif"))]
-    return jsonify(images)
+    ads_folder = ADS_FOLDER
+    # Adding or removing an ad changes the folder's mtime, which invalidates the cached body
+    version = os.stat(ads_folder).st_mtime_ns
+    body = ads_cache.get(ads_folder, version)
+    if body is None:
+        images = [f for f in os.listdir(ads_folder) if f.endswith((".jpg", ".png", ".jpeg", ".gif"))]
+        body = ads_cache.put(ads_folder, app.json.encode(images), version)
+    return json_body(body)
 
 # Movie Streaming Routes
+def catalog_page(page, per_page):
+    """One page of the movie catalog; players and posters are fetched by the browser on demand."""
+    entries = catalog.listing(app.config["MOVIE_FOLDER"], app.config["CATALOG_FOLDER"])
+    start = (page - 1) * per_page
+    movies = [{
+        "name": entry["name"],
+        "duration": entry["duration"],
+        "size": entry["size"],
+        "codec": entry["codec"],
+        "height": entry["height"],
+        "poster": url_for("get_poster", movie=entry["id"], v=entry["mtime"]) if entry["poster"] else None,
+        "hls": hls_available(app.config["HLS_FOLDER"], entry["name"]),
+        "url": url_for("get_movie", filename=entry["name"]),
+    } for entry in entries[start:start + per_page]]
+    return {"movies": movies, "page": page, "per_page": per_page, "total": len(entries),
+            "next": page + 1 if start + per_page < len(entries) else None}
+
 @app.route("/movies")
 def list_movies():
-    movies = [f for f in os.listdir(app.config["MOVIE_FOLDER"]) if f.endswith((".mp4", ".mkv", ".avi"))]
-    return render_template("movies.html", movies=movies)
+    return render_template("movies.html", catalog=catalog_page(1, CATALOG_PAGE_SIZE), HLS_JS=HLS_JS)
+
+@app.route("/movies/catalog")
+def movie_catalog():
+    try:
+        page = int(request.args.get("page", 1))
+        per_page = min(int(request.args.get("per_page", CATALOG_PAGE_SIZE)), 100)
+    except ValueError:
+        return jsonify({"status": "error", "message": "page and per_page must be integers"}), 400
+    if page < 1 or per_page < 1:
+        return jsonify({"status": "error", "message": "page and per_page must be positive"}), 400
+    return jsonify(catalog_page(page, per_page))
+
+@app.route("/movies/posters/<movie>.jpg")
+def get_poster(movie):
+    # Poster URLs carry the movie's mtime, so a re-described file gets a new URL
+    return send_from_directory(app.config["CATALOG_FOLDER"], f"{movie}.jpg", max_age=31536000)
 
 @app.route("/movies/<filename>")
 def get_movie(filename):
@@ -0,0 +1,246 @@
+# archive.py
+import logging
+import re
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import (Column, Index, MetaData, Table, delete, exists, func, inspect, literal, or_, select,
+                        union_all)
+
+import metrics
+from config import RETENTION_DAYS, ARCHIVE_BATCH_SIZE
+from database.models import db, Client, DataUsage, PaymentTransaction, Voucher, nairobi_tz, nairobi_now
+
+logger = logging.getLogger(__name__)
+
+# Columns the archives are searched by, besides the live table's primary key
+ARCHIVE_INDEXES = {
+    "payment_transactions": ("receipt_number", "checkout_request_id"),
+    "voucher": ("code",),
+    "client": ("mac_address",),
+    "data_usage": (),
+}
+
+# Seconds a listing of the archive tables is reused by lookups
+TABLE_NAMES_TTL = 60
+
+archive_metadata = MetaData()
+_table_names_cache = {}
+
+
+def archive_engine():
+    """The "archive" bind when ARCHIVE_DATABASE_URI is set, else the main database."""
+    return db.engines.get("archive", db.engine)
+
+
+def _key(table):
+    return list(table.primary_key)[0]
+
+
+def _month(value, default):
+    """YYYYMM of the Nairobi month `value` falls in (naive values are already Nairobi time)."""
+    if value is None:
+        return default
+    if value.tzinfo is not None:
+        value = value.astimezone(nairobi_tz)
+    return value.strftime("%Y%m")
+
+
+def archive_table(model, month):
+    """A model's monthly archive table: the same columns, indexed for lookups, without constraints."""
+    hot_table = model.__table__
+    name = f"{hot_table.name}_archive_{month}"
+    table = archive_metadata.tables.get(name)
+    if table is None:
+        # No primary key or unique constraints, so a reused id can never fail a batch
+        table = Table(name, archive_metadata, *[Column(column.name, column.type) for column in hot_table.columns])
+        for column in (_key(hot_table).name,) + ARCHIVE_INDEXES[hot_table.name]:
+            Index(f"ix_{name}_{column}", table.c[column])
+    return table
+
+
+def _table_names():
+    # New months appear at most once a month, so a lookup need not list tables every time
+    cached = _table_names_cache.get(archive_engine().url)
+    if cached is None or time.monotonic() - cached[0] > TABLE_NAMES_TTL:
+        cached = _table_names_cache[archive_engine().url] = (time.monotonic(),
+                                                             inspect(archive_engine()).get_table_names())
+    return cached[1]
+
+
+def archive_tables(model):
+    """Existing monthly archives of a model's table, newest first."""
+    pattern = re.compile(rf"^{re.escape(model.__tablename__)}_archive_(\d{{6}})$")
+    months = [match.group(1) for match in map(pattern.match, _table_names()) if match]
+    return [archive_table(model, month) for month in sorted(months, reverse=True)]
+
+
+def _copy(connection, batches):
+    """Insert rows into their archive tables, skipping rows an interrupted earlier run already copied."""
+    for (model, month), rows in batches.items():
+        table = archive_table(model, month)
+        table.create(connection, checkfirst=True)
+        key = table.c[_key(model.__table__).name]
+        copied = defaultdict(list)
+        for row in connection.execute(select(table).where(key.in_([row[key.name] for row in rows]))).mappings():
+            copied[row[key.name]].append(dict(row))
+        fresh = [row for row in rows if row not in copied[row[key.name]]]
+        if fresh:
+            connection.execute(table.insert(), fresh)
+
+
+def _move(model, where, month_of, batch_size, dependents=()):
+    """
+    Move rows of `model` matching `where` into their monthly archives, oldest
+    first, one batch per transaction; `dependents` are (model, foreign key
+    column) pairs whose rows go along to the same month. Returns rows moved.
+    """
+    table = model.__table__
+    key = _key(table)
+    engine = archive_engine()
+    moved = 0
+    while True:
+        rows = [dict(row) for row in db.session.execute(
+            select(table).where(where).order_by(key).limit(batch_size)).mappings()]
+        if not rows:
+            return moved
+        batches = defaultdict(list)
+        months = {}
+        for row in rows:
+            months[row[key.name]] = month_of(row)
+            batches[(model, months[row[key.name]])].append(row)
+        ids = list(months)
+        for dependent, column in dependents:
+            for row in db.session.execute(select(dependent.__table__).where(column.in_(ids))).mappings():
+                batches[(dependent, months[row[column.name]])].append(dict(row))
+
+        if engine is db.engine:
+            # Same database: the copy and the delete commit together
+            _copy(db.session.connection(), batches)
+        else:
+            # Separate archive: commit the copy first; a crash before the delete below only means
+            # the next run finds the rows already copied
+            with engine.begin() as connection:
+                _copy(connection, batches)
+        for dependent, column in dependents:
+            db.session.execute(delete(dependent.__table__).where(column.in_(ids)))
+        db.session.execute(delete(table).where(key.in_(ids)))
+        db.session.commit()
+        _table_names_cache.clear()
+        moved += len(rows)
+        metrics.incr(f"archive.rows.{table.name}", len(rows))
+
+
+def archive_expired(days=RETENTION_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Move everything older than `days` out of the live tables; returns
+    {table: (rows, seconds)}. Devices not seen since the cutoff go first,
+    then vouchers whose session ended before it (with their usage rows) and
+    no longer bound to a live device, then payments, except successful ones
+    whose voucher was never redeemed and so is still live.
+    """
+    cutoff = nairobi_now() - timedelta(days=days)
+    default_month = cutoff.strftime("%Y%m")
+    plan = [
+        (Client, Client.connected_at < cutoff, lambda row: _month(row["connected_at"], default_month), ()),
+        (Voucher,
+         Voucher.is_used.is_(True) & (Voucher.expiry_time < cutoff)
+         & ~exists().where(Client.voucher_id == Voucher.id),
+         lambda row: _month(row["created_at"], default_month),
+         ((DataUsage, DataUsage.voucher_id),)),
+        (PaymentTransaction,
+         (PaymentTransaction.created_at < cutoff)
+         & or_(PaymentTransaction.status != "SUCCESS",
+               ~exists().where(Voucher.code.in_([PaymentTransaction.receipt_number,
+                                                 PaymentTransaction.checkout_request_id]))),
+         lambda row: _month(row["created_at"], default_month), ()),
+    ]
+    report = {}
+    for model, where, month_of, dependents in plan:
+        start = time.perf_counter()
+        rows = _move(model, where, month_of, batch_size, dependents)
+        seconds = time.perf_counter() - start
+        report[model.__tablename__] = (rows, seconds)
+        if rows:
+            logger.info(f"Archived {rows} {model.__tablename__} rows in {seconds:.1f}s")
+            metrics.set_gauge(f"archive.rows_per_second.{model.__tablename__}", round(rows / seconds))
+    metrics.incr("archive.runs")
+    return report
+
+
+def find_archived(model, column, value):
+    """
+    Look a row up in a model's archives, for when the live table has missed;
+    returns (YYYYMM, row dict) from the newest month that has it, or None.
+    """
+    tables = archive_tables(model)
+    if not tables:
+        return None
+    # One statement across all months: each branch is an index lookup
+    query = union_all(*[select(literal(table.name.rsplit("_", 1)[1]).label("archive_month"), table)
+                        .where(table.c[column] == value) for table in tables])
+    query = query.order_by(query.selected_columns.archive_month.desc()).limit(1)
+    with archive_engine().connect() as connection:
+        row = connection.execute(query).mappings().first()
+    if row is None:
+        metrics.incr("archive.lookup_misses")
+        return None
+    metrics.incr("archive.lookup_hits")
+    row = dict(row)
+    return row.pop("archive_month"), row
+
+
+def archived_rows(model, columns, where=None):
+    """Stream `columns` of every archived row of a model (filtered by where(table)), e.g. to rebuild rollups."""
+    with archive_engine().connect() as connection:
+        for table in archive_tables(model):
+            query = select(*[table.c[name] for name in columns])
+            if where is not None:
+                query = query.where(where(table))
+            yield from connection.execution_options(yield_per=10000).execute(query)
+
+
+def retention_report():
+    """Rows in each live table (with the oldest timestamp) and in each of its monthly archives."""
+    report = {}
+    with archive_engine().connect() as connection:
+        for model, column in ((PaymentTransaction, PaymentTransaction.created_at), (Voucher, Voucher.created_at),
+                              (Client, Client.connected_at), (DataUsage, DataUsage.updated_at)):
+            rows, oldest = db.session.query(func.count(), func.min(column)).select_from(model).one()
+            metrics.set_gauge(f"retention.hot_rows.{model.__tablename__}", rows)
+            archives = {table.name.rsplit("_", 1)[1]: connection.execute(select(func.count()).select_from(table)).scalar()
+                        for table in archive_tables(model)}
+            report[model.__tablename__] = {"hot_rows": rows, "oldest": oldest, "archived": archives}
+    return report
+
+
+@click.command("archive-data")
+@click.option("--days", default=RETENTION_DAYS, help="Keep this many days in the live tables.")
+@click.option("--batch-size", default=ARCHIVE_BATCH_SIZE, help="Rows moved per transaction.")
+@click.option("--interval", default=0, help="Repeat every N seconds (0 runs once).")
+@with_appcontext
+def archive_command(days, batch_size, interval):
+    """Move payments, vouchers and clients older than the retention window into monthly archives."""
+    while True:
+        for table, (rows, seconds) in archive_expired(days, batch_size).items():
+            rate = f", {rows / seconds:,.0f} rows/s" if rows else ""
+            click.echo(f"{table}: archived {rows:,} rows in {seconds:.1f}s{rate}")
+        for table, sizes in retention_report().items():
+            click.echo(f"{table}: {sizes['hot_rows']:,} live rows, {sum(sizes['archived'].values()):,} archived")
+        if not interval:
+            break
+        time.sleep(interval)
+
+
+@click.command("archive-report")
+@with_appcontext
+def archive_report_command():
+    """Show live table sizes and archived rows per month."""
+    for table, sizes in retention_report().items():
+        oldest = sizes["oldest"].isoformat() if sizes["oldest"] else "-"
+        click.echo(f"{table}: {sizes['hot_rows']:,} live rows (oldest {oldest})")
+        for month, rows in sizes["archived"].items():
+            click.echo(f"  {month[:4]}-{month[4:]}: {rows:,} archived")
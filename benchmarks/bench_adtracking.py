@@ -0,0 +1,129 @@
+"""
+Sustained ad beacon ingestion through /ads/events.
+
+    python -m benchmarks.bench_adtracking [--rate 20000] [--seconds 20]
+
+Posts --rate impression/click events per second for --seconds against a
+throwaway SQLite database while the flush thread writes hourly counters
+every ADS_FLUSH_INTERVAL. Each beacon is one page view's: an impression of
+every ad and the occasional click. Reports the rate achieved, beacon
+latency, flush times and that every accepted event reached ad_stats. Checks
+that a beacon repeating one ad counts once, then overfills a small buffer
+to check the drop counter, and measures the memory a full ADS_BUFFER_SIZE
+buffer holds.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ad beacon ingestion")
+    parser.add_argument("--rate", type=int, default=20000, help="Events per second.")
+    parser.add_argument("--seconds", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory()
+    os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(workdir.name, 'ads.db')}"
+    os.environ.setdefault("ADS_FLUSH_INTERVAL", "2")
+    os.environ["RATELIMIT_ENABLED"] = "false"
+    os.environ["VOUCHER_FILTER_ENABLED"] = "false"
+    os.environ["USAGE_FLUSH_INTERVAL"] = "0"
+
+    import metrics
+    from sqlalchemy import func
+    from application import app
+    from adtracking import AdEventBuffer, ad_events, ad_names, ADS_FOLDER
+    from database.models import db, AdStat
+
+    ads = sorted(ad_names.get(ADS_FOLDER))
+    client = app.test_client()
+    rng = random.Random(7)
+    interval = app.config["ADS_FLUSH_INTERVAL"]
+
+    request_ms, flush_ms = [], []
+    stop = threading.Event()
+
+    def watch_flushes():
+        last = 0
+        while not stop.is_set():
+            snapshot = metrics.snapshot()
+            if snapshot["counters"].get("ads.flushes", 0) != last:
+                last = snapshot["counters"]["ads.flushes"]
+                flush_ms.append(snapshot["gauges"]["ads.last_flush_ms"])
+            time.sleep(0.05)
+
+    watcher = threading.Thread(target=watch_flushes, daemon=True)
+    watcher.start()
+    sent = 0
+    start = time.perf_counter()
+    for second in range(args.seconds):
+        tick = start + second
+        for _ in range(max(1, args.rate // len(ads))):
+            events = [{"ad": ad, "type": "impression"} for ad in ads]
+            events += [{"ad": ad, "type": "click"} for ad in ads if rng.random() < 0.02]
+            request_start = time.perf_counter()
+            client.post("/ads/events", json={"events": events})
+            request_ms.append((time.perf_counter() - request_start) * 1000)
+            sent += len(events)
+        time.sleep(max(0.0, tick + 1 - time.perf_counter()))
+    elapsed = time.perf_counter() - start
+    time.sleep(interval + 0.5)  # let the last flush land
+    stop.set()
+
+    with app.app_context():
+        ad_events.flush()
+        stored = db.session.query(func.sum(AdStat.impressions + AdStat.clicks)).scalar() or 0
+    counters = metrics.snapshot()["counters"]
+    dropped = counters.get("ads.dropped", 0)
+
+    print(f"{sent:,} events ({len(ads)} ads) in {elapsed:.1f}s = {sent / elapsed:,.0f}/s (target {args.rate:,}/s)")
+    print(f"beacon of {len(ads)} ads: median {statistics.median(request_ms):.2f}ms, "
+          f"p99 {sorted(request_ms)[int(len(request_ms) * 0.99)]:.2f}ms")
+    if flush_ms:
+        print(f"flushes every {interval:g}s: {len(flush_ms)}, median {statistics.median(flush_ms):.1f}ms, "
+              f"max {max(flush_ms):.1f}ms")
+    ok = stored + dropped == sent
+    print(f"events sent {sent:,}, stored {stored:,}, dropped {dropped:,}: {'match' if ok else 'MISMATCH'}")
+
+    # A beacon repeating one ad 200 times counts one impression and one click
+    client.post("/ads/events", json={"events": [{"ad": ads[0], "type": "impression"},
+                                                {"ad": ads[0], "type": "click"}] * 100})
+    with app.app_context():
+        ad_events.flush()
+        repeated = (db.session.query(func.sum(AdStat.impressions + AdStat.clicks)).scalar() or 0) - stored
+    print(f"beacon repeating one ad 200 times: {repeated} counted")
+    ok = ok and repeated == 2
+
+    # Overfill a small buffer with no flush running: the overflow is counted, memory stays bounded
+    small = AdEventBuffer(size=10000)
+    before = metrics.snapshot()["counters"].get("ads.dropped", 0)
+    event = [(ads[0], 0, 0)] * 1000
+    for _ in range(50):
+        small.add(event)
+    counted = metrics.snapshot()["counters"].get("ads.dropped", 0) - before
+    print(f"50,000 events into a 10,000-event buffer: {small.pending():,} kept, {counted:,} counted as dropped")
+    ok = ok and small.pending() == 10000 and counted == 40000
+
+    size = app.config["ADS_BUFFER_SIZE"]
+    tracemalloc.start()
+    full = AdEventBuffer(size=size)
+    hour = int(time.time()) // 3600
+    for i in range(0, size, 1000):
+        full.add([(ads[j % len(ads)], j & 1, hour) for j in range(i, i + 1000)])
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"a full {size:,}-event buffer holds {held / 2 ** 20:.1f} MiB ({held / size:.0f} bytes/event)")
+
+    workdir.cleanup()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+Retention: live-table sizes and lookups before and after archiving, and archive throughput.
+
+    python -m benchmarks.bench_archive [--rows 2000000] [--days 540] [--keep 90]
+                                       [--archive-file]
+
+Fills a throwaway SQLite database with --rows payments spread over --days
+(~90% successful, each success with its voucher, most redeemed long ago,
+one device per 10 vouchers and usage rows for a fifth of them), then times
+the paginated admin lists and receipt lookups, moves everything older than
+--keep days into monthly archives (a separate SQLite file with
+--archive-file), and times them again; the old receipt is then answered
+from the archive. Checks that no row was lost and that rollups rebuilt
+afterwards match the ones before.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+PACKAGES = (1.0, 35.0, 45.0, 60.0, 1000.0)
+FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def populate(path, rows, days, now):
+    connection = sqlite3.connect(path)
+    start = now - timedelta(days=days)
+    span = days * 86400
+    rng = random.Random(42)
+    chunk = 100000
+    voucher_id = 0
+    for offset in range(0, rows, chunk):
+        payments, vouchers, clients, usage = [], [], [], []
+        for i in range(offset, min(rows, offset + chunk)):
+            # Oldest to newest, as they would have been inserted
+            created = start + timedelta(seconds=span * i / rows)
+            success = rng.random() < 0.9
+            amount = rng.choice(PACKAGES)
+            receipt = f"R{i:09d}" if success else None
+            payments.append((f"ws_CO_{i:012d}", f"m{i}", receipt, amount, "SUCCESS" if success else "FAILED",
+                             "254712345678", "Voucher for 1 GB (1 Hour)", created.strftime(FORMAT)))
+            if not success:
+                continue
+            voucher_id += 1
+            used = rng.random() < 0.97
+            expiry = created + timedelta(minutes=rng.randrange(5, 600), hours=1) if used else None
+            vouchers.append((voucher_id, receipt, used, created.strftime(FORMAT), amount,
+                             expiry.strftime(FORMAT) if expiry else None))
+            if used and voucher_id % 5 == 0:
+                usage.append((voucher_id, rng.randrange(1 << 30), rng.randrange(1 << 26), 1 << 30,
+                              expiry.strftime(FORMAT)))
+            if voucher_id % 10 == 0:
+                clients.append((f"02:00:{voucher_id >> 24 & 255:02x}:{voucher_id >> 16 & 255:02x}:"
+                                f"{voucher_id >> 8 & 255:02x}:{voucher_id & 255:02x}",
+                                voucher_id, (expiry or created).strftime(FORMAT)))
+        connection.executemany(
+            "INSERT INTO payment_transactions (checkout_request_id, merchant_request_id, receipt_number, amount,"
+            " status, phone_number, description, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", payments)
+        connection.executemany("INSERT INTO voucher (id, code, is_used, created_at, price, expiry_time)"
+                               " VALUES (?, ?, ?, ?, ?, ?)", vouchers)
+        connection.executemany("INSERT INTO client (mac_address, voucher_id, connected_at) VALUES (?, ?, ?)", clients)
+        connection.executemany("INSERT INTO data_usage (voucher_id, bytes_in, bytes_out, quota_bytes, updated_at)"
+                               " VALUES (?, ?, ?, ?, ?)", usage)
+        connection.commit()
+    connection.close()
+
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retention and archival")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--days", type=int, default=540, help="Days of history to generate.")
+    parser.add_argument("--keep", type=int, default=90, help="Days kept in the live tables.")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--archive-file", action="store_true", help="Archive into a separate SQLite file.")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory()
+    path = os.path.join(workdir.name, "live.db")
+    os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    if args.archive_file:
+        os.environ["ARCHIVE_DATABASE_URI"] = f"sqlite:///{os.path.join(workdir.name, 'archive.db')}"
+    os.environ["RATELIMIT_ENABLED"] = "false"
+    os.environ["VOUCHER_FILTER_ENABLED"] = "false"
+    os.environ["USAGE_FLUSH_INTERVAL"] = "0"
+
+    from application import app  # creates the schema in the throwaway database
+    from archive import archive_expired, retention_report
+    from database.models import db, RevenueRollup, UsageRollup
+    from rollups import backfill
+
+    now = datetime.now()
+    start = time.perf_counter()
+    populate(path, args.rows, args.days, now)
+    print(f"inserted {args.rows:,} payments over {args.days} days in {time.perf_counter() - start:.1f}s")
+
+    client = app.test_client()
+    raw = sqlite3.connect(path)
+    receipt_after = "SELECT code FROM voucher WHERE is_used AND id > ? ORDER BY id LIMIT 1"
+    recent = raw.execute(receipt_after, (args.rows * 9 // 10 - 100,)).fetchone()[0]
+    old = raw.execute(receipt_after, (args.rows * 9 // 100,)).fetchone()[0]
+    raw.close()
+
+    def measure():
+        return {
+            "GET /voucher/list": timed(lambda: client.get("/voucher/list?page=2&per_page=50"), args.repeat),
+            "GET /client/list": timed(lambda: client.get("/client/list?page=2&per_page=50"), args.repeat),
+            f"receipt {recent} (live)": timed(lambda: client.get(f"/reports/receipts/{recent}"), args.repeat),
+            f"receipt {old} (old)": timed(lambda: client.get(f"/reports/receipts/{old}"), args.repeat),
+            "receipt never issued": timed(lambda: client.get("/reports/receipts/XXXXXXXXXX"), args.repeat),
+        }
+
+    def totals():
+        return (db.session.query(db.func.sum(RevenueRollup.transactions), db.func.sum(RevenueRollup.revenue)).one(),
+                db.session.query(db.func.sum(UsageRollup.redemptions)).scalar())
+
+    with app.app_context():
+        backfill()
+        rollups_before = totals()
+        sizes_before = retention_report()
+        before = measure()
+
+        start = time.perf_counter()
+        report = archive_expired(args.keep, args.batch_size)
+        elapsed = time.perf_counter() - start
+        sizes_after = retention_report()
+        after = measure()
+        archived_receipt = client.get(f"/reports/receipts/{old}").get_json()
+
+        backfill()
+        rollups_after = totals()
+
+    print(f"\narchived rows older than {args.keep} days "
+          f"({'separate file' if args.archive_file else 'same database'}, batches of {args.batch_size:,}):")
+    for table, (rows, seconds) in report.items():
+        rate = f"{rows / seconds:>10,.0f} rows/s" if rows else ""
+        print(f"  {table:<22} {rows:>10,} rows in {seconds:6.1f}s {rate}")
+    moved = sum(rows for rows, _ in report.values())
+    print(f"  {'total':<22} {moved:>10,} rows in {elapsed:6.1f}s {moved / elapsed:>10,.0f} rows/s")
+
+    print(f"\n{'table':<22} {'live before':>12} {'live after':>12} {'archived':>10} {'months':>7} {'lost':>5}")
+    lost = 0
+    for table, sizes in sizes_after.items():
+        archived = sum(sizes["archived"].values())
+        missing = sizes_before[table]["hot_rows"] - sizes["hot_rows"] - archived
+        lost += abs(missing)
+        print(f"{table:<22} {sizes_before[table]['hot_rows']:>12,} {sizes['hot_rows']:>12,} {archived:>10,}"
+              f" {len(sizes['archived']):>7} {missing:>5}")
+
+    print(f"\n{'request':<32} {'before':>9} {'after':>9}")
+    for name in before:
+        print(f"{name:<32} {before[name]:>8.2f}m {after[name]:>8.2f}m")
+    print(f"(m = milliseconds, median of {args.repeat}; the old receipt is served from archive "
+          f"{archived_receipt.get('archived')})")
+
+    same = rollups_before == rollups_after
+    print(f"\nrollups rebuilt after archiving {'match' if same else 'DIFFER from'} the ones before")
+    workdir.cleanup()
+    return 0 if same and not lost else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+Requests and bytes to open the movie page for a large library.
+
+    python -m benchmarks.bench_catalog [--films 500] [--viewport 6] [--metadata-kb 256]
+
+Creates --films sparse movie files with described catalog entries and
+posters (synthetic JPEG-sized payloads, since probing needs ffmpeg), then
+counts what a phone fetches:
+
+  * old page: one <video controls> per file, so the HTML plus one metadata
+    range request per film. Bytes per request are --metadata-kb, an
+    assumption (browsers read the container header; more when the index
+    sits at the end of the file).
+  * catalog page: the HTML with the first page embedded, plus posters for
+    the --viewport cards on screen (the rest are loading="lazy"), and for a
+    viewer who scrolls to the end, every catalog page and poster.
+All HTML, JSON and poster bytes are measured through the Flask test client.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+OLD_PAGE = """<!DOCTYPE html><html lang="en"><head>
+<meta name="viewport" content="width=device-width, initial-scale=1, maximum-scale=1"><title>Movies</title>
+<link rel="stylesheet" href="/static/style.css"></head><body><h1>Watch Movies</h1><div class="movies-container">
+{% for movie in movies %}<div class="movie-item"><h3>{{ movie }}</h3><video controls width="100%">
+<source src="{{ url_for('get_movie', filename=movie) }}" type="video/mp4">
+Your browser does not support this video format.</video></div>{% endfor %}</div></body></html>"""
+
+POSTER_BYTES = 14 * 1024
+
+
+def make_library(movie_folder, catalog_folder, films):
+    from hls import movie_id
+
+    os.makedirs(movie_folder)
+    os.makedirs(catalog_folder)
+    for i in range(films):
+        name = f"Film {i:03d} ({1990 + i % 35}).mp4"
+        path = os.path.join(movie_folder, name)
+        with open(path, "wb") as f:
+            f.truncate((700 + i % 900) * 2**20)  # sparse: sizes look real, nothing is written
+        stat = os.stat(path)
+        entry = {"name": name, "id": movie_id(name), "size": stat.st_size, "mtime": int(stat.st_mtime),
+                 "duration": 5400 + i % 1800, "codec": "h264", "width": 1280, "height": 720,
+                 "poster": True, "ready": True}
+        with open(os.path.join(catalog_folder, f"{entry['id']}.json"), "w") as f:
+            json.dump(entry, f)
+        with open(os.path.join(catalog_folder, f"{entry['id']}.jpg"), "wb") as f:
+            f.write(os.urandom(POSTER_BYTES))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Movie page requests and bytes")
+    parser.add_argument("--films", type=int, default=500)
+    parser.add_argument("--viewport", type=int, default=6, help="Cards visible without scrolling.")
+    parser.add_argument("--metadata-kb", type=int, default=256, help="Assumed bytes per <video> metadata fetch.")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory()
+    movie_folder = os.path.join(workdir.name, "movies")
+    os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(workdir.name, 'catalog.db')}"
+    os.environ["CATALOG_FOLDER"] = os.path.join(workdir.name, "catalog")
+    os.environ["RATELIMIT_ENABLED"] = "false"
+
+    from flask import render_template_string
+    from application import app
+
+    make_library(movie_folder, app.config["CATALOG_FOLDER"], args.films)
+    app.config["MOVIE_FOLDER"] = movie_folder
+    client = app.test_client()
+
+    # Old page
+    with app.test_request_context():
+        films = sorted(f for f in os.listdir(movie_folder) if f.endswith((".mp4", ".mkv", ".avi")))
+        old_html = len(render_template_string(OLD_PAGE, movies=films).encode())
+    old_requests = 1 + args.films
+    old_bytes = old_html + args.films * args.metadata_kb * 1024
+
+    # Catalog page: first visit reads the metadata files, later visits hit memory
+    start = time.perf_counter()
+    client.get("/movies")
+    cold_ms = (time.perf_counter() - start) * 1000
+    warm = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        page = client.get("/movies")
+        warm.append((time.perf_counter() - start) * 1000)
+    html_bytes = len(page.get_data())
+
+    pages, posters = [], []
+    next_page = 1
+    while next_page:
+        body = client.get(f"/movies/catalog?page={next_page}")
+        pages.append(len(body.get_data()))
+        data = body.get_json()
+        posters += [len(client.get(movie["poster"]).get_data()) for movie in data["movies"]]
+        next_page = data["next"]
+
+    open_requests = 1 + min(args.viewport, len(posters))
+    open_bytes = html_bytes + sum(posters[:args.viewport])
+    scroll_requests = 1 + (len(pages) - 1) + len(posters)
+    scroll_bytes = html_bytes + sum(pages[1:]) + sum(posters)
+
+    print(f"{args.films} films, {len(pages)} catalog pages; /movies server time {cold_ms:.1f}ms cold, "
+          f"{statistics.median(warm):.2f}ms warm\n")
+    print(f"{'':<34} {'requests':>9} {'bytes':>12}")
+    print(f"{'old page (one <video> per film)':<34} {old_requests:>9} {old_bytes / 2**20:10.1f} MiB"
+          f"  (HTML {old_html / 1024:.0f} KiB + {args.metadata_kb} KiB assumed per film)")
+    print(f"{'catalog page, opened':<34} {open_requests:>9} {open_bytes / 1024:10.1f} KiB")
+    print(f"{'catalog page, scrolled to the end':<34} {scroll_requests:>9} {scroll_bytes / 2**20:10.1f} MiB")
+    workdir.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
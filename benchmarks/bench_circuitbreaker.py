@@ -0,0 +1,179 @@
+"""
+Daraja outage drill: portal responsiveness with and without the circuit breaker.
+
+    python -m benchmarks.bench_circuitbreaker [--workers 8] [--buy-rate 4] [--page-rate 20]
+
+Starts benchmarks.daraja_stub, then drives the portal in-process through a
+pool of --workers threads standing in for sync server workers: purchases
+(POST /mpesa/buy-voucher) and page loads (GET /buy) arrive at fixed rates
+and queue for a free worker. Midway the stub is told to hang every Daraja
+request for longer than DARAJA_TIMEOUT, then the fault is cleared. The same
+timeline runs with the breaker disabled and enabled; per phase it reports
+purchase outcomes and page latency (queueing included), and for the
+breaker run how long after the fault cleared purchases succeeded again.
+
+Exits non-zero unless, in the breaker run, the circuit opened during the
+outage, purchases got 503s that all carry Retry-After, half-open probes were
+sent, and the circuit closed again with purchases succeeding.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.loadtest import ROOT, free_port, wait_for, percentile
+
+PHASES = (("healthy", 3.0), ("daraja hangs", 15.0), ("recovered", 12.0))
+
+
+def drive(app, args, stub_url):
+    """
+    Run the timeline once; returns {phase: {"buy": [(status, ms, retry_after)], "page": [ms]}}
+    and the recovery time.
+    """
+    results = {name: {"buy": [], "page": []} for name, _ in PHASES}
+    lock = threading.Lock()
+    recovered_at = []
+    cleared_at = [None]
+
+    def request(kind, phase, arrived, body):
+        with app.test_client() as client:
+            if kind == "buy":
+                response = client.post("/mpesa/buy-voucher", json=body)
+            else:
+                response = client.get("/buy")
+        status = response.status_code
+        done = time.perf_counter()
+        with lock:
+            if kind == "buy":
+                results[phase]["buy"].append((status, (done - arrived) * 1000, response.headers.get("Retry-After")))
+                if status == 200 and cleared_at[0] is not None and not recovered_at:
+                    recovered_at.append(done - cleared_at[0])
+            else:
+                results[phase]["page"].append((done - arrived) * 1000)
+
+    events = []
+    offset = 0.0
+    for name, seconds in PHASES:
+        events += [(offset + i / args.buy_rate, "buy", name) for i in range(int(seconds * args.buy_rate))]
+        events += [(offset + i / args.page_rate, "page", name) for i in range(int(seconds * args.page_rate))]
+        events.append((offset, "phase", name))
+        offset += seconds
+    events.sort(key=lambda event: (event[0], event[1] != "phase"))
+
+    pool = ThreadPoolExecutor(max_workers=args.workers)
+    start = time.perf_counter()
+    for index, (at, kind, phase) in enumerate(events):
+        delay = start + at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        if kind == "phase":
+            fault = {"hang": args.hang} if phase == "daraja hangs" else {}
+            requests.post(f"{stub_url}/stub/fault", json=fault)
+            if phase == "recovered":
+                cleared_at[0] = time.perf_counter()
+            continue
+        body = {"phone_number": f"07{index % 100000000:08d}", "amount": 10,
+                "voucher_data": "1 GB", "voucher_duration": "1 Hour"}
+        pool.submit(request, kind, phase, time.perf_counter(), body)
+    pool.shutdown(wait=True)
+    return results, recovered_at[0] if recovered_at else None
+
+
+def report(label, results, recovered):
+    print(f"\n{label}")
+    print(f"  {'phase':<14} {'buys':>5} {'200':>5} {'503':>5} {'other':>6} {'buy p50':>9} {'buy p99':>9}"
+          f" {'page p50':>9} {'page p99':>9} {'pages >1s':>10}")
+    for name, _ in PHASES:
+        buys, pages = results[name]["buy"], results[name]["page"]
+        statuses = [status for status, _, _ in buys]
+        buy_ms = [ms for _, ms, _ in buys]
+        slow_pages = sum(ms > 1000 for ms in pages)
+        print(f"  {name:<14} {len(buys):>5} {statuses.count(200):>5} {statuses.count(503):>5}"
+              f" {len(buys) - statuses.count(200) - statuses.count(503):>6}"
+              f" {percentile(buy_ms, 0.5):>8.0f}m {percentile(buy_ms, 0.99):>8.0f}m"
+              f" {percentile(pages, 0.5):>8.0f}m {percentile(pages, 0.99):>8.0f}m {slow_pages:>10}")
+    if recovered is not None:
+        print(f"  first successful purchase {recovered:.1f}s after Daraja recovered")
+    else:
+        print("  no successful purchase after Daraja recovered")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Daraja outage drill")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent requests the portal can serve.")
+    parser.add_argument("--buy-rate", type=float, default=4.0, help="Purchases per second.")
+    parser.add_argument("--page-rate", type=float, default=20.0, help="Page loads per second.")
+    parser.add_argument("--timeout", type=float, default=3.0, help="DARAJA_TIMEOUT for the drill.")
+    parser.add_argument("--hang", type=float, default=30.0, help="Seconds the stub holds each request.")
+    parser.add_argument("--open-seconds", type=float, default=5.0, help="BREAKER_OPEN_SECONDS for the drill.")
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory()
+    stub_port = free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    os.environ.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(workdir.name, 'breaker.db')}",
+        OAUTH_URL=f"{stub_url}/oauth/v1/generate",
+        STK_PUSH_URL=f"{stub_url}/mpesa/stkpush/v1/processrequest",
+        STK_QUERY_URL=f"{stub_url}/mpesa/stkpushquery/v1/query",
+        CALLBACK_URL="http://127.0.0.1:9/mpesa/mpesa_callback",
+        CONSUMER_KEY="key", CONSUMER_SECRET="secret", SHORTCODE="174379", PASSKEY="passkey",
+        DARAJA_TIMEOUT=str(args.timeout), BREAKER_OPEN_SECONDS=str(args.open_seconds),
+        RATELIMIT_ENABLED="false", VOUCHER_FILTER_ENABLED="false", USAGE_FLUSH_INTERVAL="0")
+
+    stub = subprocess.Popen([sys.executable, "-m", "benchmarks.daraja_stub", "--port", str(stub_port)],
+                            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(f"{stub_url}/stub/stats")
+        requests.post(f"{stub_url}/stub/outcome", json={"send_callback": False})
+
+        import logging
+        import metrics
+        from application import app
+        from circuitbreaker import daraja_breaker
+
+        logging.disable(logging.CRITICAL)  # the drill logs every failed push otherwise
+        print(f"{args.workers} workers, {args.buy_rate:g} purchases/s and {args.page_rate:g} page loads/s; "
+              f"Daraja hangs {args.hang:g}s per request, DARAJA_TIMEOUT={args.timeout:g}s")
+
+        daraja_breaker.enabled = False
+        results, recovered = drive(app, args, stub_url)
+        report("without the circuit breaker", results, recovered)
+
+        daraja_breaker.enabled = True
+        daraja_breaker.state.close()
+        before = metrics.snapshot()["counters"]
+        results, recovered = drive(app, args, stub_url)
+        report("with the circuit breaker", results, recovered)
+        after = metrics.snapshot()["counters"]
+        counts = {key: after.get(f"breaker.daraja.{key}", 0) - before.get(f"breaker.daraja.{key}", 0)
+                  for key in ("opened", "rejected", "probes")}
+        print("  breaker: " + ", ".join(f"{key} {count}" for key, count in counts.items()))
+
+        rejected = [retry_after for status, _, retry_after in results["daraja hangs"]["buy"] if status == 503]
+        checks = (
+            ("circuit opened during the outage", counts["opened"] >= 1),
+            ("purchases got 503 while open", bool(rejected)),
+            ("every 503 carries Retry-After", all(retry_after and int(retry_after) >= 1 for retry_after in rejected)),
+            ("half-open probes were sent", counts["probes"] >= 1),
+            ("circuit closed after recovery", daraja_breaker.state.open_until() is None and recovered is not None),
+        )
+        for name, passed in checks:
+            print(f"  {'ok  ' if passed else 'FAIL'} {name}")
+        ok = all(passed for _, passed in checks)
+    finally:
+        stub.terminate()
+        stub.wait()
+        workdir.cleanup()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
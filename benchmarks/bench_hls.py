@@ -0,0 +1,159 @@
+"""
+HLS startup latency and egress vs serving the whole movie file.
+
+    python -m benchmarks.bench_hls [--movie path.mp4] [--minutes 5] [--viewers 20]
+
+With --movie (needs ffmpeg) the file is packaged for real; otherwise a
+synthetic movie is laid out exactly as `flask package-movies` would, with
+segment sizes taken from the rendition bitrates. The script then measures:
+
+  * startup: bytes a player must fetch before the first frame (master +
+    lowest-rendition playlist + first segment, vs the first segment's worth of
+    the original file), server time for them, and the resulting wait on slow links;
+  * fan-out: --viewers clients watching the same film at once, counting disk
+    reads against segments served through the hot-segment cache;
+  * egress: bytes per full viewing at each rendition vs the original file.
+"""
+import argparse
+import hashlib
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+LINKS_KBPS = (500, 1000, 3000)
+
+
+def synthetic_movie(root, mid, minutes):
+    """Write renditions and content-addressed segments the way hls.package_movie does."""
+    from hls import RENDITIONS, SEGMENT_SECONDS, _bandwidth, segment_path
+
+    segments = minutes * 60 // SEGMENT_SECONDS
+    movie_dir = os.path.join(root, mid)
+    os.makedirs(movie_dir, exist_ok=True)
+    master = ["#EXTM3U", "#EXT-X-VERSION:3"]
+    for name, height, video, audio in RENDITIONS:
+        size = _bandwidth(video, audio) * SEGMENT_SECONDS // 8
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{SEGMENT_SECONDS}",
+                 "#EXT-X-PLAYLIST-TYPE:VOD"]
+        for i in range(segments):
+            data = os.urandom(size)
+            digest = hashlib.sha256(data).hexdigest()
+            path = segment_path(root, digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+            lines += [f"#EXTINF:{SEGMENT_SECONDS}.000000,", f"/hls/segments/{digest}.ts"]
+        lines.append("#EXT-X-ENDLIST")
+        with open(os.path.join(movie_dir, f"{name}.m3u8"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+        master.append(f"#EXT-X-STREAM-INF:BANDWIDTH={_bandwidth(video, audio)},RESOLUTION={height * 16 // 9}x{height}")
+        master.append(f"{name}.m3u8")
+    with open(os.path.join(movie_dir, "master.m3u8"), "w") as f:
+        f.write("\n".join(master) + "\n")
+
+
+def segment_urls(client, mid, rendition):
+    text = client.get(f"/hls/{mid}/{rendition}.m3u8").get_data(as_text=True)
+    return [line for line in text.splitlines() if line and not line.startswith("#")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HLS startup and egress")
+    parser.add_argument("--movie", help="Real movie to package (needs ffmpeg).")
+    parser.add_argument("--minutes", type=int, default=5, help="Length of the synthetic movie.")
+    parser.add_argument("--source-kbps", type=int, default=2500, help="Bitrate of the synthetic original file.")
+    parser.add_argument("--viewers", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory()
+    os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(workdir.name, 'hls.db')}"
+    os.environ["HLS_FOLDER"] = os.path.join(workdir.name, "hls")
+    os.environ["RATELIMIT_ENABLED"] = "false"
+
+    import hls
+    import metrics
+    from application import app
+    from routes.hls import segment_cache
+
+    root = app.config["HLS_FOLDER"]
+    if args.movie:
+        start = time.perf_counter()
+        hls.package_movie(args.movie, root)
+        mid = hls.movie_id(os.path.basename(args.movie))
+        source_bytes = os.path.getsize(args.movie)
+        print(f"packaged {args.movie} in {time.perf_counter() - start:.1f}s")
+    else:
+        mid = "synthetic"
+        synthetic_movie(root, mid, args.minutes)
+        source_bytes = args.source_kbps * 1000 * args.minutes * 60 // 8
+    client = app.test_client()
+    lowest, renditions = hls.RENDITIONS[0][0], [r[0] for r in hls.RENDITIONS]
+
+    # Startup: what the player fetches before it can show the first frame
+    def startup():
+        responses = [client.get(f"/hls/{mid}/master.m3u8"), client.get(f"/hls/{mid}/{lowest}.m3u8")]
+        responses.append(client.get(segment_urls(client, mid, lowest)[0]))
+        return sum(len(r.get_data()) for r in responses)
+
+    cold_start = time.perf_counter()
+    startup_bytes = startup()
+    cold_ms = (time.perf_counter() - cold_start) * 1000
+    warm = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        startup()
+        warm.append((time.perf_counter() - start) * 1000)
+    duration = len(segment_urls(client, mid, lowest)) * hls.SEGMENT_SECONDS
+    source_kbps = source_bytes * 8 / 1000 / duration
+    progressive_bytes = source_bytes * hls.SEGMENT_SECONDS // duration
+
+    print(f"\nstartup: HLS {startup_bytes / 1024:.0f} KiB (server {cold_ms:.1f}ms cold, "
+          f"{statistics.median(warm):.2f}ms warm) vs {progressive_bytes / 1024:.0f} KiB for the same "
+          f"{hls.SEGMENT_SECONDS}s of the original file (and only if its index sits at the front)")
+    print(f"{'link':>10} {'HLS first frame':>16} {'original first frame':>21} {'original sustains?':>19}")
+    for kbps in LINKS_KBPS:
+        print(f"{kbps:>6} kb/s {startup_bytes * 8 / kbps / 1000:15.1f}s "
+              f"{progressive_bytes * 8 / kbps / 1000:20.1f}s {'yes' if kbps > source_kbps else 'no, stalls':>19}")
+
+    # Fan-out: many viewers of the same film through the segment cache
+    before = metrics.snapshot()["counters"]
+    urls = segment_urls(client, mid, lowest)
+    barrier = threading.Barrier(args.viewers)
+
+    def viewer():
+        own = app.test_client()
+        barrier.wait()
+        for url in urls:
+            own.get(url).get_data()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=viewer) for _ in range(args.viewers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    after = metrics.snapshot()["counters"]
+    served = after.get("hls.segments_served", 0) - before.get("hls.segments_served", 0)
+    reads = after.get("hls.disk_reads", 0) - before.get("hls.disk_reads", 0)
+    print(f"\nfan-out: {args.viewers} viewers x {len(urls)} segments = {served} served, "
+          f"{reads} disk reads ({len(urls)} unique segments, first one already warm), {elapsed:.1f}s; "
+          f"cache holds {segment_cache.size / 2**20:.0f} MiB")
+
+    # Egress per full viewing
+    print(f"\n{'rendition':<10} {'egress per viewing':>19} {'vs original':>12}")
+    for name in renditions:
+        total = sum(os.path.getsize(hls.segment_path(root, url.rsplit("/", 1)[1][:-3]))
+                    for url in segment_urls(client, mid, name))
+        print(f"{name:<10} {total / 2**20:16.1f} MiB {total / source_bytes:11.0%}")
+    print(f"{'original':<10} {source_bytes / 2**20:16.1f} MiB {1:11.0%}")
+    workdir.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+JSON serializer microbenchmark over the portal's response shapes.
+
+    python -m benchmarks.bench_json [--number 2000]
+
+For each route's typical response, times building and encoding the body
+the old way (stdlib provider, datetimes turned into isoformat() strings in
+the view) against FastJSONProvider (orjson, datetimes passed through), and
+against serving a pre-encoded body from an EncodedCache where the route
+keeps one. Also times parsing a router's 1000-counter push.
+"""
+import argparse
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+NOW = datetime(2026, 10, 19, 18, 30, 15, 123456)
+
+
+def iso(value):
+    return value.isoformat() if value else None
+
+
+def shapes(stamp):
+    """Route -> function building its response, with datetimes passed through `stamp`."""
+    vouchers = lambda: [{"id": i, "code": f"SJK{i:07d}", "is_used": i % 3 == 0, "created_at": stamp(NOW - timedelta(minutes=i)),
+                 "price": 35.0} for i in range(100)]
+    clients = lambda: [{"id": i, "mac_address": f"02:00:00:00:{i >> 8:02x}:{i & 255:02x}", "voucher_id": i,
+                "voucher_code": f"SJK{i:07d}", "connected_at": stamp(NOW - timedelta(minutes=i))} for i in range(100)]
+    hours = lambda: [{"hour": stamp(NOW.replace(hour=h, minute=0, second=0, microsecond=0)), "status": status, "amount": amount,
+              "transactions": 12, "revenue": amount * 11}
+             for h in range(24) for status in ("SUCCESS", "FAILED") for amount in (35.0, 45.0, 60.0)]
+    movies = [{"name": f"Film {i:03d} (2001).mp4", "duration": 5400 + i, "size": 1_400_000_000 + i, "codec": "h264",
+               "height": 720, "poster": f"/movies/posters/film-{i:03d}-2001.jpg?v=1760000000",
+               "hls": f"/hls/film-{i:03d}-2001/master.m3u8", "url": f"/movies/Film%20{i:03d}%20(2001).mp4"}
+              for i in range(24)]
+    return {
+        "/get_ads": lambda: [f"ad{i}.jpg" for i in range(20)],
+        "/mpesa/payment-status": lambda: {
+            "status": "success", "transaction_status": "SUCCESS", "amount": 35.0,
+            "description": "Voucher for 3 GB (3 Hours)", "receipt_number": "SJK4H7QX2P", "timestamp": stamp(NOW)},
+        "/mpesa/validate_voucher": lambda: {
+            "status": "success", "message": "Voucher validated successfully", "expiry_time": iso(NOW)},
+        "/voucher/list (100)": lambda: {"status": "success", "vouchers": vouchers(), "page": 1, "per_page": 100,
+                                        "total": 5000, "pages": 50},
+        "/client/list (100)": lambda: {"status": "success", "clients": clients(), "page": 1, "per_page": 100,
+                                       "total": 5000, "pages": 50},
+        "/reports/revenue": lambda: {"status": "success", "date": "2026-10-19", "hours": hours(),
+                                     "transactions": 1728, "revenue": 75000.0},
+        "/movies/catalog": lambda: {"movies": movies, "page": 1, "per_page": 24, "total": 500, "next": 2},
+        "/usage/counters": lambda: {"status": "success", "accepted": 1000, "rejected": 0,
+                                    "cut_off": [f"02:00:00:00:00:{i:02x}" for i in range(20)]},
+        "/metrics": lambda: {"counters": {f"metric.{i}": i * 7 for i in range(40)},
+                             "gauges": {f"gauge.{i}": i / 3 for i in range(10)}},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON serializer microbenchmark")
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    from flask import Flask
+    from flask.json.provider import DefaultJSONProvider
+    import jsonprovider
+    from jsonprovider import FastJSONProvider, EncodedCache
+
+    if jsonprovider.orjson is None:
+        print("orjson is not installed; FastJSONProvider is using its stdlib fallback")
+    app = Flask(__name__)
+    stdlib, fast = DefaultJSONProvider(app), FastJSONProvider(app)
+    old, new = shapes(iso), shapes(lambda value: value)
+    cache = EncodedCache("bench_cache")
+    cache.put("body", fast.encode(new["/mpesa/payment-status"]()))
+    cached = ("/get_ads", "/mpesa/payment-status")
+
+    def per_call(func):
+        return min(timeit.repeat(func, number=args.number, repeat=5)) / args.number * 1e6
+
+    print(f"{'route shape':<26} {'bytes':>7} {'stdlib':>9} {'orjson':>9} {'speedup':>8} {'cached':>8}")
+    for route in old:
+        build_old, build_new = old[route], new[route]
+        stdlib_us = per_call(lambda: (stdlib.dumps(build_old(), separators=(",", ":")) + "\n").encode())
+        fast_us = per_call(lambda: fast.encode(build_new()))
+        cached_us = f"{per_call(lambda: cache.get('body')):7.2f}u" if route in cached else ""
+        size = len(fast.encode(build_new()))
+        print(f"{route:<26} {size:>7} {stdlib_us:8.1f}u {fast_us:8.1f}u {stdlib_us / fast_us:7.1f}x {cached_us:>8}")
+
+    push = fast.encode({"counters": [{"mac": f"02:00:00:00:{i >> 8:02x}:{i & 255:02x}", "bytes_in": 48213 + i,
+                                      "bytes_out": 5120} for i in range(1000)]})
+    stdlib_us = per_call(lambda: stdlib.loads(push))
+    fast_us = per_call(lambda: fast.loads(push))
+    print(f"\n{'parse 1000-counter push':<26} {len(push):>7} {stdlib_us:8.1f}u {fast_us:8.1f}u {stdlib_us / fast_us:7.1f}x")
+    print("(u = microseconds per response, build + encode; cached = EncodedCache lookup)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
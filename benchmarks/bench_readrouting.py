@@ -0,0 +1,183 @@
+"""
+Payment callback latency while admin lists and reports scan the database, with and without read routing.
+
+    python -m benchmarks.bench_readrouting [--rows 1000000] [--rate 20] [--scanners 2] [--seconds 15]
+
+Runs once with READ_ROUTING=false and once with it on, each in a fresh
+process on its own throwaway SQLite database of --rows payments (see
+benchmarks.bench_archive). Each run first sends stkCallbacks at --rate per
+second through a pool of --workers threads standing in for server workers,
+then keeps sending them while --scanners separate processes, standing in
+for the workers that serve admins, loop over /client/list, /voucher/list
+and the reports. Reports callback p50/p99 (queueing included)
+and errors per phase, and how many admin requests completed.
+
+Exits non-zero unless, with routing on, callbacks stay flat under the scans:
+no errors, and a p99 within --max-p99-ratio of the idle phase's plus
+--slack-ms.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from benchmarks.loadtest import ROOT, percentile
+
+ADMIN_REQUESTS = (
+    "/client/list?page={page}&per_page=50",
+    "/client/list?voucher_used=true&page={page}&per_page=50",
+    "/voucher/list?page={page}&per_page=50",
+    "/reports/revenue?date={date}",
+    "/reports/usage?date={date}",
+)
+
+
+def run(args):
+    """One run in this process; prints its results as a JSON line."""
+    workdir = tempfile.TemporaryDirectory()
+    path = os.path.join(workdir.name, "routing.db")
+    os.environ.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{path}", RATELIMIT_ENABLED="false",
+                      VOUCHER_FILTER_ENABLED="false", USAGE_FLUSH_INTERVAL="0", ADS_FLUSH_INTERVAL="0")
+
+    import logging
+    import sqlite3
+    from application import app  # creates the schema in the throwaway database
+    from benchmarks.bench_archive import populate
+    from benchmarks.daraja_stub import callback_body
+
+    logging.disable(logging.CRITICAL)
+    now = datetime.now()
+    populate(path, args.rows, 90, now)
+    phases = (("callbacks alone", args.seconds), ("with admin scans", args.seconds))
+    callbacks = int(sum(seconds for _, seconds in phases) * args.rate)
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        "INSERT INTO payment_transactions (checkout_request_id, merchant_request_id, amount, status, created_at)"
+        " VALUES (?, ?, 10, 'PENDING', ?)", [(f"ws_CO_bench{i}", f"m_bench{i}", str(now)) for i in range(callbacks)])
+    connection.commit()
+    connection.close()
+
+    results = {name: {"ms": [], "errors": 0} for name, _ in phases}
+    lock = threading.Lock()
+
+    def callback(phase, index, arrived):
+        body = callback_body(f"ws_CO_bench{index}", f"m_bench{index}", 0, "ok", 10, f"B{index:09d}", 254700000000)
+        with app.test_client() as client:
+            status = client.post("/mpesa/mpesa_callback", json=body).status_code
+        with lock:
+            results[phase]["ms"].append((time.perf_counter() - arrived) * 1000)
+            results[phase]["errors"] += status != 200
+
+    pool = ThreadPoolExecutor(max_workers=args.workers)
+    scanners = []
+    index = 0
+    for name, seconds in phases:
+        if name == "with admin scans":
+            # Admin requests land on other worker processes, as they would under gunicorn
+            scanners = [subprocess.Popen([sys.executable, "-m", "benchmarks.bench_readrouting", "--scan", path,
+                                          "--seconds", str(seconds + args.scanner_startup), "--seed", str(i)],
+                                         cwd=ROOT, stdout=subprocess.PIPE, text=True)
+                        for i in range(args.scanners)]
+            time.sleep(args.scanner_startup)
+        start = time.perf_counter()
+        for i in range(int(seconds * args.rate)):
+            delay = start + i / args.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(callback, name, index, time.perf_counter())
+            index += 1
+        time.sleep(max(0.0, start + seconds - time.perf_counter()))
+    pool.shutdown(wait=True)
+    admin = {"requests": 0, "errors": 0}
+    for scanner in scanners:
+        counts = json.loads(scanner.communicate()[0].strip().splitlines()[-1])
+        admin["requests"] += counts["requests"]
+        admin["errors"] += counts["errors"]
+
+    with app.app_context():
+        from database.models import db
+        journal = db.session.execute(db.text("PRAGMA journal_mode")).scalar()
+    print(json.dumps({"results": results, "admin": admin, "journal": journal}))
+    workdir.cleanup()
+
+
+def scan(args):
+    """An admin client in its own process: loop over ADMIN_REQUESTS for --seconds, then print counts."""
+    os.environ.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{args.scan}", RATELIMIT_ENABLED="false",
+                      VOUCHER_FILTER_ENABLED="false", USAGE_FLUSH_INTERVAL="0", ADS_FLUSH_INTERVAL="0",
+                      AUTO_CREATE_TABLES="false")
+    from application import app
+
+    client = app.test_client()
+    today = datetime.now().date()
+    counts = {"requests": 0, "errors": 0}
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")  # /client/list prints its parameters
+    index = args.seed
+    deadline = time.perf_counter() + args.seconds
+    while time.perf_counter() < deadline:
+        path = ADMIN_REQUESTS[index % len(ADMIN_REQUESTS)].format(page=index % 200 + 1, date=today)
+        counts["requests"] += 1
+        counts["errors"] += client.get(path).status_code != 200
+        index += 1
+    sys.stdout = stdout
+    print(json.dumps(counts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Callback latency under admin scans")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--rate", type=float, default=20.0, help="Callbacks per second.")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent callbacks the portal can serve.")
+    parser.add_argument("--scanners", type=int, default=2, help="Admin clients scanning in a loop.")
+    parser.add_argument("--seconds", type=float, default=15, help="Length of each phase.")
+    parser.add_argument("--scanner-startup", type=float, default=2.0,
+                        help="Seconds the admin processes get to start before the scan phase is timed.")
+    parser.add_argument("--max-p99-ratio", type=float, default=2.0,
+                        help="Allowed callback p99 under scans, as a multiple of the idle p99 (routing on).")
+    parser.add_argument("--slack-ms", type=float, default=25.0,
+                        help="Absolute allowance on top, for scheduler jitter on small machines.")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--scan", help=argparse.SUPPRESS)
+    parser.add_argument("--seed", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scan:
+        scan(args)
+        return 0
+    if args.child:
+        run(args)
+        return 0
+
+    print(f"{args.rows:,} payments; {args.rate:g} callbacks/s on {args.workers} workers, "
+          f"{args.scanners} admin scanners")
+    for routing in ("false", "true"):
+        output = subprocess.run([sys.executable, "-m", "benchmarks.bench_readrouting", "--child"] + sys.argv[1:],
+                                cwd=ROOT, env={**os.environ, "READ_ROUTING": routing},
+                                capture_output=True, text=True, check=True).stdout
+        run_result = json.loads(output.strip().splitlines()[-1])
+        print(f"\nREAD_ROUTING={routing} (journal_mode {run_result['journal']})")
+        print(f"  {'phase':<18} {'callbacks':>9} {'errors':>7} {'p50':>9} {'p99':>9} {'max':>9}")
+        for phase, result in run_result["results"].items():
+            ms = result["ms"]
+            print(f"  {phase:<18} {len(ms):>9} {result['errors']:>7} {percentile(ms, 0.5):>8.1f}m"
+                  f" {percentile(ms, 0.99):>8.1f}m {max(ms):>8.1f}m")
+        admin = run_result["admin"]
+        print(f"  admin requests completed: {admin['requests']:,} ({admin['errors']} errors)")
+
+    idle, scanned = (run_result["results"][phase] for phase in ("callbacks alone", "with admin scans"))
+    bound = percentile(idle["ms"], 0.99) * args.max_p99_ratio + args.slack_ms
+    p99 = percentile(scanned["ms"], 0.99)
+    ok = p99 <= bound and not idle["errors"] and not scanned["errors"]
+    print(f"\nREAD_ROUTING=true: callback p99 under scans {p99:.1f}ms, bound {bound:.1f}ms "
+          f"({args.max_p99_ratio:g}x idle + {args.slack_ms:g}ms): {'ok' if ok else 'FAILED'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
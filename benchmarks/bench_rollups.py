@@ -0,0 +1,111 @@
+"""
+Rollup reports vs ad-hoc aggregation over a large payment history.
+
+    python -m benchmarks.bench_rollups [--rows 10000000] [--days 90]
+
+Fills a throwaway SQLite database with synthetic transactions (spread over
+--days, five packages, ~90% successful), rebuilds the rollups with the
+backfill job, then times the same dashboard questions answered by ad-hoc
+GROUP BY over payment_transactions and by the /reports endpoints.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+PACKAGES = (1.0, 35.0, 45.0, 60.0, 1000.0)
+
+
+def populate(path, rows, days, now):
+    connection = sqlite3.connect(path)
+    start = now - timedelta(days=days)
+    span = days * 86400
+    rng = random.Random(42)
+    chunk = 100000
+    for offset in range(0, rows, chunk):
+        batch = []
+        for i in range(offset, min(rows, offset + chunk)):
+            created = start + timedelta(seconds=rng.random() * span)
+            success = rng.random() < 0.9
+            batch.append((f"ws_CO_{i:012d}", f"m{i}", f"R{i:09d}" if success else None, rng.choice(PACKAGES),
+                          "SUCCESS" if success else "FAILED", "254712345678", "Voucher",
+                          created.strftime("%Y-%m-%d %H:%M:%S.%f")))
+        connection.executemany(
+            "INSERT INTO payment_transactions (checkout_request_id, merchant_request_id, receipt_number, amount,"
+            " status, phone_number, description, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+        connection.commit()
+    connection.close()
+
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rollups vs ad-hoc aggregation")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory()
+    path = os.path.join(workdir.name, "rollups.db")
+    os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    os.environ["RATELIMIT_ENABLED"] = "false"
+
+    from application import app  # creates the schema in the throwaway database
+    from rollups import backfill
+
+    now = datetime.now()
+    start = time.perf_counter()
+    populate(path, args.rows, args.days, now)
+    print(f"inserted {args.rows:,} transactions in {time.perf_counter() - start:.1f}s")
+
+    with app.app_context():
+        start = time.perf_counter()
+        revenue_rows, _ = backfill()
+        print(f"backfill: {revenue_rows:,} rollup rows in {time.perf_counter() - start:.1f}s")
+
+    day = now.strftime("%Y-%m-%d")
+    raw = sqlite3.connect(path)
+    client = app.test_client()
+
+    def adhoc_today():
+        raw.execute(
+            "SELECT strftime('%Y-%m-%d %H:00:00', created_at), amount, status, count(*), sum(amount)"
+            " FROM payment_transactions WHERE created_at >= ? AND created_at < ?"
+            " AND status IN ('SUCCESS', 'FAILED') GROUP BY 1, 2, 3",
+            (f"{day} 00:00:00", f"{day} 23:59:59.999999")).fetchall()
+
+    def adhoc_packages():
+        raw.execute("SELECT amount, count(*), sum(amount) FROM payment_transactions"
+                    " WHERE status = 'SUCCESS' GROUP BY amount").fetchall()
+
+    results = [
+        ("today, per hour and package", timed(adhoc_today, args.repeat),
+         timed(lambda: client.get(f"/reports/revenue?date={day}"), args.repeat)),
+        ("all time, per package", timed(adhoc_packages, args.repeat),
+         timed(lambda: client.get("/reports/packages"), args.repeat)),
+    ]
+
+    print(f"\n{'question':<30} {'ad-hoc SQL':>12} {'/reports':>12} {'speedup':>9}")
+    for name, adhoc_ms, rollup_ms in results:
+        print(f"{name:<30} {adhoc_ms:10.1f}ms {rollup_ms:10.2f}ms {adhoc_ms / rollup_ms:8.0f}x")
+    print("\n(/reports timings include Flask request handling and JSON encoding)")
+    raw.close()
+    workdir.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""
+Cold-start budget for portal workers.
+
+    python -m benchmarks.bench_startup [--runs 5] [--budget-ms 600]
+
+Imports `application` in fresh interpreters with `-X importtime`, reports the
+median cumulative import time and wall-clock cold start, and fails when the
+import exceeds the budget or when a module that workers should load lazily
+(outbound HTTP, migrations, a second timezone library) is imported.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only needed on first payment, under the flask CLI, or not at all
+LAZY_MODULES = ("requests", "flask_migrate", "alembic", "pytz")
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def import_profile():
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import application"],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            cumulative[match.group(4)] = int(match.group(2)) / 1000
+    return wall_ms, cumulative
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Portal cold-start budget")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=600.0, help="Budget for `import application`.")
+    args = parser.parse_args()
+
+    walls, imports, loaded = [], [], set()
+    for _ in range(args.runs):
+        wall_ms, cumulative = import_profile()
+        walls.append(wall_ms)
+        imports.append(cumulative["application"])
+        loaded.update(cumulative)
+
+    import_ms = statistics.median(imports)
+    print(f"import application   {import_ms:8.1f} ms (median of {args.runs}, budget {args.budget_ms:.0f} ms)")
+    print(f"cold start (wall)    {statistics.median(walls):8.1f} ms")
+
+    eager = [name for name in LAZY_MODULES if name in loaded]
+    if eager:
+        print(f"imported eagerly: {', '.join(eager)}")
+    return 1 if eager or import_ms > args.budget_ms else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+Edge/central sync drill: two edges redeem one voucher while the uplink is cut, then converge.
+
+    python -m benchmarks.bench_sync [--interval 1] [--timeout 60]
+
+Starts benchmarks.daraja_stub, a central node and two edges (A and B) as
+local processes, each on its own throwaway SQLite database. A customer buys
+a voucher at edge A, and the drill waits for it to reach edge B. The central
+node is then stopped, which cuts both edges' link. The voucher is redeemed at
+A and, a moment later, at B, and B sells a second voucher. Both edges keep
+serving from their local databases. Central is then restarted on the same
+database, and the drill waits until all three nodes agree: the voucher is
+redeemed with A's expiry (first redeem wins), B's sale reached A, every
+node's revenue and usage reports count both sales and one redemption, and
+central counted the conflict. Exits non-zero if they have not converged within
+--timeout seconds.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from benchmarks.loadtest import ROOT, free_port, wait_for
+
+TOKEN = "drill-token"
+
+
+class Node:
+    """One portal process; restartable on the same port and database."""
+
+    def __init__(self, name, workdir, stub_url, **env):
+        self.name = name
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.log = open(os.path.join(workdir, f"{name}.log"), "a")
+        self.env = dict(os.environ,
+                        SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(workdir, f'{name}.db')}",
+                        NODE_ID=name, SYNC_TOKEN=TOKEN,
+                        OAUTH_URL=f"{stub_url}/oauth/v1/generate",
+                        STK_PUSH_URL=f"{stub_url}/mpesa/stkpush/v1/processrequest",
+                        STK_QUERY_URL=f"{stub_url}/mpesa/stkpushquery/v1/query",
+                        CALLBACK_URL=f"{self.url}/mpesa/mpesa_callback",
+                        CONSUMER_KEY="key", CONSUMER_SECRET="secret", SHORTCODE="174379", PASSKEY="passkey",
+                        RATELIMIT_ENABLED="false", VOUCHER_FILTER_ENABLED="false", **env)
+        self.process = None
+
+    def start(self):
+        self.process = subprocess.Popen([sys.executable, "-m", "flask", "--app", "application", "run",
+                                         "--port", str(self.port), "--with-threads", "--no-reload"],
+                                        cwd=ROOT, env=self.env, stdout=self.log, stderr=self.log)
+        wait_for(f"{self.url}/routes")
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+
+    def voucher(self, code):
+        """The voucher as this node sees it, or None."""
+        response = requests.get(f"{self.url}/reports/receipts/{code}", timeout=5)
+        return response.json()["voucher"] if response.status_code == 200 else None
+
+    def totals(self):
+        """(successful payments, redemptions) today, as this node's rollups report them."""
+        revenue = requests.get(f"{self.url}/reports/revenue", timeout=5).json()
+        usage = requests.get(f"{self.url}/reports/usage", timeout=5).json()
+        return revenue["successful_transactions"], usage["total_redemptions"]
+
+
+def buy(node, phone):
+    """Buy a voucher at a node through the stub; returns its code once the callback has landed."""
+    response = requests.post(f"{node.url}/mpesa/buy-voucher", timeout=10, json={
+        "phone_number": phone, "amount": 10, "voucher_data": "1 GB", "voucher_duration": "1 Hour"})
+    response.raise_for_status()
+    checkout_id = response.json()["stk_response"]["CheckoutRequestID"]
+    for _ in range(50):
+        time.sleep(0.2)
+        status = requests.get(f"{node.url}/mpesa/payment-status", timeout=5,
+                              params={"phone": phone, "request_id": checkout_id}).json()
+        if status.get("transaction_status") == "SUCCESS":
+            return status["receipt_number"]
+    raise RuntimeError(f"payment at {node.name} never succeeded")
+
+
+def redeem(node, code):
+    response = requests.post(f"{node.url}/mpesa/validate_voucher", json={"receipt_number": code}, timeout=5)
+    return response.status_code
+
+
+def wait_until(check, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return True
+        time.sleep(0.5)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Edge/central sync drill")
+    parser.add_argument("--interval", type=float, default=1.0, help="SYNC_INTERVAL of the edges.")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds allowed for each convergence.")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="sync-drill-")  # kept, with the node logs, if the drill fails
+    stub_port = free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    stub = subprocess.Popen([sys.executable, "-m", "benchmarks.daraja_stub", "--port", str(stub_port)],
+                            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    central = Node("central", workdir, stub_url, NODE_ROLE="central")
+    edges = [Node(name, workdir, stub_url, NODE_ROLE="edge", SYNC_CENTRAL_URL=central.url,
+                  SYNC_INTERVAL=str(args.interval)) for name in ("edge-a", "edge-b")]
+    edge_a, edge_b = edges
+    nodes = [central] + edges
+    ok = False
+    try:
+        wait_for(f"{stub_url}/stub/stats")
+        for node in nodes:
+            node.start()
+
+        code = buy(edge_a, "254700000001")
+        reached = wait_until(lambda: edge_b.voucher(code) is not None, args.timeout)
+        print(f"voucher {code} bought at edge-a {'reached' if reached else 'did NOT reach'} edge-b")
+        if not reached:
+            return 1
+
+        central.stop()
+        print("link cut: central stopped")
+        status_a = redeem(edge_a, code)
+        time.sleep(1)
+        status_b = redeem(edge_b, code)
+        second = buy(edge_b, "254700000002")
+        print(f"offline: redeemed at edge-a ({status_a}) then edge-b ({status_b}); edge-b sold {second}")
+        winner = edge_a.voucher(code)["expiry_time"]
+
+        central.start()
+        print("link restored: central restarted")
+
+        def converged():
+            views = [node.voucher(code) for node in nodes]
+            return (all(view and view["is_used"] and view["expiry_time"] == winner for view in views)
+                    and edge_a.voucher(second) is not None and all(node.totals() == (2, 1) for node in nodes))
+
+        start = time.monotonic()
+        ok = wait_until(converged, args.timeout)
+        conflicts = requests.get(f"{central.url}/metrics", timeout=5).json()["counters"].get("sync.conflicts", 0)
+        for node in nodes:
+            view = node.voucher(code)
+            sales, redemptions = node.totals()
+            print(f"  {node.name:<8} {code}: used={view['is_used'] if view else None} "
+                  f"expiry={view['expiry_time'] if view else None}; reports {sales} sales, {redemptions} redemptions")
+        if ok:
+            print(f"converged on edge-a's redemption {time.monotonic() - start:.1f}s after the link came back; "
+                  f"central counted {conflicts} conflict(s)")
+        else:
+            print(f"did NOT converge within {args.timeout:g}s (logs in {workdir})")
+        ok = ok and status_a == 200 and status_b == 200 and conflicts >= 1
+    finally:
+        for node in nodes:
+            node.stop()
+        stub.terminate()
+        stub.wait()
+        if ok:
+            shutil.rmtree(workdir)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
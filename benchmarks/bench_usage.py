@@ -0,0 +1,111 @@
+"""
+Sustained router counter ingestion through /usage/counters.
+
+    python -m benchmarks.bench_usage [--devices 10000] [--rate 10000] [--seconds 20]
+                                     [--database-url postgresql://...]
+
+Creates --devices redeemed vouchers with bound MACs and 1 GB quotas (in a
+throwaway SQLite file unless --database-url points at an empty database),
+then pushes --rate counter updates per second in router-sized batches for
+--seconds while the flush thread writes every USAGE_FLUSH_INTERVAL. Reports
+the rate achieved, flush times against the interval, and checks that every
+pushed byte reached the usage table.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+
+def populate(devices):
+    from database.models import db, Voucher, Client, DataUsage
+
+    macs = [f"02:00:{i >> 24 & 255:02x}:{i >> 16 & 255:02x}:{i >> 8 & 255:02x}:{i & 255:02x}" for i in range(devices)]
+    db.session.bulk_insert_mappings(Voucher, [{"id": i + 1, "code": f"U{i:09d}", "is_used": True, "price": 35.0}
+                                              for i in range(devices)])
+    db.session.bulk_insert_mappings(Client, [{"mac_address": mac, "voucher_id": i + 1} for i, mac in enumerate(macs)])
+    db.session.bulk_insert_mappings(DataUsage, [{"voucher_id": i + 1, "mac_address": mac, "bytes_in": 0,
+                                                 "bytes_out": 0, "quota_bytes": 1024 ** 3} for i, mac in enumerate(macs)])
+    db.session.commit()
+    return macs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Router counter ingestion")
+    parser.add_argument("--devices", type=int, default=10000)
+    parser.add_argument("--rate", type=int, default=10000, help="Counter updates per second.")
+    parser.add_argument("--batch", type=int, default=1000, help="Counters per router push.")
+    parser.add_argument("--seconds", type=int, default=20)
+    parser.add_argument("--database-url")
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory()
+    os.environ["SQLALCHEMY_DATABASE_URI"] = args.database_url or f"sqlite:///{os.path.join(workdir.name, 'usage.db')}"
+    os.environ["RATELIMIT_ENABLED"] = "false"
+    os.environ["VOUCHER_FILTER_ENABLED"] = "false"
+    os.environ["USAGE_TOKEN"] = "bench-token"
+
+    import metrics
+    from sqlalchemy import func
+    from application import app
+    from database.models import db, DataUsage
+
+    with app.app_context():
+        macs = populate(args.devices)
+    client = app.test_client()
+    rng = random.Random(4)
+
+    pushed, request_ms, flush_ms = 0, [], []
+    interval = app.config["USAGE_FLUSH_INTERVAL"]
+    stop = threading.Event()
+
+    def watch_flushes():
+        last = 0
+        while not stop.is_set():
+            snapshot = metrics.snapshot()
+            if snapshot["counters"].get("usage.flushes", 0) != last:
+                last = snapshot["counters"]["usage.flushes"]
+                flush_ms.append(snapshot["gauges"]["usage.last_flush_ms"])
+            time.sleep(0.05)
+
+    watcher = threading.Thread(target=watch_flushes, daemon=True)
+    watcher.start()
+    start = time.perf_counter()
+    for second in range(args.seconds):
+        tick = start + second
+        for _ in range(max(1, args.rate // args.batch)):
+            batch = [{"mac": rng.choice(macs), "bytes_in": rng.randrange(1, 50000), "bytes_out": rng.randrange(1, 5000)}
+                     for _ in range(args.batch)]
+            pushed += sum(c["bytes_in"] + c["bytes_out"] for c in batch)
+            request_start = time.perf_counter()
+            client.post("/usage/counters", json={"counters": batch}, headers={"X-Usage-Token": "bench-token"})
+            request_ms.append((time.perf_counter() - request_start) * 1000)
+        time.sleep(max(0.0, tick + 1 - time.perf_counter()))
+    elapsed = time.perf_counter() - start
+    time.sleep(interval + 0.5)  # let the last flush land
+    stop.set()
+
+    from usage import usage_aggregator
+    with app.app_context():
+        usage_aggregator.flush()
+        stored = db.session.query(func.sum(DataUsage.bytes_in + DataUsage.bytes_out)).scalar()
+
+    updates = len(request_ms) * args.batch
+    dialect = os.environ["SQLALCHEMY_DATABASE_URI"].split(":", 1)[0]
+    print(f"{dialect}: {updates:,} counter updates from {args.devices:,} devices in {elapsed:.1f}s "
+          f"= {updates / elapsed:,.0f}/s (target {args.rate:,}/s)")
+    print(f"push of {args.batch} counters: median {statistics.median(request_ms):.1f}ms, max {max(request_ms):.1f}ms")
+    if flush_ms:
+        print(f"flushes every {interval:g}s: {len(flush_ms)}, median {statistics.median(flush_ms):.0f}ms, "
+              f"max {max(flush_ms):.0f}ms ({max(flush_ms) / (interval * 1000):.0%} of the interval)")
+    print(f"bytes pushed {pushed:,}, stored {stored:,}: {'match' if pushed == stored else 'MISMATCH'}")
+    workdir.cleanup()
+    return 0 if pushed == stored else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
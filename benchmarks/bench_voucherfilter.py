@@ -0,0 +1,157 @@
+"""
+Voucher code Bloom filter: footprint, false positives, and an attack replay.
+
+    python -m benchmarks.bench_voucherfilter [--codes 10000000] [--vouchers 100000] [--attempts 20000]
+
+1. Builds a filter for --codes M-Pesa-style receipt codes at the configured
+   false-positive target and reports memory, build time and the measured
+   false-positive rate over 1M codes that were never issued.
+2. Fills a throwaway database with --vouchers paid vouchers and replays
+   --attempts guesses (99% never-issued codes, 1% real ones) against
+   /mpesa/validate_voucher with and without the filter, counting requests/s,
+   SQL statements and rejected misses.
+3. Inserts two vouchers behind the app's back, as another worker would (one
+   new, one at a lower id committing late), and checks both redeem once
+   VOUCHER_FILTER_REFRESH has passed.
+
+Exits non-zero unless the filter rejects at least --min-rejected of the
+never-issued codes, cuts SQL statements by at least --min-saving, and
+accepts both late vouchers.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import string
+import sys
+import tempfile
+import time
+
+ALPHABET = string.ascii_uppercase + string.digits
+
+
+def codes(rng, count, prefix=""):
+    return [prefix + "".join(rng.choices(ALPHABET, k=10 - len(prefix))) for _ in range(count)]
+
+
+def footprint(count, fp_rate):
+    from voucherfilter import BloomFilter
+
+    rng = random.Random(1)
+    issued = codes(rng, count, prefix="S")  # never-issued probes start with "X", so they can't collide
+    bloom = BloomFilter(count, fp_rate)
+    start = time.perf_counter()
+    for code in issued:
+        bloom.add(code)
+    build_s = time.perf_counter() - start
+    del issued
+
+    probes = codes(rng, 1_000_000, prefix="X")
+    start = time.perf_counter()
+    false_positives = sum(code in bloom for code in probes)
+    lookup_us = (time.perf_counter() - start) / len(probes) * 1e6
+    print(f"{count:,} codes, target {fp_rate:.1%}: {len(bloom.bits) / 2**20:.1f} MiB, {bloom.hashes} hashes, "
+          f"built in {build_s:.1f}s; measured false positives {false_positives / len(probes):.2%}, "
+          f"{lookup_us:.1f}us per lookup")
+
+
+def populate(path, vouchers):
+    rng = random.Random(2)
+    issued = codes(rng, vouchers, prefix="S")
+    connection = sqlite3.connect(path)
+    connection.executemany("INSERT INTO voucher (code, is_used, price) VALUES (?, 0, 35.0)",
+                           [(code,) for code in issued])
+    connection.executemany(
+        "INSERT INTO payment_transactions (checkout_request_id, merchant_request_id, receipt_number, amount,"
+        " status, phone_number, description, created_at) VALUES (?, ?, ?, 35.0, 'SUCCESS', '254712345678',"
+        " 'Voucher', '2026-01-01 00:00:00')",
+        [(f"ws_CO_{i}", f"m{i}", code) for i, code in enumerate(issued)])
+    connection.commit()
+    connection.close()
+    return issued
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Voucher filter footprint and attack replay")
+    parser.add_argument("--codes", type=int, default=10_000_000)
+    parser.add_argument("--vouchers", type=int, default=100_000)
+    parser.add_argument("--attempts", type=int, default=20_000)
+    parser.add_argument("--min-rejected", type=float, default=0.95, help="Share of misses the filter must reject.")
+    parser.add_argument("--min-saving", type=float, default=0.8, help="Share of SQL statements it must save.")
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory()
+    path = os.path.join(workdir.name, "vouchers.db")
+    os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    os.environ["RATELIMIT_ENABLED"] = "false"
+    os.environ["VOUCHER_FILTER_REBUILD"] = "0"  # build once, no periodic thread
+
+    from sqlalchemy import event
+    import metrics
+    from application import app
+    from database.models import db
+    from voucherfilter import voucher_filter
+
+    footprint(args.codes, app.config["VOUCHER_FILTER_FP_RATE"])
+
+    issued = populate(path, args.vouchers)
+    # Free an id near the end, for a voucher that commits late below the filter's high-water mark
+    late_id = args.vouchers - 10
+    late_code = issued.pop(late_id - 1)
+    connection = sqlite3.connect(path)
+    connection.execute("DELETE FROM voucher WHERE id = ?", (late_id,))
+    connection.commit()
+    with app.app_context():
+        voucher_filter.rebuild()
+        statements = [0]
+        event.listen(db.engine, "before_cursor_execute", lambda *a: statements.__setitem__(0, statements[0] + 1))
+
+    rng = random.Random(3)
+    attempts = [rng.choice(issued) if rng.random() < 0.01 else code
+                for code in codes(rng, args.attempts, prefix="X")]
+    misses = sum(code.startswith("X") for code in attempts)
+    client = app.test_client()
+    bloom = voucher_filter.bloom
+
+    print(f"\nreplay: {args.attempts:,} attempts ({misses:,} never issued), {args.vouchers:,} vouchers in the database")
+    results = {}
+    for label, active in (("without filter", None), ("with filter", bloom)):
+        voucher_filter.bloom = active
+        statements[0] = 0
+        before = metrics.snapshot()["counters"].get("voucher_filter.rejected", 0)
+        start = time.perf_counter()
+        for code in attempts:
+            client.post("/mpesa/validate_voucher", json={"receipt_number": code})
+        elapsed = time.perf_counter() - start
+        rejected = metrics.snapshot()["counters"].get("voucher_filter.rejected", 0) - before
+        results[label] = (statements[0], rejected)
+        print(f"{label:<15} {args.attempts / elapsed:8.0f} req/s, {statements[0]:6,} SQL statements, "
+              f"{rejected:,} misses rejected")
+    (baseline, _), (filtered, rejected) = results.values()
+    saving = 1 - filtered / baseline
+    ok = rejected / misses >= args.min_rejected and saving >= args.min_saving
+    print(f"filter rejected {rejected / misses:.1%} of misses (need {args.min_rejected:.0%}), "
+          f"saved {saving:.1%} of SQL statements (need {args.min_saving:.0%}): {'ok' if ok else 'FAILED'}")
+
+    # Another worker's inserts: this process's after_insert hook never sees them
+    new_code = "SLATEWORKR"
+    connection.execute("INSERT INTO voucher (code, is_used, price) VALUES (?, 0, 35.0)", (new_code,))
+    connection.execute("INSERT INTO voucher (id, code, is_used, price) VALUES (?, ?, 0, 35.0)", (late_id, late_code))
+    connection.execute(
+        "INSERT INTO payment_transactions (checkout_request_id, merchant_request_id, receipt_number, amount,"
+        " status, phone_number, description, created_at) VALUES ('ws_CO_late', 'm_late', ?, 35.0, 'SUCCESS',"
+        " '254712345678', 'Voucher', '2026-01-01 00:00:00')", (new_code,))
+    connection.commit()
+    connection.close()
+    time.sleep(app.config["VOUCHER_FILTER_REFRESH"])
+    for label, code in (("new", new_code), ("late, lower id", late_code)):
+        status = client.post("/mpesa/validate_voucher", json={"receipt_number": code}).status_code
+        print(f"voucher inserted by another worker ({label}): {status}")
+        ok = ok and status == 200
+
+    workdir.cleanup()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+"""
+Local stand-in for the Safaricom Daraja API (OAuth, STK push, STK query and
+the result callback sent back to the portal).
+
+    python -m benchmarks.daraja_stub --port 8081
+
+Point the portal at it with
+    OAUTH_URL=http://127.0.0.1:8081/oauth/v1/generate
+    STK_PUSH_URL=http://127.0.0.1:8081/mpesa/stkpush/v1/processrequest
+    STK_QUERY_URL=http://127.0.0.1:8081/mpesa/stkpushquery/v1/query
+
+Every push gets an outcome when it is created. POST /stub/outcome sets the
+outcome for the next pushes, e.g. {"result_code": 1032}. Like the real API,
+a successful STK query carries no MpesaReceiptNumber unless the outcome sets
+"include_receipt": true; "pending": true keeps queries answering "still
+processing". Unless "send_callback" is false, the stub POSTs
+the stkCallback to the push's CallBackURL after "callback_delay" seconds.
+
+POST /stub/fault injects gateway faults into OAuth, STK push and STK query:
+{"hang": 30} holds every request that long before answering, {"status": 503}
+answers with that error instead; {} clears them.
+"""
+import argparse
+import itertools
+import logging
+import threading
+import time
+import uuid
+
+import requests
+from flask import Flask, jsonify, request
+
+logger = logging.getLogger(__name__)
+
+
+def callback_body(checkout_id, merchant_id, result_code, desc, amount, receipt, phone):
+    """The stkCallback document Daraja POSTs to CallBackURL."""
+    callback = {
+        "MerchantRequestID": merchant_id,
+        "CheckoutRequestID": checkout_id,
+        "ResultCode": result_code,
+        "ResultDesc": desc,
+    }
+    if result_code == 0:
+        callback["CallbackMetadata"] = {"Item": [
+            {"Name": "Amount", "Value": amount},
+            {"Name": "MpesaReceiptNumber", "Value": receipt},
+            {"Name": "TransactionDate", "Value": 20250221192216},
+            {"Name": "PhoneNumber", "Value": int(phone)},
+        ]}
+    return {"Body": {"stkCallback": callback}}
+
+
+def create_stub():
+    stub = Flask(__name__)
+    state = {
+        "outcome": {"result_code": 0, "include_receipt": False, "pending": False,
+                    "send_callback": True, "callback_delay": 1.0},
+        "fault": {},
+        "transactions": {},
+        "callback_timings": [],
+        "counts": {"oauth": 0, "stk_push": 0, "stk_query": 0, "callback_sent": 0, "callback_failed": 0},
+    }
+    lock = threading.Lock()
+    receipts = itertools.count(1)
+    stub.config["STUB_STATE"] = state
+
+    def result_desc(code):
+        return {
+            0: "The service request is processed successfully.",
+            1032: "Request cancelled by user",
+            2001: "The initiator information is invalid.",
+            1037: "DS timeout user cannot be reached",
+        }.get(code, "Request failed")
+
+    def send_callback(url, body):
+        start = time.perf_counter()
+        try:
+            ok = requests.post(url, json=body, timeout=10).status_code == 200
+        except requests.RequestException as e:
+            logger.warning(f"Callback to {url} failed: {e}")
+            ok = False
+        with lock:
+            state["counts"]["callback_sent" if ok else "callback_failed"] += 1
+            state["callback_timings"].append((time.perf_counter() - start, ok))
+
+    @stub.before_request
+    def inject_fault():
+        if request.path.startswith("/stub/"):
+            return None
+        with lock:
+            fault = dict(state["fault"])
+        if fault.get("hang"):
+            time.sleep(fault["hang"])
+        if fault.get("status"):
+            return jsonify({"errorCode": str(fault["status"]), "errorMessage": "Injected fault"}), fault["status"]
+        return None
+
+    @stub.route("/oauth/v1/generate", methods=["GET"])
+    def oauth():
+        with lock:
+            state["counts"]["oauth"] += 1
+        return jsonify({"access_token": "stub-token", "expires_in": "3599"})
+
+    @stub.route("/mpesa/stkpush/v1/processrequest", methods=["POST"])
+    def stk_push():
+        payload = request.get_json()
+        checkout_id = f"ws_CO_{uuid.uuid4().hex[:24]}"
+        merchant_id = uuid.uuid4().hex[:20]
+        with lock:
+            state["counts"]["stk_push"] += 1
+            outcome = dict(state["outcome"])
+            receipt = f"STB{next(receipts):07d}"
+            state["transactions"][checkout_id] = {"payload": payload, "outcome": outcome, "receipt": receipt}
+
+        if outcome.get("send_callback") and not outcome.get("pending"):
+            code = outcome["result_code"]
+            body = callback_body(checkout_id, merchant_id, code, result_desc(code),
+                                 payload.get("Amount"), receipt, payload.get("PhoneNumber"))
+            timer = threading.Timer(outcome.get("callback_delay", 1.0), send_callback,
+                                    args=(payload.get("CallBackURL"), body))
+            timer.daemon = True
+            timer.start()
+
+        return jsonify({
+            "MerchantRequestID": merchant_id,
+            "CheckoutRequestID": checkout_id,
+            "ResponseCode": "0",
+            "ResponseDescription": "Success. Request accepted for processing",
+            "CustomerMessage": "Success. Request accepted for processing",
+        })
+
+    @stub.route("/mpesa/stkpushquery/v1/query", methods=["POST"])
+    def stk_query():
+        checkout_id = request.get_json().get("CheckoutRequestID")
+        with lock:
+            state["counts"]["stk_query"] += 1
+            transaction = state["transactions"].get(checkout_id)
+        if transaction is None:
+            return jsonify({"errorCode": "400.002.02", "errorMessage": "Bad Request - Invalid CheckoutRequestID"}), 400
+
+        outcome = transaction["outcome"]
+        if outcome.get("pending"):
+            return jsonify({"errorCode": "500.001.1001", "errorMessage": "The transaction is being processed"}), 500
+
+        body = {
+            "ResponseCode": "0",
+            "ResponseDescription": "The service request has been accepted successsfully",
+            "MerchantRequestID": uuid.uuid4().hex[:20],
+            "CheckoutRequestID": checkout_id,
+            "ResultCode": str(outcome["result_code"]),
+            "ResultDesc": result_desc(outcome["result_code"]),
+        }
+        if outcome["result_code"] == 0 and outcome.get("include_receipt"):
+            body["MpesaReceiptNumber"] = transaction["receipt"]
+        return jsonify(body)
+
+    @stub.route("/stub/outcome", methods=["POST"])
+    def set_outcome():
+        with lock:
+            state["outcome"].update(request.get_json())
+            return jsonify(state["outcome"])
+
+    @stub.route("/stub/fault", methods=["POST"])
+    def set_fault():
+        with lock:
+            state["fault"] = request.get_json() or {}
+            return jsonify(state["fault"])
+
+    @stub.route("/stub/stats", methods=["GET"])
+    def stats():
+        with lock:
+            return jsonify(state["counts"])
+
+    @stub.route("/stub/callbacks", methods=["GET"])
+    def callbacks():
+        # (seconds, ok) for every callback the portal answered, for latency reporting
+        with lock:
+            return jsonify(state["callback_timings"])
+
+    return stub
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Daraja API stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    create_stub().run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
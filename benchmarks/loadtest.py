@@ -0,0 +1,300 @@
+"""
+Load test for the purchase-to-login flow against a local fake Daraja.
+
+    python -m benchmarks.loadtest [--rate 5] [--duration 30] [--runs 3] [--compare]
+
+Starts benchmarks.daraja_stub and the portal (on a throwaway SQLite database)
+as subprocesses, then opens customer journeys at a fixed arrival rate:
+
+    POST /mpesa/buy-voucher  ->  stub sends the stkCallback to /mpesa/mpesa_callback
+    GET  /mpesa/payment-status (polled until SUCCESS/FAILED)
+    POST /mpesa/validate_voucher
+
+and reports throughput, p50/p99 latency and error rate per route (the
+callback is timed by the stub, which is the caller). The test runs --runs
+times on fresh processes and reports each metric's median across runs, since
+a single run's p99 is little more than its slowest request. --compare checks
+the result against benchmarks/loadtest_baseline.json and exits non-zero on a
+regression, allowing for the run-to-run spread both sides measured;
+--write-baseline replaces the baseline.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, "benchmarks", "loadtest_baseline.json")
+
+# A result regresses when the median p99 grows by more than SPREAD_FACTOR times the wider
+# run-to-run spread (max - min over median) seen in it or the baseline, but at least TOLERANCE;
+# when throughput drops by more than TOLERANCE; or when errors appear. The absolute slack keeps
+# millisecond jitter on a quiet route from failing the run.
+TOLERANCE = 0.25
+SPREAD_FACTOR = 2.0
+SLACK_MS = 10.0
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, seconds, ok):
+        with self._lock:
+            self.samples.setdefault(route, []).append((seconds, ok))
+
+    def report(self, elapsed):
+        report = {}
+        for route, samples in sorted(self.samples.items()):
+            latencies = [seconds * 1000 for seconds, _ in samples]
+            errors = sum(1 for _, ok in samples if not ok)
+            report[route] = {
+                "requests": len(samples),
+                "throughput_rps": round(len(samples) / elapsed, 2),
+                "p50_ms": round(percentile(latencies, 0.50), 2),
+                "p99_ms": round(percentile(latencies, 0.99), 2),
+                "error_rate": round(errors / len(samples), 4),
+            }
+        return report
+
+
+class Journey:
+    """One customer: buy, wait for the callback by polling, then log in with the receipt."""
+
+    def __init__(self, base_url, recorder, poll_interval, poll_timeout):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.poll_interval = poll_interval
+        self.poll_timeout = poll_timeout
+        self.local = threading.local()
+
+    def session(self):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def call(self, route, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session().request(method, self.base_url + path, timeout=30, **kwargs)
+        except requests.RequestException:
+            self.recorder.record(route, time.perf_counter() - start, False)
+            return None
+        self.recorder.record(route, time.perf_counter() - start, response.status_code < 400)
+        return response
+
+    def run(self, index):
+        phone = f"2547{index % 10 ** 8:08d}"
+        response = self.call("buy_voucher", "POST", "/mpesa/buy-voucher", json={
+            "phone_number": phone, "amount": 1, "voucher_data": "1 GB", "voucher_duration": "1 Hour"})
+        if response is None or response.status_code != 200:
+            return "buy_failed"
+        checkout_id = response.json()["stk_response"]["CheckoutRequestID"]
+
+        deadline = time.monotonic() + self.poll_timeout
+        receipt = None
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            response = self.call("payment_status", "GET", "/mpesa/payment-status",
+                                 params={"phone": phone, "request_id": checkout_id})
+            if response is None or response.status_code != 200:
+                continue
+            data = response.json()
+            if data["transaction_status"] == "SUCCESS":
+                receipt = data["voucher_code"]
+                break
+            if data["transaction_status"] == "FAILED":
+                return "payment_failed"
+        if receipt is None:
+            return "callback_timeout"
+
+        response = self.call("validate_voucher", "POST", "/mpesa/validate_voucher",
+                             json={"receipt_number": receipt})
+        return "ok" if response is not None and response.status_code == 200 else "login_failed"
+
+
+def start_processes(args, workdir):
+    stub_port, app_port = free_port(), free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    app_url = f"http://127.0.0.1:{app_port}"
+
+    env = dict(os.environ,
+               SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+               OAUTH_URL=f"{stub_url}/oauth/v1/generate",
+               STK_PUSH_URL=f"{stub_url}/mpesa/stkpush/v1/processrequest",
+               STK_QUERY_URL=f"{stub_url}/mpesa/stkpushquery/v1/query",
+               CALLBACK_URL=f"{app_url}/mpesa/mpesa_callback",
+               RATELIMIT_ENABLED="true" if args.with_ratelimit else "false")
+    log = open(os.path.join(workdir, "servers.log"), "w")
+    processes = [
+        subprocess.Popen([sys.executable, "-m", "benchmarks.daraja_stub", "--port", str(stub_port)],
+                         cwd=ROOT, env=env, stdout=log, stderr=log),
+        subprocess.Popen([sys.executable, "-m", "flask", "--app", "application", "run",
+                          "--port", str(app_port), "--with-threads", "--no-reload"],
+                         cwd=ROOT, env=env, stdout=log, stderr=log),
+    ]
+    wait_for(f"{stub_url}/stub/stats")
+    wait_for(f"{app_url}/routes")
+    requests.post(f"{stub_url}/stub/outcome", json={"callback_delay": args.callback_delay})
+    return processes, stub_url, app_url
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        processes, stub_url, app_url = start_processes(args, workdir)
+        try:
+            recorder = Recorder()
+            journey = Journey(app_url, recorder, args.poll_interval, args.poll_timeout)
+            outcomes = {}
+            futures = []
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.max_users) as pool:
+                # Open-loop arrivals: journeys start on schedule whether or not earlier ones finished
+                total = int(args.rate * args.duration)
+                for index in range(total):
+                    delay = start + index / args.rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    futures.append(pool.submit(journey.run, index))
+                for future in futures:
+                    outcome = future.result()
+                    outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            elapsed = time.perf_counter() - start
+
+            for seconds, ok in requests.get(f"{stub_url}/stub/callbacks").json():
+                recorder.record("mpesa_callback", seconds, ok)
+            return {
+                "config": {"rate": args.rate, "duration": args.duration, "poll_interval": args.poll_interval,
+                           "callback_delay": args.callback_delay},
+                "routes": recorder.report(elapsed),
+                "journeys": outcomes,
+                "callbacks": requests.get(f"{stub_url}/stub/stats").json(),
+            }
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def combine(results):
+    """Median of each route metric over several runs, keeping the per-run p99s for their spread."""
+    routes = {}
+    for route in sorted({route for result in results for route in result["routes"]}):
+        runs = [result["routes"][route] for result in results if route in result["routes"]]
+        routes[route] = {metric: round(median([run[metric] for run in runs]), 4 if metric == "error_rate" else 2)
+                         for metric in runs[0]}
+        routes[route]["p99_runs_ms"] = [run["p99_ms"] for run in runs]
+    totals = {}
+    for section in ("journeys", "callbacks"):
+        totals[section] = {}
+        for result in results:
+            for key, count in result[section].items():
+                totals[section][key] = totals[section].get(key, 0) + count
+    return {"config": results[0]["config"], "routes": routes, **totals}
+
+
+def spread(route):
+    """Relative run-to-run spread of a route's p99; 0 for a single run or an old baseline."""
+    runs = route.get("p99_runs_ms", [])
+    if len(runs) < 2 or not median(runs):
+        return 0.0
+    return (max(runs) - min(runs)) / median(runs)
+
+
+def compare(result, baseline):
+    regressions = []
+    for route, base in baseline["routes"].items():
+        current = result["routes"].get(route)
+        if current is None:
+            regressions.append(f"{route}: no requests recorded")
+            continue
+        tolerance = max(TOLERANCE, SPREAD_FACTOR * max(spread(base), spread(current)))
+        if current["p99_ms"] > base["p99_ms"] * (1 + tolerance) + SLACK_MS:
+            regressions.append(f"{route}: p99 {current['p99_ms']}ms vs baseline {base['p99_ms']}ms "
+                               f"(allowed +{tolerance:.0%} + {SLACK_MS:g}ms)")
+        if current["throughput_rps"] < base["throughput_rps"] * (1 - TOLERANCE):
+            regressions.append(f"{route}: throughput {current['throughput_rps']}/s vs baseline {base['throughput_rps']}/s")
+        if current["error_rate"] > base["error_rate"] + 0.01:
+            regressions.append(f"{route}: error rate {current['error_rate']} vs baseline {base['error_rate']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Purchase-to-login load test")
+    parser.add_argument("--rate", type=float, default=5.0, help="New customer journeys per second.")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to keep starting journeys.")
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--poll-timeout", type=float, default=30.0)
+    parser.add_argument("--callback-delay", type=float, default=1.0, help="Seconds before the stub calls back.")
+    parser.add_argument("--max-users", type=int, default=200, help="Concurrent journeys in flight.")
+    parser.add_argument("--runs", type=int, default=3, help="Repetitions; metrics are medians across them.")
+    parser.add_argument("--with-ratelimit", action="store_true", help="Keep the rate limiter enabled.")
+    parser.add_argument("--output", help="Write the JSON report here.")
+    parser.add_argument("--compare", action="store_true", help="Fail on regression against the baseline.")
+    parser.add_argument("--write-baseline", action="store_true")
+    args = parser.parse_args()
+
+    result = combine([run(args) for _ in range(args.runs)])
+    result["config"]["runs"] = args.runs
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    if args.write_baseline:
+        with open(BASELINE, "w") as f:
+            f.write(text + "\n")
+
+    if args.compare:
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+        if baseline["config"] != result["config"]:
+            print(f"warning: baseline was recorded with {baseline['config']}", file=sys.stderr)
+        regressions = compare(result, baseline)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
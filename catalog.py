@@ -0,0 +1,155 @@
+# catalog.py
+import json
+import logging
+import os
+import queue
+import subprocess
+import threading
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from hls import MOVIE_EXTENSIONS, movie_id
+
+logger = logging.getLogger(__name__)
+
+POSTER_WIDTH = 320
+
+
+def _probe(path):
+    """Duration, video codec and frame size of a movie file via ffprobe."""
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path],
+        capture_output=True, text=True, check=True, timeout=60)
+    info = json.loads(result.stdout)
+    video = next((s for s in info.get("streams", []) if s.get("codec_type") == "video"), {})
+    duration = info.get("format", {}).get("duration")
+    return {
+        "duration": round(float(duration)) if duration else None,
+        "codec": video.get("codec_name"),
+        "width": video.get("width"),
+        "height": video.get("height"),
+    }
+
+
+def _poster(path, target, duration):
+    """Grab one frame a little way into the film (past any black intro) as a small JPEG."""
+    offset = min(60, (duration or 0) // 10)
+    subprocess.run(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-ss", str(offset), "-i", path,
+         "-frames:v", "1", "-vf", f"scale={POSTER_WIDTH}:-2", "-q:v", "5", target],
+        check=True, timeout=120)
+
+
+class Catalog:
+    """
+    Movie listing with poster and metadata, computed once per file by a
+    background thread and cached on disk as <catalog>/<movie id>.json, keyed by
+    the file's size and mtime. Requests never wait on ffmpeg: a file that has
+    not been described yet is listed with its name and size only.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._pending = set()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def listing(self, movie_folder, catalog_folder, background=True):
+        """All movies, sorted by name, as metadata dicts; undescribed files are queued unless background=False."""
+        entries = []
+        with os.scandir(movie_folder) as items:
+            for item in sorted(items, key=lambda i: i.name):
+                if not item.name.lower().endswith(MOVIE_EXTENSIONS):
+                    continue
+                stat = item.stat()
+                with self._lock:
+                    entry = self._entries.get(item.name)
+                if entry is None or entry["size"] != stat.st_size or entry["mtime"] != int(stat.st_mtime):
+                    entry = self._load(item.path, catalog_folder, item.name, stat, background)
+                entries.append(entry)
+        return entries
+
+    def _load(self, path, catalog_folder, name, stat, background):
+        fingerprint = {"size": stat.st_size, "mtime": int(stat.st_mtime)}
+        entry = None
+        try:
+            with open(os.path.join(catalog_folder, f"{movie_id(name)}.json")) as f:
+                cached = json.load(f)
+            if cached["size"] == fingerprint["size"] and cached["mtime"] == fingerprint["mtime"]:
+                entry = cached
+        except (OSError, ValueError, KeyError):
+            pass
+
+        if entry is None:
+            entry = {"name": name, "id": movie_id(name), **fingerprint,
+                     "duration": None, "codec": None, "width": None, "height": None, "poster": False, "ready": False}
+            if background:
+                self._enqueue(path, catalog_folder, name)
+        with self._lock:
+            self._entries[name] = entry
+        return entry
+
+    def _enqueue(self, path, catalog_folder, name):
+        with self._lock:
+            if name in self._pending:
+                return
+            self._pending.add(name)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="catalog", daemon=True)
+                self._thread.start()
+        self._queue.put((path, catalog_folder, name))
+
+    def _run(self):
+        while True:
+            path, catalog_folder, name = self._queue.get()
+            try:
+                self.describe(path, catalog_folder)
+            except Exception as e:
+                logger.error(f"Failed to describe {name}: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(name)
+
+    def describe(self, path, catalog_folder):
+        """Probe one movie, write its poster and metadata file, and return the entry."""
+        name = os.path.basename(path)
+        stat = os.stat(path)
+        entry = {"name": name, "id": movie_id(name), "size": stat.st_size, "mtime": int(stat.st_mtime),
+                 "duration": None, "codec": None, "width": None, "height": None, "poster": False, "ready": True}
+        os.makedirs(catalog_folder, exist_ok=True)
+        try:
+            entry.update(_probe(path))
+            _poster(path, os.path.join(catalog_folder, f"{entry['id']}.jpg"), entry["duration"])
+            entry["poster"] = True
+        except FileNotFoundError:
+            logger.warning("ffmpeg/ffprobe not installed; listing movies without posters")
+        except (subprocess.SubprocessError, ValueError) as e:
+            logger.warning(f"Could not read {name}: {e}")
+
+        # Write-then-rename so a concurrent reader never sees half a file
+        target = os.path.join(catalog_folder, f"{entry['id']}.json")
+        with open(target + ".tmp", "w") as f:
+            json.dump(entry, f)
+        os.replace(target + ".tmp", target)
+        with self._lock:
+            self._entries[name] = entry
+        return entry
+
+
+catalog = Catalog()
+
+
+@click.command("build-catalog")
+@with_appcontext
+def build_catalog_command():
+    """Describe every movie now instead of waiting for the first visitor."""
+    folder, catalog_folder = current_app.config["MOVIE_FOLDER"], current_app.config["CATALOG_FOLDER"]
+    described = 0
+    for entry in catalog.listing(folder, catalog_folder, background=False):
+        if not entry["ready"]:
+            catalog.describe(os.path.join(folder, entry["name"]), catalog_folder)
+            described += 1
+    click.echo(f"Described {described} movies")
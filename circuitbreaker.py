@@ -0,0 +1,309 @@
+# circuitbreaker.py
+import logging
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import jsonify
+
+import metrics
+from config import (BREAKER_ENABLED, BREAKER_REDIS_URL, BREAKER_WINDOW, BREAKER_MIN_CALLS, BREAKER_ERROR_RATE,
+                    BREAKER_SLOW_CALL, BREAKER_SLOW_RATE, BREAKER_OPEN_SECONDS, BREAKER_HALF_OPEN_PROBES,
+                    DARAJA_TIMEOUT)
+
+logger = logging.getLogger(__name__)
+
+# Values of the breaker.<name>.state gauge
+CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit {name} is open; retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class MemoryState:
+    """Breaker state for one worker process: open deadline, probe slot and per-second outcome buckets."""
+
+    def __init__(self, window):
+        self.window = window
+        self._open_until = None
+        self._probe_until = 0.0
+        self._probe_successes = 0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def open_until(self):
+        return self._open_until
+
+    def record(self, now, failed, slow):
+        """Count one call outcome; returns (calls, failures, slow) over the window, or None while open."""
+        second = int(now)
+        with self._lock:
+            if self._open_until is not None:
+                return None
+            bucket = self._buckets.setdefault(second, [0, 0, 0])
+            bucket[0] += 1
+            bucket[1] += failed
+            bucket[2] += slow
+            totals = [0, 0, 0]
+            for key in list(self._buckets):
+                if key <= second - self.window:
+                    del self._buckets[key]
+                    continue
+                for i, count in enumerate(self._buckets[key]):
+                    totals[i] += count
+            return tuple(totals)
+
+    def trip(self, until):
+        with self._lock:
+            self._open_until = until
+            self._probe_until = 0.0
+            self._probe_successes = 0
+            self._buckets.clear()
+
+    def claim_probe(self, now, hold):
+        """Take the single half-open probe slot for up to `hold` seconds."""
+        with self._lock:
+            if now < self._probe_until:
+                return False
+            self._probe_until = now + hold
+            return True
+
+    def probe_succeeded(self):
+        """Release the probe slot; returns the number of successful probes since the circuit opened."""
+        with self._lock:
+            self._probe_until = 0.0
+            self._probe_successes += 1
+            return self._probe_successes
+
+    def close(self):
+        with self._lock:
+            self._open_until = None
+            self._probe_until = 0.0
+            self._probe_successes = 0
+            self._buckets.clear()
+
+
+def _fallback_on_error(method):
+    @wraps(method)
+    def wrapper(self, *args):
+        try:
+            return method(self, *args)
+        except Exception as e:
+            # A redis outage must not take payments down with it; degrade to per-worker state
+            logger.warning(f"Redis circuit breaker state unavailable, using in-process state: {e}")
+            return getattr(self._fallback, method.__name__)(*args)
+
+    return wrapper
+
+
+class RedisState:
+    """The same state in redis, so every worker sees one circuit (one round trip per operation)."""
+
+    RECORD = """
+    if redis.call('EXISTS', KEYS[2]) == 1 then
+        return nil
+    end
+    local now = tonumber(ARGV[1])
+    local window = tonumber(ARGV[2])
+    local key = KEYS[1] .. now
+    redis.call('HINCRBY', key, 'calls', 1)
+    redis.call('HINCRBY', key, 'failures', tonumber(ARGV[3]))
+    redis.call('HINCRBY', key, 'slow', tonumber(ARGV[4]))
+    redis.call('EXPIRE', key, window + 1)
+    local calls, failures, slow = 0, 0, 0
+    for second = now - window + 1, now do
+        local counts = redis.call('HMGET', KEYS[1] .. second, 'calls', 'failures', 'slow')
+        calls = calls + (tonumber(counts[1]) or 0)
+        failures = failures + (tonumber(counts[2]) or 0)
+        slow = slow + (tonumber(counts[3]) or 0)
+    end
+    return {calls, failures, slow}
+    """
+
+    def __init__(self, url, name, window):
+        import redis  # Optional dependency, only needed for shared state
+
+        # Short timeouts: a slow redis must not become the outage the breaker is there to contain
+        self._client = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        self._record = self._client.register_script(self.RECORD)
+        self._prefix = f"breaker:{name}:"
+        self.window = window
+        self._fallback = MemoryState(window)
+
+    def _window_keys(self, now):
+        second = int(now)
+        return [f"{self._prefix}w:{s}" for s in range(second - self.window + 1, second + 1)]
+
+    @_fallback_on_error
+    def open_until(self):
+        value = self._client.get(self._prefix + "open")
+        return float(value) if value is not None else None
+
+    @_fallback_on_error
+    def record(self, now, failed, slow):
+        totals = self._record(keys=[self._prefix + "w:", self._prefix + "open"],
+                              args=[int(now), self.window, int(failed), int(slow)])
+        return tuple(totals) if totals else None
+
+    @_fallback_on_error
+    def trip(self, until):
+        pipe = self._client.pipeline()
+        pipe.set(self._prefix + "open", repr(until))
+        pipe.delete(self._prefix + "probe", self._prefix + "ok", *self._window_keys(time.time()))
+        pipe.execute()
+
+    @_fallback_on_error
+    def claim_probe(self, now, hold):
+        return bool(self._client.set(self._prefix + "probe", 1, nx=True, px=int(hold * 1000)))
+
+    @_fallback_on_error
+    def probe_succeeded(self):
+        pipe = self._client.pipeline()
+        pipe.incr(self._prefix + "ok")
+        pipe.delete(self._prefix + "probe")
+        return pipe.execute()[0]
+
+    @_fallback_on_error
+    def close(self):
+        self._client.delete(self._prefix + "open", self._prefix + "probe", self._prefix + "ok",
+                            *self._window_keys(time.time()))
+
+
+def _server_error(response):
+    return response.status_code >= 500
+
+
+def service_unavailable(retry_after):
+    response = jsonify({"status": "error", "message": "Payments are temporarily unavailable, please try again shortly"})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+class CircuitBreaker:
+    """
+    Fails calls to an upstream fast once it is misbehaving. Outcomes are
+    counted over a rolling window of BREAKER_WINDOW seconds; when at least
+    BREAKER_MIN_CALLS calls were made and the share of errors or of calls
+    slower than BREAKER_SLOW_CALL crosses its threshold, the circuit opens
+    and calls raise CircuitOpenError for BREAKER_OPEN_SECONDS. After that,
+    one call at a time goes through as a probe; BREAKER_HALF_OPEN_PROBES
+    healthy probes close the circuit, a failed one opens it again.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.enabled = True
+        self.state = MemoryState(BREAKER_WINDOW)
+        self.min_calls, self.error_rate = BREAKER_MIN_CALLS, BREAKER_ERROR_RATE
+        self.slow_call, self.slow_rate = BREAKER_SLOW_CALL, BREAKER_SLOW_RATE
+        self.open_seconds, self.probes = BREAKER_OPEN_SECONDS, BREAKER_HALF_OPEN_PROBES
+        # A probe that hangs gives up its slot once the request timeout has surely passed
+        self.probe_hold = DARAJA_TIMEOUT + 1
+
+    def init_app(self, app):
+        app.config.setdefault("BREAKER_ENABLED", BREAKER_ENABLED)
+        app.config.setdefault("BREAKER_REDIS_URL", BREAKER_REDIS_URL)
+        app.config.setdefault("BREAKER_WINDOW", BREAKER_WINDOW)
+        app.config.setdefault("BREAKER_MIN_CALLS", BREAKER_MIN_CALLS)
+        app.config.setdefault("BREAKER_ERROR_RATE", BREAKER_ERROR_RATE)
+        app.config.setdefault("BREAKER_SLOW_CALL", BREAKER_SLOW_CALL)
+        app.config.setdefault("BREAKER_SLOW_RATE", BREAKER_SLOW_RATE)
+        app.config.setdefault("BREAKER_OPEN_SECONDS", BREAKER_OPEN_SECONDS)
+        app.config.setdefault("BREAKER_HALF_OPEN_PROBES", BREAKER_HALF_OPEN_PROBES)
+
+        self.enabled = app.config["BREAKER_ENABLED"]
+        self.min_calls = app.config["BREAKER_MIN_CALLS"]
+        self.error_rate = app.config["BREAKER_ERROR_RATE"]
+        self.slow_call = app.config["BREAKER_SLOW_CALL"]
+        self.slow_rate = app.config["BREAKER_SLOW_RATE"]
+        self.open_seconds = app.config["BREAKER_OPEN_SECONDS"]
+        self.probes = app.config["BREAKER_HALF_OPEN_PROBES"]
+        window = app.config["BREAKER_WINDOW"]
+        if app.config["BREAKER_REDIS_URL"]:
+            self.state = RedisState(app.config["BREAKER_REDIS_URL"], self.name, window)
+        else:
+            self.state = MemoryState(window)
+        metrics.set_gauge(f"breaker.{self.name}.state", CLOSED)
+        app.extensions[f"breaker.{self.name}"] = self
+
+    def call(self, func, *args, failure=_server_error, **kwargs):
+        """
+        Call func(*args, **kwargs) through the breaker. Exceptions and results
+        for which failure(result) is true count as errors.
+        """
+        if not self.enabled:
+            return func(*args, **kwargs)
+
+        probe = self._admit()
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self._record(probe, True, time.perf_counter() - start)
+            raise
+        self._record(probe, failure(result), time.perf_counter() - start)
+        return result
+
+    def _admit(self):
+        """Whether the call is a half-open probe; raises CircuitOpenError if it may not go ahead."""
+        now = time.time()
+        open_until = self.state.open_until()
+        if open_until is None:
+            return False
+        if now < open_until:
+            self._reject(open_until - now)
+        if not self.state.claim_probe(now, self.probe_hold):
+            self._reject(1, HALF_OPEN)  # another worker's probe is in flight
+        metrics.incr(f"breaker.{self.name}.probes")
+        metrics.set_gauge(f"breaker.{self.name}.state", HALF_OPEN)
+        return True
+
+    def _reject(self, retry_after, state=OPEN):
+        metrics.incr(f"breaker.{self.name}.rejected")
+        metrics.set_gauge(f"breaker.{self.name}.state", state)
+        raise CircuitOpenError(self.name, retry_after)
+
+    def _record(self, probe, failed, elapsed):
+        slow = elapsed >= self.slow_call
+        metrics.incr(f"breaker.{self.name}.calls")
+        if failed:
+            metrics.incr(f"breaker.{self.name}.failures")
+        if slow:
+            metrics.incr(f"breaker.{self.name}.slow")
+
+        if probe:
+            if failed or slow:
+                self._trip("half-open probe failed")
+            elif self.state.probe_succeeded() >= self.probes:
+                self.state.close()
+                metrics.set_gauge(f"breaker.{self.name}.state", CLOSED)
+                logger.info(f"Circuit {self.name} closed after {self.probes} healthy probes")
+            return
+
+        totals = self.state.record(time.time(), failed, slow)
+        if totals is None:
+            return
+        calls, failures, slow_calls = totals
+        if calls >= self.min_calls:
+            if failures >= calls * self.error_rate:
+                self._trip(f"{failures}/{calls} calls failed")
+            elif slow_calls >= calls * self.slow_rate:
+                self._trip(f"{slow_calls}/{calls} calls took over {self.slow_call:g}s")
+
+    def _trip(self, reason):
+        self.state.trip(time.time() + self.open_seconds)
+        metrics.incr(f"breaker.{self.name}.opened")
+        metrics.set_gauge(f"breaker.{self.name}.state", OPEN)
+        logger.warning(f"Circuit {self.name} opened for {self.open_seconds:g}s: {reason}")
+
+
+# OAuth, STK push and STK query all go to the same Daraja gateway, so they share one circuit
+daraja_breaker = CircuitBreaker("daraja")
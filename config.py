@@ -1,5 +1,6 @@
 # config.py
 import os
+import platform
 from dotenv import load_dotenv
 
 # Load environment variables from the .env file
@@ -14,8 +15,87 @@ SHORTCODE = os.getenv("SHORTCODE")
 TILL_NUMBER= os.getenv("TILL_NUMBER")
 CALLBACK_URL = os.getenv("CALLBACK_URL")
 STK_PUSH_URL=os.getenv("STK_PUSH_URL")
+STK_QUERY_URL = os.getenv("STK_QUERY_URL", "https://api.safaricom.co.ke/mpesa/stkpushquery/v1/query")
 OAUTH_URL = os.getenv("OAUTH_URL")
 
+# Run db.create_all() when the app is created (set to false on workers once `flask init-db` has run)
+AUTO_CREATE_TABLES = os.getenv("AUTO_CREATE_TABLES", "true").lower() == "true"
+
+# Rate limiting (set RATELIMIT_REDIS_URL to share buckets across workers)
+RATELIMIT_ENABLED = os.getenv("RATELIMIT_ENABLED", "true").lower() == "true"
+RATELIMIT_REDIS_URL = os.getenv("RATELIMIT_REDIS_URL")
+
+# Multi-site sync: "standalone" (default), "edge" (local DB, syncs to central) or "central".
+# Edge and central nodes refuse to start without the shared SYNC_TOKEN.
+NODE_ROLE = os.getenv("NODE_ROLE", "standalone")
+NODE_ID = os.getenv("NODE_ID", "central" if NODE_ROLE == "central" else platform.node())
+SYNC_CENTRAL_URL = os.getenv("SYNC_CENTRAL_URL")
+SYNC_TOKEN = os.getenv("SYNC_TOKEN")
+SYNC_INTERVAL = float(os.getenv("SYNC_INTERVAL", "10"))
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", "500"))
+
+# Per-request SQL profiling (X-DB-Queries header and /debug/queries); off in production
+QUERY_PROFILER = os.getenv("QUERY_PROFILER", "false").lower() == "true"
+QUERY_PROFILER_N_PLUS_ONE = int(os.getenv("QUERY_PROFILER_N_PLUS_ONE", "3"))
+
+# HLS output of `flask package-movies` and the in-memory hot-segment cache size
+HLS_FOLDER = os.getenv("HLS_FOLDER", "static/hls/")
+HLS_CACHE_MB = int(os.getenv("HLS_CACHE_MB", "256"))
+
+# Movie catalog: posters and metadata written by the background describer, and the page size
+CATALOG_FOLDER = os.getenv("CATALOG_FOLDER", "static/catalog/")
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "24"))
+
+# Bloom filter of issued voucher codes; unknown codes are rejected before the voucher lookup
+VOUCHER_FILTER_ENABLED = os.getenv("VOUCHER_FILTER_ENABLED", "true").lower() == "true"
+VOUCHER_FILTER_FP_RATE = float(os.getenv("VOUCHER_FILTER_FP_RATE", "0.01"))
+VOUCHER_FILTER_REBUILD = float(os.getenv("VOUCHER_FILTER_REBUILD", "3600"))  # seconds between full rebuilds
+VOUCHER_FILTER_REFRESH = float(os.getenv("VOUCHER_FILTER_REFRESH", "1"))  # min seconds between miss-driven refreshes
+
+# Router byte-counter ingestion: shared token (required; /usage/counters rejects every push
+# without one), seconds between batched writes, and how long a cut-off MAC keeps being
+# reported back to the router
+USAGE_TOKEN = os.getenv("USAGE_TOKEN")
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "2"))
+USAGE_CUTOFF_WINDOW = int(os.getenv("USAGE_CUTOFF_WINDOW", "60"))
+
+# Daraja gateway: request timeout, and the circuit breaker that fails payments fast while it is down.
+# The circuit opens when, over the last BREAKER_WINDOW seconds and at least BREAKER_MIN_CALLS calls,
+# the share of errors or of calls slower than BREAKER_SLOW_CALL seconds reaches its rate; it stays
+# open BREAKER_OPEN_SECONDS, then closes after BREAKER_HALF_OPEN_PROBES healthy probe calls.
+# BREAKER_REDIS_URL (defaults to RATELIMIT_REDIS_URL) shares the circuit across workers.
+DARAJA_TIMEOUT = float(os.getenv("DARAJA_TIMEOUT", "10"))
+BREAKER_ENABLED = os.getenv("BREAKER_ENABLED", "true").lower() == "true"
+BREAKER_REDIS_URL = os.getenv("BREAKER_REDIS_URL", RATELIMIT_REDIS_URL)
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "30"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_CALL = float(os.getenv("BREAKER_SLOW_CALL", "5"))
+BREAKER_SLOW_RATE = float(os.getenv("BREAKER_SLOW_RATE", "0.5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", "2"))
+
+# Retention: rows older than RETENTION_DAYS move out of the live tables into monthly archive tables,
+# in ARCHIVE_DATABASE_URI if set (e.g. an SQLite file on cheap storage), else in the main database
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "90"))
+ARCHIVE_DATABASE_URI = os.getenv("ARCHIVE_DATABASE_URI")
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))
+
+# Ad impression/click beacons: events buffered in memory (oldest overwritten, and counted, once
+# ADS_BUFFER_SIZE is reached) and written as per-ad hourly counters every ADS_FLUSH_INTERVAL seconds
+ADS_BUFFER_SIZE = int(os.getenv("ADS_BUFFER_SIZE", "200000"))
+ADS_FLUSH_INTERVAL = float(os.getenv("ADS_FLUSH_INTERVAL", "5"))
+
+# Read routing: the read-only blueprints (admin lists and reports) query REPLICA_DATABASE_URI, e.g. a
+# Postgres streaming replica. On SQLite without one, READ_ROUTING switches the database to WAL and
+# reads through a separate read-only pool on the same file, so admin scans never block payment writes.
+# A read-only route falls back to the primary while the replica is more than REPLICA_MAX_LAG seconds
+# behind (routes can tighten this); the lag is measured at most every REPLICA_LAG_CHECK seconds.
+READ_ROUTING = os.getenv("READ_ROUTING", "true").lower() == "true"
+REPLICA_DATABASE_URI = os.getenv("REPLICA_DATABASE_URI")
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "30"))
+REPLICA_LAG_CHECK = float(os.getenv("REPLICA_LAG_CHECK", "1"))
+
 class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv(
         "SQLALCHEMY_DATABASE_URI",
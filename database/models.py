@@ -1,9 +1,29 @@
+from flask import g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.dml import UpdateBase
 from datetime import datetime
-import pytz
+from zoneinfo import ZoneInfo
 
-db = SQLAlchemy()
-nairobi_tz = pytz.timezone("Africa/Nairobi")
+
+class RoutingSession(Session):
+    """
+    Sends reads to the "replica" bind during requests the read router marked
+    read-only (see readreplica.py). Flushes and explicit write statements,
+    and every session outside such a request, stay on the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and not isinstance(clause, UpdateBase)
+                and has_app_context() and g.get("read_replica")):
+            replica = db.engines.get("replica")
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+nairobi_tz = ZoneInfo("Africa/Nairobi")
 
 
 def nairobi_now():
@@ -27,7 +47,8 @@ class Client(db.Model):
     __tablename__ = 'client'
     id = db.Column(db.Integer, primary_key=True)
     mac_address = db.Column(db.String(50), unique=True, nullable=False)
-    voucher_id = db.Column(db.Integer, db.ForeignKey('voucher.id'))
+    # Indexed for retention, which only archives vouchers no device is still bound to
+    voucher_id = db.Column(db.Integer, db.ForeignKey('voucher.id'), index=True)
     connected_at = db.Column(db.DateTime(timezone=True), default=nairobi_now)
 
     voucher = db.relationship("Voucher", backref="client")
@@ -35,6 +56,13 @@ class Client(db.Model):
 
 class PaymentTransaction(db.Model):
     __tablename__ = 'payment_transactions'
+    __table_args__ = (
+        # Lets the reconciler find stale PENDING rows without scanning the table
+        db.Index("ix_payment_transactions_status_created_at", "status", "created_at"),
+        # validate_voucher looks up successful transactions by receipt; covering both columns keeps
+        # SQLite from picking the status index instead (which matches ~90% of rows)
+        db.Index("ix_payment_transactions_receipt_number_status", "receipt_number", "status"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     checkout_request_id = db.Column(db.String(255), nullable=False, unique=True)
@@ -47,5 +75,73 @@ class PaymentTransaction(db.Model):
     created_at = db.Column(db.DateTime(timezone=True), default=nairobi_now)
 
 
+class RevenueRollup(db.Model):
+    """Payments per Nairobi hour, final status and package price; maintained by apply_stk_result and sync merges."""
+    __tablename__ = 'revenue_rollup'
+
+    hour = db.Column(db.DateTime, primary_key=True)
+    status = db.Column(db.String(50), primary_key=True)
+    amount = db.Column(db.Float, primary_key=True)
+    transactions = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+
+class UsageRollup(db.Model):
+    """Voucher redemptions per Nairobi hour and voucher price; maintained by validate_voucher and sync merges."""
+    __tablename__ = 'usage_rollup'
+
+    hour = db.Column(db.DateTime, primary_key=True)
+    price = db.Column(db.Float, primary_key=True)
+    redemptions = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DataUsage(db.Model):
+    """Bytes used by a voucher's session, flushed in batches from router counters, against its bundle quota."""
+    __tablename__ = 'data_usage'
+
+    voucher_id = db.Column(db.Integer, db.ForeignKey('voucher.id'), primary_key=True)
+    mac_address = db.Column(db.String(50), nullable=True)
+    bytes_in = db.Column(db.BigInteger, nullable=False, default=0)
+    bytes_out = db.Column(db.BigInteger, nullable=False, default=0)
+    quota_bytes = db.Column(db.BigInteger, nullable=True)  # None: no data cap
+    cut_off_at = db.Column(db.DateTime(timezone=True), nullable=True, index=True)
+    updated_at = db.Column(db.DateTime(timezone=True), default=nairobi_now)
+
+    voucher = db.relationship("Voucher", backref=db.backref("usage", uselist=False))
+
+
+class AdStat(db.Model):
+    """Ad impressions and clicks per Nairobi hour, flushed in batches from the success page's beacons."""
+    __tablename__ = 'ad_stats'
+
+    ad = db.Column(db.String(255), primary_key=True)
+    hour = db.Column(db.DateTime, primary_key=True)
+    impressions = db.Column(db.BigInteger, nullable=False, default=0)
+    clicks = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class ChangeLog(db.Model):
+    """Row-level changes to vouchers, clients and payments, replayed between edge and central nodes."""
+    __tablename__ = 'change_log'
+    # AUTOINCREMENT keeps seq monotonic on SQLite even after old entries are pruned
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq = db.Column(db.Integer, primary_key=True)
+    origin = db.Column(db.String(64), nullable=False)
+    entity = db.Column(db.String(32), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), default=nairobi_now)
+
+
+class SyncState(db.Model):
+    """Sync cursors: last change sequence pushed/pulled by an edge, or applied per edge on central."""
+    __tablename__ = 'sync_state'
+
+    name = db.Column(db.String(128), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+
 # Explicitly expose the models for import
-__all__ = ["Voucher", "Client", "PaymentTransaction", "db"]
+__all__ = ["Voucher", "Client", "PaymentTransaction", "RevenueRollup", "UsageRollup", "DataUsage", "AdStat", "ChangeLog", "SyncState",
+           "db"]
@@ -0,0 +1,387 @@
+# edgesync.py
+import json
+import logging
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import click
+from flask import current_app, has_app_context
+from flask.cli import with_appcontext
+from sqlalchemy import event, func, select
+
+import metrics
+from config import NODE_ROLE, NODE_ID, SYNC_CENTRAL_URL, SYNC_TOKEN, SYNC_INTERVAL, SYNC_BATCH_SIZE
+from database.models import db, Voucher, Client, PaymentTransaction, ChangeLog, SyncState, nairobi_tz
+from rollups import record_payment, record_redemption
+
+logger = logging.getLogger(__name__)
+
+# Entity name -> (model, natural key). Row ids differ between nodes, so changes travel by natural key.
+SYNCED = {
+    "voucher": (Voucher, "code"),
+    "client": (Client, "mac_address"),
+    "payment": (PaymentTransaction, "checkout_request_id"),
+}
+ENTITY_BY_MODEL = {model: entity for entity, (model, _) in SYNCED.items()}
+
+_listening = False
+# Serializes pushes within a central worker; SQLite would otherwise merge against a stale snapshot
+_apply_lock = threading.Lock()
+
+# Advisory lock key that orders change_log appends on Postgres (see _serialize_appends)
+CHANGE_LOG_LOCK = 0x5D1C
+
+# Payment status only moves forward, whichever node hears about it first
+STATUS_RANK = {"PENDING": 0, "FAILED": 1, "SUCCESS": 2}
+
+
+def _naive(value):
+    """Compare datetimes as Nairobi wall-clock time; SQLite hands them back without tzinfo."""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(nairobi_tz).replace(tzinfo=None)
+    return value
+
+
+def _dump_time(value):
+    value = _naive(value)
+    return value.isoformat() if value else None
+
+
+def _load_time(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def serialize(obj, connection=None):
+    """Natural-keyed snapshot of a synced row."""
+    if isinstance(obj, Voucher):
+        return {"code": obj.code, "is_used": bool(obj.is_used), "price": obj.price,
+                "created_at": _dump_time(obj.created_at), "expiry_time": _dump_time(obj.expiry_time)}
+    if isinstance(obj, Client):
+        voucher_code = None
+        if obj.voucher_id is not None:
+            # Inside a flush, read the code through the flush's own connection
+            query = select(Voucher.code).where(Voucher.id == obj.voucher_id)
+            voucher_code = (connection or db.session).execute(query).scalar()
+        return {"mac_address": obj.mac_address, "voucher_code": voucher_code,
+                "connected_at": _dump_time(obj.connected_at)}
+    return {"checkout_request_id": obj.checkout_request_id, "merchant_request_id": obj.merchant_request_id,
+            "receipt_number": obj.receipt_number, "amount": obj.amount, "status": obj.status,
+            "phone_number": obj.phone_number, "description": obj.description,
+            "created_at": _dump_time(obj.created_at)}
+
+
+def _serialize_appends(connection):
+    """
+    Postgres hands out seq values at insert time, so concurrent writers could
+    commit seq N+1 before N and a reader's cursor would move past N for good.
+    Holding a transaction-scoped advisory lock from the first append until
+    commit makes entries become visible in seq order. SQLite already allows
+    only one writer at a time.
+    """
+    if connection.dialect.name != "postgresql":
+        return
+    transaction = connection.get_transaction()
+    if connection.info.get("change_log_locked") is not transaction:
+        connection.execute(select(func.pg_advisory_xact_lock(CHANGE_LOG_LOCK)))
+        connection.info["change_log_locked"] = transaction
+
+
+def log_change(connection, origin, entity, key, payload):
+    _serialize_appends(connection)
+    connection.execute(ChangeLog.__table__.insert(), {
+        "origin": origin, "entity": entity, "key": key,
+        "payload": json.dumps(payload), "created_at": datetime.now(nairobi_tz)})
+
+
+def record_changes(session, flush_context):
+    """after_flush hook: append every voucher/client/payment write to the change log in the same transaction."""
+    if session.info.get("sync_applying") or not has_app_context():
+        return
+    if current_app.config.get("NODE_ROLE") not in ("edge", "central"):
+        return
+
+    connection = session.connection()
+    origin = current_app.config["NODE_ID"]
+    for obj in list(session.new) + list(session.dirty):
+        entity = ENTITY_BY_MODEL.get(type(obj))
+        if entity is None or (obj in session.dirty and not session.is_modified(obj)):
+            continue
+        key = getattr(obj, SYNCED[entity][1])
+        log_change(connection, origin, entity, key, serialize(obj, connection))
+
+
+def _merge_voucher(voucher, incoming):
+    conflict = False
+    expiry = _load_time(incoming["expiry_time"])
+    if incoming["is_used"]:
+        if voucher.is_used and voucher.expiry_time and expiry:
+            # Redeemed on two nodes while apart: the earlier redemption (earlier expiry) wins
+            conflict = _naive(expiry) != _naive(voucher.expiry_time)
+            if _naive(expiry) < _naive(voucher.expiry_time):
+                voucher.expiry_time = expiry
+        elif not voucher.is_used:
+            voucher.is_used = True
+            voucher.expiry_time = expiry
+    return conflict
+
+
+def _merge_client(client, incoming):
+    connected_at = _load_time(incoming["connected_at"])
+    if client.connected_at is None or (connected_at and _naive(connected_at) > _naive(client.connected_at)):
+        client.connected_at = connected_at
+        client.voucher_id = _voucher_id(incoming["voucher_code"])
+    return False
+
+
+def _merge_payment(payment, incoming):
+    if STATUS_RANK.get(incoming["status"], 0) > STATUS_RANK.get(payment.status, 0):
+        payment.status = incoming["status"]
+        payment.description = incoming["description"]
+    payment.receipt_number = payment.receipt_number or incoming["receipt_number"]
+    return False
+
+
+def _voucher_id(code):
+    if code is None:
+        return None
+    return db.session.execute(select(Voucher.id).where(Voucher.code == code)).scalar()
+
+
+def _create(entity, incoming):
+    if entity == "voucher":
+        return Voucher(code=incoming["code"], is_used=incoming["is_used"], price=incoming["price"],
+                       created_at=_load_time(incoming["created_at"]),
+                       expiry_time=_load_time(incoming["expiry_time"]))
+    if entity == "client":
+        return Client(mac_address=incoming["mac_address"], voucher_id=_voucher_id(incoming["voucher_code"]),
+                      connected_at=_load_time(incoming["connected_at"]))
+    fields = dict(incoming, created_at=_load_time(incoming["created_at"]))
+    return PaymentTransaction(**fields)
+
+
+MERGERS = {"voucher": _merge_voucher, "client": _merge_client, "payment": _merge_payment}
+
+
+def apply_change(entity, incoming):
+    """Merge a remote change into the local row; returns (row, conflict). Caller commits."""
+    model, key_attr = SYNCED[entity]
+    # FOR UPDATE so concurrent pushes from two edges merge one after the other on Postgres
+    row = model.query.filter_by(**{key_attr: incoming[key_attr]}).with_for_update().first()
+    if row is None:
+        row, conflict = _create(entity, incoming), False
+        db.session.add(row)
+        previous = None
+    else:
+        previous = (row.status if entity == "payment" else
+                    (row.is_used, row.expiry_time) if entity == "voucher" else None)
+        conflict = MERGERS[entity](row, incoming)
+    # Sales and redemptions made on other nodes count in this node's rollups too
+    if entity == "payment":
+        record_payment(row, previous)
+    elif entity == "voucher" and row.is_used and row.expiry_time is not None:
+        was_used, previous_expiry = previous or (False, None)
+        if not was_used or previous_expiry is None:
+            record_redemption(row)
+        elif _naive(previous_expiry) != _naive(row.expiry_time):
+            record_redemption(row, previous_expiry)
+    return row, conflict
+
+
+def pack(document):
+    return zlib.compress(json.dumps(document, separators=(",", ":")).encode(), 6)
+
+
+def unpack(data):
+    return json.loads(zlib.decompress(data))
+
+
+def _cursor(name):
+    state = db.session.get(SyncState, name)
+    return state.value if state else 0
+
+
+def _set_cursor(name, value):
+    state = db.session.get(SyncState, name) or SyncState(name=name)
+    state.value = value
+    db.session.add(state)
+
+
+def apply_pushed_changes(node, changes):
+    """Central side of a push; idempotent per edge sequence number. Returns (acked, conflicts)."""
+    cursor_name = f"applied:{node}"
+    conflicts = []
+    with _apply_lock:
+        acked = _apply_pushed(node, cursor_name, changes, conflicts)
+    metrics.incr("sync.applied", len(changes))
+    metrics.incr("sync.conflicts", len(conflicts))
+    return acked, conflicts
+
+
+def _apply_pushed(node, cursor_name, changes, conflicts):
+    acked = _cursor(cursor_name)
+    db.session.info["sync_applying"] = True
+    try:
+        connection = db.session.connection()
+        for change in changes:
+            if change["seq"] <= acked:
+                continue
+            row, conflict = apply_change(change["entity"], change["payload"])
+            db.session.flush()
+            # Re-log the merged row for the other edges; a conflict is logged as central's
+            # decision so the edge that lost also pulls the winning state
+            origin = current_app.config["NODE_ID"] if conflict else node
+            log_change(connection, origin, change["entity"], change["key"], serialize(row, connection))
+            if conflict:
+                conflicts.append(change["key"])
+            acked = change["seq"]
+        _set_cursor(cursor_name, acked)
+        db.session.commit()
+    finally:
+        db.session.info.pop("sync_applying", None)
+    return acked
+
+
+def changes_since(since, limit, exclude_origin=None):
+    query = ChangeLog.query.filter(ChangeLog.seq > since)
+    if exclude_origin:
+        query = query.filter(ChangeLog.origin != exclude_origin)
+    return query.order_by(ChangeLog.seq).limit(limit).all()
+
+
+class EdgeSync:
+    """Pushes the local change log to the central node and pulls everyone else's changes."""
+
+    def __init__(self, app):
+        self.app = app
+        self.central_url = app.config["SYNC_CENTRAL_URL"].rstrip("/")
+        self.node = app.config["NODE_ID"]
+        self.batch_size = app.config["SYNC_BATCH_SIZE"]
+        self.headers = {"Content-Type": "application/octet-stream", "X-Sync-Node": self.node,
+                        "X-Sync-Token": app.config["SYNC_TOKEN"]}
+
+    def push(self, session):
+        """Send unpushed local changes in compressed batches; returns how many were acknowledged."""
+        pushed = 0
+        while True:
+            since = _cursor("pushed")
+            entries = (ChangeLog.query.filter(ChangeLog.seq > since, ChangeLog.origin == self.node)
+                       .order_by(ChangeLog.seq).limit(self.batch_size).all())
+            if not entries:
+                break
+            body = pack({"node": self.node, "changes": [
+                {"seq": e.seq, "entity": e.entity, "key": e.key, "payload": json.loads(e.payload)}
+                for e in entries]})
+            response = session.post(f"{self.central_url}/sync/push", data=body, headers=self.headers, timeout=30)
+            response.raise_for_status()
+            result = unpack(response.content)
+            _set_cursor("pushed", result["acked"])
+            db.session.commit()
+            pushed += len(entries)
+            metrics.incr("sync.pushed", len(entries))
+            metrics.incr("sync.push_bytes", len(body))
+            if result["conflicts"]:
+                logger.warning(f"Central resolved sync conflicts for: {', '.join(result['conflicts'])}")
+        return pushed
+
+    def pull(self, session):
+        """Apply other nodes' changes from central, in sequence order; returns how many were applied."""
+        pulled = 0
+        while True:
+            since = _cursor("pulled")
+            response = session.get(f"{self.central_url}/sync/pull", headers=self.headers, timeout=30,
+                                   params={"since": since, "limit": self.batch_size, "node": self.node})
+            response.raise_for_status()
+            result = unpack(response.content)
+            if not result["changes"]:
+                _set_cursor("pulled", max(since, result["last_seq"]))
+                db.session.commit()
+                break
+
+            db.session.info["sync_applying"] = True
+            try:
+                for change in result["changes"]:
+                    apply_change(change["entity"], change["payload"])
+                    db.session.flush()
+                _set_cursor("pulled", result["changes"][-1]["seq"])
+                db.session.commit()
+            finally:
+                db.session.info.pop("sync_applying", None)
+            pulled += len(result["changes"])
+            metrics.incr("sync.pulled", len(result["changes"]))
+        return pulled
+
+    def sync_once(self):
+        import requests  # Deferred like every other outbound HTTP call
+
+        with self.app.app_context(), requests.Session() as session:
+            try:
+                pushed = self.push(session)
+                pulled = self.pull(session)
+            except (requests.RequestException, zlib.error) as e:
+                # Uplink down: keep serving from the local database and retry next round
+                db.session.rollback()
+                metrics.incr("sync.link_down")
+                logger.warning(f"Sync with {self.central_url} failed, will retry: {e}")
+                return None
+            backlog = (db.session.query(func.count(ChangeLog.seq))
+                       .filter(ChangeLog.seq > _cursor("pushed"), ChangeLog.origin == self.node).scalar())
+            metrics.set_gauge("sync.backlog", backlog)
+            metrics.set_gauge("sync.last_success", time.time())
+            return pushed, pulled
+
+    def run_forever(self, interval):
+        while True:
+            self.sync_once()
+            time.sleep(interval)
+
+    def start(self, interval):
+        thread = threading.Thread(target=self.run_forever, args=(interval,), name="edge-sync", daemon=True)
+        thread.start()
+        return thread
+
+
+def init_sync(app):
+    global _listening
+
+    app.config.setdefault("NODE_ROLE", NODE_ROLE)
+    app.config.setdefault("NODE_ID", NODE_ID)
+    app.config.setdefault("SYNC_CENTRAL_URL", SYNC_CENTRAL_URL)
+    app.config.setdefault("SYNC_TOKEN", SYNC_TOKEN)
+    app.config.setdefault("SYNC_INTERVAL", SYNC_INTERVAL)
+    app.config.setdefault("SYNC_BATCH_SIZE", SYNC_BATCH_SIZE)
+
+    role = app.config["NODE_ROLE"]
+    if role not in ("edge", "central"):
+        return
+
+    # /sync/push writes vouchers and payments, so it is never left open
+    if not app.config["SYNC_TOKEN"]:
+        raise ValueError(f"🚨 NODE_ROLE={role} needs SYNC_TOKEN")
+
+    if not _listening:
+        event.listen(db.session, "after_flush", record_changes)
+        _listening = True
+
+    if role == "central":
+        from routes.sync import sync_bp
+        app.register_blueprint(sync_bp, url_prefix="/sync")
+        return
+
+    if not app.config["SYNC_CENTRAL_URL"]:
+        raise ValueError("🚨 NODE_ROLE=edge needs SYNC_CENTRAL_URL")
+    app.extensions["edge_sync"] = EdgeSync(app)
+    app.cli.add_command(sync_command)
+    if app.config["SYNC_INTERVAL"] > 0 and not app.config.get("TESTING"):
+        app.extensions["edge_sync"].start(app.config["SYNC_INTERVAL"])
+
+
+@click.command("sync-now")
+@with_appcontext
+def sync_command():
+    """Push local changes to the central node and pull everyone else's."""
+    result = current_app.extensions["edge_sync"].sync_once()
+    if result is None:
+        raise click.ClickException("Central node unreachable")
+    click.echo(f"Pushed {result[0]} changes, pulled {result[1]}")
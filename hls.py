@@ -0,0 +1,265 @@
+# hls.py
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MOVIE_EXTENSIONS = (".mp4", ".mkv", ".avi")
+
+# name, height, video bitrate, audio bitrate; the player switches between them as the link allows
+RENDITIONS = (
+    ("240p", 240, "400k", "64k"),
+    ("480p", 480, "1000k", "96k"),
+    ("720p", 720, "2500k", "128k"),
+)
+SEGMENT_SECONDS = 6
+
+# hls.js for browsers without native HLS (e.g. Android Chrome), relative to static/; the portal
+# serves it because captive-portal clients cannot reach a CDN. `flask fetch-hls-js` (also run by
+# package-movies) installs the pinned release; players fall back to the original file without it.
+HLS_JS = "vendor/hls.min.js"
+HLS_JS_VERSION = "1.5.17"
+HLS_JS_SOURCE = f"https://cdn.jsdelivr.net/npm/hls.js@{HLS_JS_VERSION}/dist/hls.min.js"
+
+
+def movie_id(filename):
+    """
+    URL-safe id for a movie file, stable across packaging runs. The readable
+    slug is suffixed with a short hash of the whole filename, so files that
+    only differ in extension, case or punctuation (Film.mp4, Film.mkv) get
+    their own directories.
+    """
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "-", os.path.splitext(filename)[0]).strip("-").lower()
+    digest = hashlib.sha1(filename.encode()).hexdigest()[:8]
+    return f"{slug}-{digest}" if slug else digest
+
+
+def segment_path(root, digest):
+    return os.path.join(root, "segments", digest[:2], f"{digest}.ts")
+
+
+def _bandwidth(video, audio):
+    return (int(video[:-1]) + int(audio[:-1])) * 1000
+
+
+def _store_segments(root, workdir, playlist):
+    """Move each segment into the content-addressed store and point the playlist at it."""
+    lines = []
+    with open(os.path.join(workdir, playlist)) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                source = os.path.join(workdir, line)
+                with open(source, "rb") as segment:
+                    digest = hashlib.sha256(segment.read()).hexdigest()
+                target = segment_path(root, digest)
+                if os.path.exists(target):
+                    os.remove(source)  # identical bytes are already stored (e.g. black frames, repeated intros)
+                else:
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.move(source, target)
+                line = f"/hls/segments/{digest}.ts"
+            lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def package_movie(source, root):
+    """
+    Transcode one movie into HLS renditions (runs in a worker process). Skips
+    files whose size and mtime match the last packaging run.
+    """
+    stat = os.stat(source)
+    fingerprint = {"size": stat.st_size, "mtime": int(stat.st_mtime)}
+    movie_dir = os.path.join(root, movie_id(os.path.basename(source)))
+    manifest = os.path.join(movie_dir, "source.json")
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            if json.load(f) == fingerprint:
+                return source, False
+
+    with tempfile.TemporaryDirectory(dir=root) as workdir:
+        master = ["#EXTM3U", "#EXT-X-VERSION:3"]
+        playlists = {}
+        for name, height, video, audio in RENDITIONS:
+            subprocess.run([
+                "ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-i", source,
+                "-map", "0:v:0", "-map", "0:a:0?",
+                "-vf", f"scale=-2:{height}", "-c:v", "libx264", "-preset", "veryfast", "-profile:v", "main",
+                "-b:v", video, "-maxrate", video, "-bufsize", video,
+                # Keyframe at every segment boundary so renditions can switch cleanly
+                "-force_key_frames", f"expr:gte(t,n_forced*{SEGMENT_SECONDS})",
+                "-c:a", "aac", "-b:a", audio, "-ac", "2",
+                "-f", "hls", "-hls_time", str(SEGMENT_SECONDS), "-hls_playlist_type", "vod",
+                "-hls_segment_filename", os.path.join(workdir, f"{name}_%05d.ts"),
+                os.path.join(workdir, f"{name}.m3u8"),
+            ], check=True)
+            playlists[name] = _store_segments(root, workdir, f"{name}.m3u8")
+            master.append(f"#EXT-X-STREAM-INF:BANDWIDTH={_bandwidth(video, audio)},RESOLUTION={height * 16 // 9}x{height}")
+            master.append(f"{name}.m3u8")
+
+        # Publish playlists only after every rendition is stored, then the manifest last
+        os.makedirs(movie_dir, exist_ok=True)
+        for name, text in playlists.items():
+            with open(os.path.join(movie_dir, f"{name}.m3u8"), "w") as f:
+                f.write(text)
+        with open(os.path.join(movie_dir, "master.m3u8"), "w") as f:
+            f.write("\n".join(master) + "\n")
+        with open(manifest, "w") as f:
+            json.dump(fingerprint, f)
+    return source, True
+
+
+def package_library(movie_folder, root, workers):
+    """Package every movie in the folder across a process pool; returns (packaged, skipped, failed)."""
+    from concurrent.futures import ProcessPoolExecutor, as_completed  # CLI only; keeps worker start-up lean
+
+    os.makedirs(root, exist_ok=True)
+    sources = [os.path.join(movie_folder, f) for f in sorted(os.listdir(movie_folder))
+               if f.lower().endswith(MOVIE_EXTENSIONS)]
+    packaged, skipped, failed = [], [], []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(package_movie, source, root): source for source in sources}
+        for future in as_completed(futures):
+            try:
+                _, changed = future.result()
+                (packaged if changed else skipped).append(futures[future])
+            except Exception as e:
+                logger.error(f"Failed to package {futures[future]}: {e}")
+                failed.append(futures[future])
+    return packaged, skipped, failed
+
+
+def hls_available(root, filename):
+    """The master playlist URL for a packaged movie, or None."""
+    mid = movie_id(filename)
+    if os.path.exists(os.path.join(root, mid, "master.m3u8")):
+        return f"/hls/{mid}/master.m3u8"
+    return None
+
+
+class SegmentCache:
+    """
+    In-memory LRU of hot segments, bounded in bytes. Concurrent misses on the
+    same segment wait for a single disk read, so a room full of phones watching
+    the same film costs one read per segment.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(self, digest, path):
+        with self._lock:
+            data = self._items.get(digest)
+            if data is not None:
+                self._items.move_to_end(digest)
+                metrics.incr("hls.cache_hits")
+                return data
+            loading = self._loading.get(digest)
+            leader = loading is None
+            if leader:
+                loading = self._loading[digest] = threading.Event()
+
+        if not leader:
+            loading.wait()
+            metrics.incr("hls.cache_coalesced")
+            with self._lock:
+                data = self._items.get(digest)
+            if data is not None:
+                return data
+            return self._read(path)  # too big to cache, or the leader's read failed
+
+        try:
+            data = self._read(path)
+            metrics.incr("hls.cache_misses")
+            with self._lock:
+                if len(data) <= self.max_bytes:
+                    self._items[digest] = data
+                    self.size += len(data)
+                    while self.size > self.max_bytes:
+                        _, evicted = self._items.popitem(last=False)
+                        self.size -= len(evicted)
+                        metrics.incr("hls.cache_evictions")
+                metrics.set_gauge("hls.cache_bytes", self.size)
+            return data
+        finally:
+            with self._lock:
+                self._loading.pop(digest, None)
+            loading.set()
+
+    @staticmethod
+    def _read(path):
+        with open(path, "rb") as f:
+            data = f.read()
+        metrics.incr("hls.disk_reads")
+        return data
+
+
+def fetch_hls_js(static_folder):
+    """Download the pinned hls.js into static/ unless it is already there; returns its path."""
+    import requests
+
+    path = os.path.join(static_folder, HLS_JS)
+    if os.path.exists(path):
+        return path
+    response = requests.get(HLS_JS_SOURCE, timeout=30)
+    response.raise_for_status()
+    if b"Hls" not in response.content:
+        raise ValueError(f"{HLS_JS_SOURCE} did not return hls.js")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename, so the portal never serves a half-written script
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as f:
+        f.write(response.content)
+    os.chmod(f.name, 0o644)
+    os.replace(f.name, path)
+    return path
+
+
+def _fetch_hls_js_or_fail():
+    import requests
+
+    try:
+        return fetch_hls_js(current_app.static_folder)
+    except (requests.RequestException, ValueError, OSError) as e:
+        raise click.ClickException(f"Could not install hls.js ({e}); download {HLS_JS_SOURCE} "
+                                   f"to static/{HLS_JS}, then rerun")
+
+
+@click.command("fetch-hls-js")
+@with_appcontext
+def fetch_hls_js_command():
+    """Install the hls.js player the movie page serves to browsers without native HLS."""
+    click.echo(f"hls.js {HLS_JS_VERSION} at {_fetch_hls_js_or_fail()}")
+
+
+@click.command("package-movies")
+@click.option("--workers", default=max(1, (os.cpu_count() or 2) - 1), help="Parallel ffmpeg processes.")
+@with_appcontext
+def package_command(workers):
+    """Package movies in the movie folder as multi-bitrate HLS, and install the hls.js player."""
+    if shutil.which("ffmpeg") is None:
+        raise click.ClickException("ffmpeg is not installed")
+    # Without the player, Android Chrome and most other browsers fall back to the original files
+    _fetch_hls_js_or_fail()
+    packaged, skipped, failed = package_library(current_app.config["MOVIE_FOLDER"],
+                                                current_app.config["HLS_FOLDER"], workers)
+    click.echo(f"Packaged {len(packaged)}, up to date {len(skipped)}, failed {len(failed)}")
+    if failed:
+        raise click.ClickException("Some movies failed to package: " + ", ".join(failed))
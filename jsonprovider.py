@@ -0,0 +1,104 @@
+# jsonprovider.py
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+
+import metrics
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib encoder gives the same output, only slower
+    orjson = None
+
+
+def _default(o):
+    # ISO 8601 for dates and datetimes, like orjson, instead of Flask's HTTP-date format
+    if isinstance(o, date):
+        return o.isoformat()
+    return DefaultJSONProvider.default(o)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by orjson when it is installed. Dates and
+    datetimes are encoded natively as ISO 8601 on both paths, so views can
+    hand rows' datetimes straight to jsonify.
+    """
+
+    default = staticmethod(_default)
+
+    def _pretty(self):
+        return self.compact is False or (self.compact is None and self._app.debug)
+
+    def _options(self):
+        options = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if self._pretty():
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=_default, option=self._options()).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def encode(self, obj):
+        """The JSON body for `obj` as bytes, newline-terminated like jsonify's."""
+        if orjson is None:
+            layout = {"indent": 2} if self._pretty() else {"separators": (",", ":")}
+            return (super().dumps(obj, **layout) + "\n").encode()
+        return orjson.dumps(obj, default=_default, option=self._options() | orjson.OPT_APPEND_NEWLINE)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.encode(obj), mimetype=self.mimetype)
+
+
+def json_body(body, status=200):
+    """A response for an already-encoded JSON body."""
+    return current_app.response_class(body, status=status, mimetype="application/json")
+
+
+class EncodedCache:
+    """
+    Small LRU of pre-encoded JSON bodies for hot responses that rarely change.
+    An entry is reused while its version matches (e.g. a folder's mtime) and
+    its TTL, if any, has not run out.
+    """
+
+    def __init__(self, name, max_entries=10000):
+        self.name = name
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                cached_version, expires, body = item
+                if cached_version == version and (expires is None or expires > time.monotonic()):
+                    self._items.move_to_end(key)
+                    metrics.incr(f"{self.name}.hits")
+                    return body
+                del self._items[key]
+        metrics.incr(f"{self.name}.misses")
+        return None
+
+    def put(self, key, body, version=None, ttl=None):
+        with self._lock:
+            self._items[key] = (version, None if ttl is None else time.monotonic() + ttl, body)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+        return body
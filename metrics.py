@@ -0,0 +1,23 @@
+# metrics.py
+import threading
+from collections import defaultdict
+
+# Process-local counters and gauges, exposed as JSON on /metrics
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def snapshot():
+    with _lock:
+        return {"counters": dict(_counters), "gauges": dict(_gauges)}
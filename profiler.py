@@ -0,0 +1,119 @@
+# profiler.py
+import re
+import threading
+import time
+from collections import Counter
+
+from flask import g, has_app_context, jsonify, request
+from sqlalchemy import event
+
+from config import QUERY_PROFILER, QUERY_PROFILER_N_PLUS_ONE
+from database.models import db
+
+# Reduce a statement to its shape so the same query with different values groups together
+_IN_LIST = re.compile(r"\bIN\s*\((?:[^()]|\([^()]*\))*\)", re.IGNORECASE)
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r"\s+")
+
+
+def statement_shape(statement):
+    shape = _IN_LIST.sub("IN (...)", statement)
+    shape = _LITERALS.sub("?", shape)
+    return _SPACES.sub(" ", shape).strip()
+
+
+class QueryProfiler:
+    """
+    Opt-in per-request SQL profiling: query count, DB time and repeated statement
+    shapes (N+1 patterns), reported in an X-DB-Queries header and on
+    /debug/queries. When disabled nothing is attached to the engine or the app.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.routes = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("QUERY_PROFILER", QUERY_PROFILER)
+        app.config.setdefault("QUERY_PROFILER_N_PLUS_ONE", QUERY_PROFILER_N_PLUS_ONE)
+        self.enabled = app.config["QUERY_PROFILER"]
+        if not self.enabled:
+            return
+
+        self.n_plus_one = app.config["QUERY_PROFILER_N_PLUS_ONE"]
+        with app.app_context():
+            for engine in db.engines.values():
+                self.watch(engine)
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule("/debug/queries", "debug_queries", self.summary_view)
+        app.extensions["query_profiler"] = self
+
+    def watch(self, engine):
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+
+    @staticmethod
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @staticmethod
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = g.get("query_stats") if has_app_context() else None
+        if stats is not None:
+            stats["count"] += 1
+            stats["seconds"] += elapsed
+            stats["shapes"][statement_shape(statement)] += 1
+
+    @staticmethod
+    def _start_request():
+        g.query_stats = {"count": 0, "seconds": 0.0, "shapes": Counter()}
+
+    def _finish_request(self, response):
+        stats = g.pop("query_stats", None)
+        if stats is None:
+            return response
+
+        repeated = {shape: count for shape, count in stats["shapes"].items()
+                    if count >= self.n_plus_one and shape.upper().startswith("SELECT")}
+        db_ms = stats["seconds"] * 1000
+        response.headers["X-DB-Queries"] = f"{stats['count']}; time={db_ms:.2f}ms; n+1={len(repeated)}"
+
+        route = request.endpoint or request.path
+        with self._lock:
+            summary = self.routes.setdefault(route, {
+                "requests": 0, "queries": 0, "max_queries": 0, "db_ms": 0.0, "n_plus_one": {}})
+            summary["requests"] += 1
+            summary["queries"] += stats["count"]
+            summary["max_queries"] = max(summary["max_queries"], stats["count"])
+            summary["db_ms"] += db_ms
+            for shape, count in repeated.items():
+                summary["n_plus_one"][shape] = max(summary["n_plus_one"].get(shape, 0), count)
+        return response
+
+    def summary_view(self):
+        """Per-route query summary, worst routes first."""
+        with self._lock:
+            routes = [
+                {
+                    "route": route,
+                    "requests": s["requests"],
+                    "avg_queries": round(s["queries"] / s["requests"], 2),
+                    "max_queries": s["max_queries"],
+                    "avg_db_ms": round(s["db_ms"] / s["requests"], 3),
+                    "n_plus_one": [{"statement": shape, "max_per_request": count}
+                                   for shape, count in s["n_plus_one"].items()],
+                }
+                for route, s in self.routes.items()
+            ]
+        # A list, since jsonify sorts object keys and would lose the order
+        routes.sort(key=lambda entry: entry["avg_db_ms"], reverse=True)
+        return jsonify({"status": "success", "routes": routes})
+
+
+query_profiler = QueryProfiler()
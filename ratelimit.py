@@ -0,0 +1,232 @@
+# ratelimit.py
+import math
+import re
+import threading
+import time
+import logging
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, jsonify
+from config import RATELIMIT_ENABLED, RATELIMIT_REDIS_URL
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    """In-process token buckets, one per key. Cheap enough to run on every request."""
+
+    # Evict least recently used buckets once the table holds this many keys
+    MAX_KEYS = 50000
+    # Most buckets one new key evicts, so eviction stays O(1) per request
+    EVICT_BATCH = 8
+
+    def __init__(self):
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, rate, burst, now):
+        """Take one token from the bucket; returns (allowed, retry_after_seconds)."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.MAX_KEYS:
+                    self._evict(now)
+                bucket = self._buckets[key] = [burst, now, rate, burst]
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return True, 0.0
+            return False, (1 - bucket[0]) / rate
+
+    def _evict(self, now):
+        # Always drop the least recently used bucket, so the table stays bounded even when
+        # every bucket is live, then up to EVICT_BATCH - 1 more that have refilled completely
+        # (an idle full bucket carries no state)
+        self._buckets.popitem(last=False)
+        for _ in range(self.EVICT_BATCH - 1):
+            if not self._buckets:
+                return
+            key = next(iter(self._buckets))
+            tokens, ts, rate, burst = self._buckets[key]
+            if tokens + (now - ts) * rate < burst:
+                return
+            del self._buckets[key]
+
+
+class RedisBackend:
+    """Token buckets shared by all workers through redis (one round trip per key)."""
+
+    SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(data[1]) or burst
+    local ts = tonumber(data[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url, prefix="ratelimit:"):
+        import redis  # Optional dependency, only needed for the shared backend
+
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+        self._prefix = prefix
+        self._fallback = MemoryBackend()
+
+    def consume(self, key, rate, burst, now):
+        try:
+            allowed, tokens = self._script(keys=[self._prefix + key], args=[rate, burst, now])
+        except Exception as e:
+            # Never block payments because redis is down; degrade to per-worker limits
+            logger.warning(f"Redis rate limit backend unavailable, using in-process buckets: {e}")
+            return self._fallback.consume(key, rate, burst, now)
+
+        if allowed:
+            return True, 0.0
+        return False, (1 - float(tokens)) / rate
+
+
+NON_DIGITS = re.compile(r"\D")
+
+
+def _client_ip(req):
+    return req.remote_addr or "unknown"
+
+
+def _client_mac(req):
+    data = req.get_json(silent=True) or {}
+    mac = data.get("mac_address") or req.args.get("mac") or req.headers.get("X-Client-MAC")
+    return mac.lower().replace("-", ":") if mac else None
+
+
+def _client_phone(req):
+    data = req.get_json(silent=True) or {}
+    phone = data.get("phone_number")
+    if not phone:
+        return None
+    # Key on the subscriber digits so 07.., 2547.. and +2547.. share one bucket
+    return NON_DIGITS.sub("", str(phone))[-9:] or None
+
+
+# Rules are checked in this order: a client already over its IP limit is turned away before
+# the keys it can invent (phone numbers, MACs) get a bucket each
+KEY_FUNCS = {
+    "ip": _client_ip,
+    "mac": _client_mac,
+    "phone": _client_phone,
+}
+
+
+class ConcurrencyCap:
+    """Non-blocking cap on in-flight requests; a full cap sheds instead of queueing."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+
+def too_many_requests(retry_after):
+    response = jsonify({"status": "error", "message": "Too many requests, please try again later"})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+class RateLimiter:
+    """
+    Token-bucket rate limiting keyed by phone number, client IP and MAC, plus a
+    concurrency cap per endpoint. Both checks run before the view, so a shed
+    request never touches the database or the M-Pesa API.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.backend = MemoryBackend()
+        self._caps = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("RATELIMIT_ENABLED", RATELIMIT_ENABLED)
+        app.config.setdefault("RATELIMIT_REDIS_URL", RATELIMIT_REDIS_URL)
+
+        self.enabled = app.config["RATELIMIT_ENABLED"]
+        if app.config["RATELIMIT_REDIS_URL"]:
+            self.backend = RedisBackend(app.config["RATELIMIT_REDIS_URL"])
+        else:
+            self.backend = MemoryBackend()
+        app.extensions["ratelimit"] = self
+
+    def limit(self, scope, concurrency=None, **limits):
+        """
+        Decorate a view with per-key limits given as (requests, per_seconds), e.g.
+        @limiter.limit("buy", concurrency=20, ip=(10, 60), phone=(3, 60)).
+        """
+        rules = []
+        for name in sorted(limits, key=list(KEY_FUNCS).index):
+            count, period = limits[name]
+            rules.append((name, KEY_FUNCS[name], count / period, float(count)))
+
+        if concurrency:
+            self._caps[scope] = ConcurrencyCap(concurrency)
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return view(*args, **kwargs)
+
+                # Admission control: shed load before any per-key bookkeeping
+                cap = self._caps.get(scope)
+                if cap is not None and not cap.acquire():
+                    return too_many_requests(1)
+
+                try:
+                    req = request._get_current_object()
+                    now = time.monotonic() if isinstance(self.backend, MemoryBackend) else time.time()
+                    for name, key_func, rate, burst in rules:
+                        key = key_func(req)
+                        if key is None:
+                            continue
+                        allowed, retry_after = self.backend.consume(f"{scope}:{name}:{key}", rate, burst, now)
+                        if not allowed:
+                            logger.warning(f"Rate limit hit on {scope} for {name}={key}")
+                            return too_many_requests(retry_after)
+
+                    return view(*args, **kwargs)
+                finally:
+                    if cap is not None:
+                        cap.release()
+
+            return wrapper
+
+        return decorator
+
+
+limiter = RateLimiter()
@@ -0,0 +1,130 @@
+# readreplica.py
+import logging
+import os
+import threading
+import time
+
+from flask import current_app, g, request
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+
+import metrics
+from config import READ_ROUTING, REPLICA_DATABASE_URI, REPLICA_MAX_LAG, REPLICA_LAG_CHECK
+from database.models import db
+
+logger = logging.getLogger(__name__)
+
+# Seconds behind the primary on a Postgres standby; 0 once it has replayed everything it received
+POSTGRES_LAG = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+    " ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END")
+
+
+def replica_database_uri(app):
+    """
+    The URI read-only blueprints query: REPLICA_DATABASE_URI if set, else, for
+    a file-backed SQLite primary, a read-only connection to the same file.
+    None when read routing is off or there is nothing to route to.
+    """
+    app.config.setdefault("READ_ROUTING", READ_ROUTING)
+    app.config.setdefault("REPLICA_DATABASE_URI", REPLICA_DATABASE_URI)
+    if not app.config["READ_ROUTING"]:
+        return None
+    if app.config["REPLICA_DATABASE_URI"]:
+        return app.config["REPLICA_DATABASE_URI"]
+
+    url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:") or url.query.get("uri"):
+        return None
+    path = url.database if os.path.isabs(url.database) else os.path.join(app.instance_path, url.database)
+    return url.set(database=f"file:{path}", query={"mode": "ro", "uri": "true"}).render_as_string(
+        hide_password=False)
+
+
+def _enable_wal(dbapi_connection, connection_record):
+    # Readers on the read-only pool then see the last committed snapshot instead of
+    # holding a lock that makes a committing callback wait
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+class ReadRouter:
+    """
+    Per-request read/write routing. Blueprints passed to read_only() run
+    their queries on the "replica" bind (see RoutingSession) so admin lists
+    and reports never hold the primary's connections or locks while payment
+    callbacks write. A request reads the primary instead while the replica
+    lags more than the route allows: REPLICA_MAX_LAG, or max_lag(seconds).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._measure_lag = False
+        self._lag = (float("-inf"), 0.0)  # (monotonic time measured, seconds behind)
+        self._lag_lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault("REPLICA_MAX_LAG", REPLICA_MAX_LAG)
+        app.config.setdefault("REPLICA_LAG_CHECK", REPLICA_LAG_CHECK)
+        with app.app_context():
+            replica = db.engines.get("replica")
+            self.enabled = replica is not None
+            if not self.enabled:
+                return
+            primary = db.engine
+            if replica.url.database == f"file:{primary.url.database}":
+                event.listen(primary, "connect", _enable_wal)
+            self._measure_lag = replica.dialect.name == "postgresql"
+        app.extensions["read_router"] = self
+
+    def read_only(self, blueprint):
+        """Route every request of a blueprint that only reads to the replica."""
+        blueprint.before_request(self._route_reads)
+        return blueprint
+
+    @staticmethod
+    def max_lag(seconds):
+        """Decorate a read-only view that tolerates at most `seconds` of replica lag (0: fully caught up)."""
+        def decorator(view):
+            view.replica_max_lag = seconds
+            return view
+        return decorator
+
+    def _route_reads(self):
+        if not self.enabled:
+            return
+        view = current_app.view_functions.get(request.endpoint)
+        allowed = getattr(view, "replica_max_lag", current_app.config["REPLICA_MAX_LAG"])
+        if self.lag() <= allowed:
+            g.read_replica = True
+            metrics.incr("db.replica_requests")
+        else:
+            metrics.incr("db.replica_fallbacks")
+
+    def lag(self):
+        """Seconds the replica is behind the primary, re-measured at most every REPLICA_LAG_CHECK seconds."""
+        if not self._measure_lag:
+            # Only Postgres standbys report lag; a read-only pool on the primary's own SQLite file sees every commit
+            return 0.0
+        measured_at, seconds = self._lag
+        if time.monotonic() - measured_at < current_app.config["REPLICA_LAG_CHECK"]:
+            return seconds
+        # One request re-measures; the others use the last value meanwhile
+        if not self._lag_lock.acquire(blocking=False):
+            return seconds
+        try:
+            with db.engines["replica"].connect() as connection:
+                seconds = float(connection.execute(POSTGRES_LAG).scalar() or 0)
+        except Exception as e:
+            # An unreachable replica counts as infinitely behind, so reads go to the primary
+            logger.error(f"Replica lag check failed: {e}")
+            seconds = float("inf")
+        finally:
+            self._lag = (time.monotonic(), seconds)
+            self._lag_lock.release()
+        metrics.set_gauge("db.replica_lag_seconds", seconds if seconds != float("inf") else -1)
+        return seconds
+
+
+read_router = ReadRouter()
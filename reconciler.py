@@ -0,0 +1,156 @@
+# reconciler.py
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+import metrics
+from database.models import PaymentTransaction, db, nairobi_now
+from routes.mpesa import apply_stk_result
+from circuitbreaker import CircuitOpenError
+from utilities import get_access_token, query_stk_status, STILL_PROCESSING
+
+logger = logging.getLogger(__name__)
+
+
+class RateBudget:
+    """Blocking token bucket shared by the pool so queries stay under Daraja's rate limit."""
+
+    def __init__(self, per_second):
+        self.rate = float(per_second)
+        self.tokens = self.rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def find_stale_pending(min_age, max_age, limit):
+    """Oldest PENDING transactions whose callback is overdue; served by the (status, created_at) index."""
+    now = nairobi_now()
+    return (PaymentTransaction.query
+            .filter(PaymentTransaction.status == "PENDING",
+                    PaymentTransaction.created_at <= now - min_age,
+                    PaymentTransaction.created_at >= now - max_age)
+            .order_by(PaymentTransaction.created_at)
+            .limit(limit)
+            .all())
+
+
+def _query(checkout_request_id, access_token, budget):
+    import requests
+
+    budget.acquire()
+    start = time.monotonic()
+    try:
+        return checkout_request_id, query_stk_status(checkout_request_id, access_token)
+    except (requests.RequestException, ValueError, CircuitOpenError) as e:
+        logger.warning(f"STK query failed for {checkout_request_id}: {e}")
+        return checkout_request_id, None
+    finally:
+        metrics.incr("reconcile.query_ms_total", int((time.monotonic() - start) * 1000))
+
+
+def reconcile_batch(transactions, pool, budget):
+    """Query Daraja for a batch of transactions in parallel and apply the results in one commit."""
+    access_token = get_access_token()
+    if not access_token:
+        logger.error("Reconciler could not get an access token; skipping batch.")
+        metrics.incr("reconcile.query_errors", len(transactions))
+        return 0
+
+    by_id = {transaction.checkout_request_id: transaction for transaction in transactions}
+    results = pool.map(lambda checkout_id: _query(checkout_id, access_token, budget), by_id)
+
+    resolved = 0
+    for checkout_id, result in results:
+        metrics.incr("reconcile.queried")
+        if result is None:
+            metrics.incr("reconcile.query_errors")
+            continue
+        if result.get("errorCode") == STILL_PROCESSING or "ResultCode" not in result:
+            metrics.incr("reconcile.still_pending")
+            continue
+
+        result_code = int(result["ResultCode"])
+        receipt_number = result.get("MpesaReceiptNumber")
+        if result_code == 0 and not receipt_number:
+            # The STK query does not return the receipt; the voucher is keyed on the checkout id
+            logger.warning(f"Transaction {checkout_id} paid without a receipt; voucher issued as {checkout_id}")
+            metrics.incr("reconcile.issued_without_receipt")
+
+        apply_stk_result(by_id[checkout_id], result_code, result.get("ResultDesc"), receipt_number)
+        metrics.incr("reconcile.resolved_success" if result_code == 0 else "reconcile.resolved_failed")
+        resolved += 1
+
+    db.session.commit()
+    return resolved
+
+
+def reconcile_pending(min_age=timedelta(minutes=2), max_age=timedelta(days=1),
+                      batch_size=50, concurrency=4, queries_per_second=5):
+    """One reconciliation pass over stale PENDING transactions; returns how many were resolved."""
+    start = time.monotonic()
+    budget = RateBudget(queries_per_second)
+    resolved = 0
+    seen = set()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while True:
+            transactions = [t for t in find_stale_pending(min_age, max_age, batch_size + len(seen))
+                            if t.checkout_request_id not in seen]
+            if not transactions:
+                break
+            transactions = transactions[:batch_size]
+            seen.update(t.checkout_request_id for t in transactions)
+            metrics.incr("reconcile.scanned", len(transactions))
+            try:
+                resolved += reconcile_batch(transactions, pool, budget)
+            except CircuitOpenError as e:
+                # Daraja is down; the next pass picks these up once the circuit closes
+                logger.warning(f"Reconciliation paused: {e}")
+                metrics.incr("reconcile.circuit_open")
+                break
+            except Exception as e:
+                logger.exception(f"Reconcile batch failed: {e}")
+                db.session.rollback()
+                break
+
+    metrics.incr("reconcile.runs")
+    metrics.set_gauge("reconcile.last_run_seconds", round(time.monotonic() - start, 3))
+    metrics.set_gauge("reconcile.last_run_resolved", resolved)
+    return resolved
+
+
+@click.command("reconcile-payments")
+@click.option("--min-age", default=120, help="Seconds a transaction must be pending before it is queried.")
+@click.option("--max-age", default=86400, help="Ignore transactions pending for longer than this many seconds.")
+@click.option("--batch-size", default=50)
+@click.option("--concurrency", default=4, help="Parallel STK queries.")
+@click.option("--rate", default=5.0, help="Maximum STK queries per second.")
+@click.option("--interval", default=0, help="Repeat every N seconds (0 runs once).")
+@with_appcontext
+def reconcile_command(min_age, max_age, batch_size, concurrency, rate, interval):
+    """Resolve PENDING transactions whose M-Pesa callback never arrived."""
+    while True:
+        resolved = reconcile_pending(timedelta(seconds=min_age), timedelta(seconds=max_age),
+                                     batch_size, concurrency, rate)
+        current_app.logger.info(f"Reconciled {resolved} pending transactions")
+        if not interval:
+            break
+        time.sleep(interval)
@@ -0,0 +1,132 @@
+# rollups.py
+from collections import defaultdict
+from datetime import timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy.dialects import postgresql, sqlite
+
+from archive import archived_rows
+from database.models import db, PaymentTransaction, Voucher, RevenueRollup, UsageRollup, nairobi_tz
+
+TERMINAL = ("SUCCESS", "FAILED")
+
+# validate_voucher grants one hour, so a redemption happened at expiry_time - 1h
+SESSION_LENGTH = timedelta(hours=1)
+
+UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def hour_bucket(value):
+    """Start of the Nairobi hour containing `value`, as a naive datetime (how SQLite stores it)."""
+    if value.tzinfo is not None:
+        value = value.astimezone(nairobi_tz).replace(tzinfo=None)
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def _bump(model, keys, increments):
+    """Add `increments` to the rollup row at `keys`, creating it if needed, in the caller's transaction."""
+    table = model.__table__
+    insert = UPSERT_INSERTS.get(db.session.get_bind().dialect.name)
+    if insert is not None:
+        statement = insert(table).values(**keys, **increments)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={column: table.c[column] + statement.excluded[column] for column in increments})
+        db.session.execute(statement)
+        return
+
+    row = db.session.get(model, tuple(keys.values()))
+    if row is None:
+        db.session.add(model(**keys, **increments))
+    else:
+        for column, value in increments.items():
+            setattr(row, column, getattr(row, column) + value)
+
+
+def record_payment(transaction, previous_status):
+    """
+    Keep a transaction counted under its final status: the first time it
+    reaches one, and again when a late result moves it between them (a
+    FAILED payment whose success callback arrives afterwards).
+    """
+    if transaction.status == previous_status:
+        return
+    hour, amount = hour_bucket(transaction.created_at), transaction.amount
+    if previous_status in TERMINAL:
+        _bump(RevenueRollup, {"hour": hour, "status": previous_status, "amount": amount},
+              {"transactions": -1, "revenue": -amount if previous_status == "SUCCESS" else 0.0})
+    if transaction.status in TERMINAL:
+        _bump(RevenueRollup, {"hour": hour, "status": transaction.status, "amount": amount},
+              {"transactions": 1, "revenue": amount if transaction.status == "SUCCESS" else 0.0})
+
+
+def record_redemption(voucher, previous_expiry=None):
+    """Count a redemption, moving it from the hour of `previous_expiry` if a sync merge changed its expiry."""
+    if previous_expiry is not None:
+        _bump(UsageRollup, {"hour": hour_bucket(previous_expiry - SESSION_LENGTH), "price": voucher.price},
+              {"redemptions": -1})
+    _bump(UsageRollup,
+          {"hour": hour_bucket(voucher.expiry_time - SESSION_LENGTH), "price": voucher.price},
+          {"redemptions": 1})
+
+
+def backfill(batch_size=50000):
+    """Rebuild both rollup tables from the raw tables and their archives; returns (revenue_rows, usage_rows)."""
+    revenue = defaultdict(lambda: [0, 0.0])
+
+    def count_payment(created_at, status, amount):
+        totals = revenue[(hour_bucket(created_at), status, amount)]
+        totals[0] += 1
+        totals[1] += amount if status == "SUCCESS" else 0.0
+
+    last_id = 0
+    while True:
+        rows = (db.session.query(PaymentTransaction.id, PaymentTransaction.created_at,
+                                 PaymentTransaction.status, PaymentTransaction.amount)
+                .filter(PaymentTransaction.id > last_id, PaymentTransaction.status.in_(TERMINAL))
+                .order_by(PaymentTransaction.id).limit(batch_size).all())
+        if not rows:
+            break
+        for _, created_at, status, amount in rows:
+            count_payment(created_at, status, amount)
+        last_id = rows[-1][0]
+    # Payments moved out by retention still count towards their hours
+    for created_at, status, amount in archived_rows(PaymentTransaction, ("created_at", "status", "amount"),
+                                                    lambda table: table.c.status.in_(TERMINAL)):
+        count_payment(created_at, status, amount)
+
+    usage = defaultdict(int)
+    last_id = 0
+    while True:
+        rows = (db.session.query(Voucher.id, Voucher.expiry_time, Voucher.price)
+                .filter(Voucher.id > last_id, Voucher.is_used.is_(True), Voucher.expiry_time.isnot(None))
+                .order_by(Voucher.id).limit(batch_size).all())
+        if not rows:
+            break
+        for _, expiry_time, price in rows:
+            usage[(hour_bucket(expiry_time - SESSION_LENGTH), price)] += 1
+        last_id = rows[-1][0]
+    for expiry_time, price in archived_rows(Voucher, ("expiry_time", "price"),
+                                            lambda table: table.c.is_used.is_(True) & table.c.expiry_time.isnot(None)):
+        usage[(hour_bucket(expiry_time - SESSION_LENGTH), price)] += 1
+
+    # Swap the contents in one transaction so /reports never sees a half-built rollup
+    db.session.query(RevenueRollup).delete()
+    db.session.query(UsageRollup).delete()
+    db.session.bulk_insert_mappings(RevenueRollup, [
+        {"hour": hour, "status": status, "amount": amount, "transactions": count, "revenue": total}
+        for (hour, status, amount), (count, total) in revenue.items()])
+    db.session.bulk_insert_mappings(UsageRollup, [
+        {"hour": hour, "price": price, "redemptions": count} for (hour, price), count in usage.items()])
+    db.session.commit()
+    return len(revenue), len(usage)
+
+
+@click.command("backfill-rollups")
+@click.option("--batch-size", default=50000, help="Rows read per batch.")
+@with_appcontext
+def backfill_command(batch_size):
+    """Rebuild revenue and usage rollups from payment and voucher history (run in a quiet window)."""
+    revenue_rows, usage_rows = backfill(batch_size)
+    click.echo(f"Rebuilt {revenue_rows} revenue and {usage_rows} usage rollup rows")
@@ -0,0 +1,39 @@
+import time
+from flask import Blueprint, request, jsonify
+from adtracking import ad_events, ad_names, EVENT_TYPES, ADS_FOLDER
+from ratelimit import limiter
+
+ads_bp = Blueprint("ads", __name__)
+
+# Events accepted per beacon; the page sends far fewer
+MAX_BATCH = 200
+
+
+@ads_bp.route("/events", methods=["POST"])
+@limiter.limit("ad_events", ip=(120, 60))
+def ad_events_beacon():
+    """
+    Accept a batch of ad events from the success page:
+    {"events": [{"ad": "promo.jpg", "type": "impression" | "click"}, ...]}.
+    Events are only buffered here (no database work) and counted per hour
+    of arrival; unknown ads and types are skipped. The page reports each
+    ad's impression once per view, so a beacon counts at most one
+    impression and one click per ad, however many it repeats.
+    """
+    # sendBeacon posts text/plain, so parse whatever the content type says
+    data = request.get_json(force=True, silent=True) or {}
+    events = data.get("events")
+    if not isinstance(events, list) or len(events) > MAX_BATCH:
+        return jsonify({"status": "error", "message": f"events must be a list of at most {MAX_BATCH}"}), 400
+
+    known = ad_names.get(ADS_FOLDER)
+    epoch_hour = int(time.time()) // 3600
+    accepted = set()
+    for event in events:
+        if not isinstance(event, dict):
+            continue
+        ad, kind = known.get(event.get("ad")), EVENT_TYPES.get(event.get("type"))
+        if ad is not None and kind is not None:
+            accepted.add((ad, kind, epoch_hour))
+    ad_events.add(list(accepted))
+    return "", 204
@@ -1,8 +1,9 @@
 import traceback
 from database.models import Client  # Import Client model
 from flask import request, jsonify, current_app, Blueprint
+from readreplica import read_router
 
-client_bp = Blueprint('client', __name__)
+client_bp = read_router.read_only(Blueprint('client', __name__))
 
 @client_bp.route("/list", methods=["GET"])
 def list_clients():
@@ -43,7 +44,7 @@ def list_clients():
                 "mac_address": client.mac_address,
                 "voucher_id": client.voucher_id,
                 "voucher_code": client.voucher.code if client.voucher else None,
-                "connected_at": client.connected_at.isoformat() if client.connected_at else None,
+                "connected_at": client.connected_at,
             }
             for client in paginated_clients.items
         ]
@@ -0,0 +1,49 @@
+import os
+import re
+from flask import Blueprint, Response, abort, current_app, request, send_from_directory
+import metrics
+from config import HLS_CACHE_MB
+from hls import SegmentCache, segment_path
+
+hls_bp = Blueprint("hls", __name__)
+
+segment_cache = SegmentCache(HLS_CACHE_MB * 1024 * 1024)
+
+DIGEST = re.compile(r"[0-9a-f]{64}")
+MOVIE = re.compile(r"[a-z0-9_-]+")
+PLAYLIST = re.compile(r"[a-z0-9_-]+\.m3u8")
+
+
+@hls_bp.route("/segments/<digest>.ts", methods=["GET"])
+def get_segment(digest):
+    """
+    Serve a content-addressed segment from the hot-segment cache. The name is
+    the hash of the bytes, so clients may cache it forever.
+    """
+    if not DIGEST.fullmatch(digest):
+        abort(404)
+    if digest in request.if_none_match:
+        return Response(status=304)
+
+    try:
+        data = segment_cache.get(digest, segment_path(current_app.config["HLS_FOLDER"], digest))
+    except FileNotFoundError:
+        abort(404)
+
+    metrics.incr("hls.segments_served")
+    metrics.incr("hls.bytes_served", len(data))
+    response = Response(data, mimetype="video/mp2t")
+    response.set_etag(digest)
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+
+@hls_bp.route("/<movie>/<playlist>", methods=["GET"])
+def get_playlist(movie, playlist):
+    # Playlists are tiny and change when a movie is re-packaged, so they are not cached
+    if not MOVIE.fullmatch(movie) or not PLAYLIST.fullmatch(playlist):
+        abort(404)
+    response = send_from_directory(os.path.join(current_app.config["HLS_FOLDER"], movie), playlist,
+                                   mimetype="application/vnd.apple.mpegurl", max_age=0)
+    metrics.incr("hls.playlists_served")
+    return response
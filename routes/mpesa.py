@@ -1,15 +1,20 @@
 import re
 import time
 from datetime import timezone, datetime, timedelta
-import requests
 from flask import Blueprint, request, jsonify, current_app
-from config import Config, STK_PUSH_URL
-from database.models import PaymentTransaction, db, Voucher
+from sqlalchemy import or_
+from config import Config, STK_PUSH_URL, DARAJA_TIMEOUT
+from circuitbreaker import daraja_breaker, CircuitOpenError, service_unavailable
+from database.models import PaymentTransaction, db, Voucher, nairobi_tz
+from ratelimit import limiter
+from rollups import record_payment, record_redemption
+from voucherfilter import voucher_filter
+from usage import start_session
+from jsonprovider import EncodedCache, json_body
 from utilities import get_access_token, get_password_and_timestamp, SHORTCODE, TILL_NUMBER, CALLBACK_URL
-from zoneinfo import ZoneInfo
 
 
-EAT = ZoneInfo("Africa/Nairobi") 
+EAT = nairobi_tz
 
 mpesa_bp = Blueprint("mpesa", __name__)
 
@@ -33,7 +38,10 @@ def sanitize_phone_number(phone_number):
 
 
 @mpesa_bp.route('/buy-voucher', methods=['POST'])
+@limiter.limit("buy_voucher", concurrency=20, phone=(3, 60), ip=(10, 60), mac=(5, 60))
 def buy_voucher():
+    import requests  # Deferred so portal workers start without the outbound HTTP stack
+
     raw_data = request.get_json()
 
     try:
@@ -81,7 +89,8 @@ def buy_voucher():
 
         # Track response time for logging
         start_time = time.time()
-        response = requests.post(STK_PUSH_URL, headers=headers, json=payload, timeout=10)
+        response = daraja_breaker.call(requests.post, STK_PUSH_URL, headers=headers, json=payload,
+                                       timeout=DARAJA_TIMEOUT)
         end_time = time.time()
         
         current_app.logger.info(f"STK Push completed in {end_time - start_time} seconds")
@@ -110,6 +119,10 @@ def buy_voucher():
             current_app.logger.error(f"STK Push failed with: {json_response.get('errorMessage', 'Unknown error')}")
             return jsonify({"status": "error", "message": json_response.get('errorMessage', 'Unknown error')}), 400
 
+    except CircuitOpenError as e:
+        # Fail fast instead of holding a worker for the full timeout while Daraja is down
+        current_app.logger.warning(f"STK Push refused: {e}")
+        return service_unavailable(e.retry_after)
     except requests.RequestException as req_ex:
         current_app.logger.error(f"RequestException during STK Push: {req_ex}")
         return jsonify({"status": "error", "message": "STK Push request failed"}), 500
@@ -118,6 +131,56 @@ def buy_voucher():
         return jsonify({"status": "error", "message": "Internal server error"}), 500
 
 
+def voucher_codes(transaction):
+    """Codes a transaction's voucher can have: its receipt, or its checkout id when issued without one."""
+    return [code for code in (transaction.receipt_number, transaction.checkout_request_id) if code]
+
+
+def apply_stk_result(transaction, result_code, result_desc, receipt_number):
+    """
+    Apply an STK result to a transaction and create its voucher on success (caller commits).
+    The voucher code is the M-Pesa receipt; an STK query reports success without one, so
+    then the voucher is keyed on the checkout id and a later callback only attaches the receipt.
+    """
+    transaction_id = transaction.checkout_request_id
+    previous_status = transaction.status
+
+    if result_code == 0:
+        transaction.status = "SUCCESS"
+        transaction.receipt_number = receipt_number or transaction.receipt_number
+        current_app.logger.info(f"Transaction {transaction_id} successful with receipt number: {receipt_number}")
+
+        # Check if voucher exists or create a new one
+        existing_voucher = Voucher.query.filter(Voucher.code.in_(voucher_codes(transaction))).first()
+        if not existing_voucher:
+            voucher = Voucher(
+                code=receipt_number or transaction_id,
+                is_used=False,
+                price=transaction.amount,
+                expiry_time=None)
+            db.session.add(voucher)
+        elif receipt_number and existing_voucher.code != receipt_number:
+            current_app.logger.info(f"Receipt {receipt_number} attached to voucher {existing_voucher.code}")
+        else:
+            current_app.logger.warning(f"Duplicate voucher detected: {receipt_number}")
+
+    elif result_code == 2001:  # Wrong PIN
+        transaction.status = "FAILED"
+        transaction.description = "Wrong PIN entered"
+        current_app.logger.warning(f"Transaction {transaction_id} failed due to wrong PIN.")
+    elif result_code == 1032:  # Cancelled by user
+        transaction.status = "FAILED"
+        transaction.description = "Transaction cancelled by user"
+        current_app.logger.warning(f"Transaction {transaction_id} was cancelled by user.")
+    else:  # Other failure cases
+        transaction.status = "FAILED"
+        transaction.description = result_desc
+        current_app.logger.error(f"Transaction {transaction_id} failed: {result_desc}")
+
+    # Keep the hourly revenue rollup in step, in the same transaction
+    record_payment(transaction, previous_status)
+
+
 @mpesa_bp.route('/mpesa_callback', methods=['POST'])
 def mpesa_callback():
     """Handle callbacks from MPesa."""
@@ -189,40 +252,12 @@ def mpesa_callback():
                 return jsonify({"ResultCode": 1, "ResultDesc": "Transaction creation error"}), 500
 
         # Process the ResultCode
-        if result_code == 0:
-            transaction.status = "SUCCESS"
-            transaction.receipt_number = receipt_number
-            current_app.logger.info(f"Transaction {transaction_id} successful with receipt number: {receipt_number}")
-
-            # Check if voucher exists or create a new one
-            existing_voucher = Voucher.query.filter_by(code=receipt_number).first()
-            if not existing_voucher:
-                try:
-                    voucher = Voucher(
-                        code=receipt_number,
-                        is_used=False,
-                        price=transaction.amount,
-                        expiry_time=None)
-                    db.session.add(voucher)
-                except Exception as e:
-                    current_app.logger.error(f"Failed to create voucher: {str(e)}")
-                    db.session.rollback()
-                    return jsonify({"ResultCode": 1, "ResultDesc": "Voucher creation error"}), 500
-            else:
-                current_app.logger.warning(f"Duplicate voucher detected: {receipt_number}")
-
-        elif result_code == 2001:  # Wrong PIN
-            transaction.status = "FAILED"
-            transaction.description = "Wrong PIN entered"
-            current_app.logger.warning(f"Transaction {transaction_id} failed due to wrong PIN.")
-        elif result_code == 1032:  # Cancelled by user
-            transaction.status = "FAILED"
-            transaction.description = "Transaction cancelled by user"
-            current_app.logger.warning(f"Transaction {transaction_id} was cancelled by user.")
-        else:  # Other failure cases
-            transaction.status = "FAILED"
-            transaction.description = result_desc
-            current_app.logger.error(f"Transaction {transaction_id} failed: {result_desc}")
+        try:
+            apply_stk_result(transaction, result_code, result_desc, receipt_number)
+        except Exception as e:
+            current_app.logger.error(f"Failed to create voucher: {str(e)}")
+            db.session.rollback()
+            return jsonify({"ResultCode": 1, "ResultDesc": "Voucher creation error"}), 500
 
         # Commit database changes
         db.session.commit()
@@ -237,6 +272,7 @@ def mpesa_callback():
 
 
 @mpesa_bp.route('/validate_voucher', methods=['POST'])
+@limiter.limit("validate_voucher", concurrency=50, ip=(20, 60), mac=(10, 60))
 def validate_voucher():
     data = request.get_json()
     receipt_number = data.get("receipt_number")
@@ -245,10 +281,18 @@ def validate_voucher():
         current_app.logger.info("No receipt_number provided")
         return jsonify({"status": "error", "message": "Receipt number is required"}), 400
 
+    # Codes that were never issued (typos, brute force) are turned away without touching the DB
+    if not voucher_filter.might_exist(str(receipt_number)):
+        current_app.logger.info(f"Unknown voucher code rejected by filter: {receipt_number}")
+        return jsonify({"status": "error", "message": "Invalid or unsuccessful transaction"}), 404
+
     try:
         # Transaction validation
         current_app.logger.info(f"Validating transaction for receipt_number: {receipt_number}")
-        transaction = PaymentTransaction.query.filter_by(receipt_number=receipt_number, status="SUCCESS").first()
+        transaction = PaymentTransaction.query.filter(
+            or_(PaymentTransaction.receipt_number == receipt_number,
+                PaymentTransaction.checkout_request_id == receipt_number),
+            PaymentTransaction.status == "SUCCESS").first()
         if not transaction:
             current_app.logger.info(f"Transaction not found or unsuccessful for receipt_number: {receipt_number}")
             return jsonify({"status": "error", "message": "Invalid or unsuccessful transaction"}), 404
@@ -260,13 +304,23 @@ def validate_voucher():
             current_app.logger.info(f"Voucher not found for code: {receipt_number}")
             return jsonify({"status": "error", "message": "Voucher not found"}), 404
 
+        mac_address = data.get("mac_address") or request.headers.get("X-Client-MAC")
+
         # Handle used voucher
         if voucher.is_used:
+            if voucher.usage is not None and voucher.usage.cut_off_at is not None:
+                current_app.logger.info(f"Data bundle used up for voucher: {receipt_number}")
+                return jsonify({"status": "error", "message": "Data bundle used up"}), 400
+
             if voucher.expiry_time:
-                expiry_time = voucher.expiry_time.replace(tzinfo=timezone.utc).astimezone(EAT)
+                expiry_time = voucher.expiry_time
+                if expiry_time.tzinfo is None:  # SQLite hands back the stored Nairobi wall-clock time
+                    expiry_time = expiry_time.replace(tzinfo=EAT)
 
                 if expiry_time > datetime.now(timezone.utc):
                     current_app.logger.info(f"Reconnecting to active session for voucher: {receipt_number}")
+                    start_session(voucher, transaction, mac_address)
+                    db.session.commit()
                     return jsonify({"status": "success", "message": "Reconnected to active session"}), 200
 
             current_app.logger.info(f"Voucher expired for code: {receipt_number}")
@@ -275,6 +329,8 @@ def validate_voucher():
         # Mark voucher as used and set expiry
         voucher.is_used = True
         voucher.expiry_time = datetime.now(EAT) + timedelta(hours=1)
+        record_redemption(voucher)
+        start_session(voucher, transaction, mac_address)
         db.session.commit()
 
         # Successful response
@@ -293,6 +349,12 @@ def validate_voucher():
 
 
 
+# Bodies of finished payments, which the buy page may keep polling. SUCCESS is final; FAILED is
+# only cached briefly because a late callback or edge sync can still upgrade it.
+status_cache = EncodedCache("payment_status_cache")
+STATUS_CACHE_TTL = {"SUCCESS": None, "FAILED": 30}
+
+
 @mpesa_bp.route('/payment-status', methods=['GET'])
 def payment_status():
     phone = request.args.get('phone')
@@ -302,6 +364,10 @@ def payment_status():
         current_app.logger.error("Missing required query parameters: phone or request_id.")
         return jsonify({"status": "error", "message": "Missing required query parameters: phone or request_id"}), 400
 
+    body = status_cache.get((phone, request_id))
+    if body is not None:
+        return json_body(body)
+
     try:
         # Query the database for the transaction
         transaction = PaymentTransaction.query.filter_by(
@@ -315,6 +381,9 @@ def payment_status():
 
         # Log the transaction status
         current_app.logger.info(f"Transaction found: {transaction.checkout_request_id}, Status: {transaction.status}")
+        voucher = None
+        if transaction.status == "SUCCESS":
+            voucher = Voucher.query.filter(Voucher.code.in_(voucher_codes(transaction))).first()
 
         response_data = {
             "status": "success",
@@ -322,11 +391,14 @@ def payment_status():
             "amount": transaction.amount,
             "description": transaction.description,
             "receipt_number": transaction.receipt_number or "N/A",
-            "timestamp": transaction.updated_at.isoformat() if transaction.updated_at else None
+            "voucher_code": voucher.code if voucher else None,
+            "timestamp": transaction.created_at
         }
 
-        # Return JSON response
-        return jsonify(response_data), 200
+        body = current_app.json.encode(response_data)
+        if transaction.status in STATUS_CACHE_TTL:
+            status_cache.put((phone, request_id), body, ttl=STATUS_CACHE_TTL[transaction.status])
+        return json_body(body)
 
     except Exception as e:
         current_app.logger.exception("Error fetching payment status")
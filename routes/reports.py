@@ -0,0 +1,150 @@
+from datetime import datetime, timedelta
+from flask import Blueprint, jsonify, request, current_app
+from sqlalchemy import func
+from database.models import RevenueRollup, UsageRollup, AdStat, PaymentTransaction, Voucher, db, nairobi_now
+from archive import find_archived
+from readreplica import read_router
+
+reports_bp = read_router.read_only(Blueprint("reports", __name__))
+
+
+def day_range():
+    """The Nairobi day asked for with ?date=YYYY-MM-DD (default today), as naive hour bounds."""
+    day = request.args.get("date")
+    start = datetime.strptime(day, "%Y-%m-%d") if day else nairobi_now().replace(tzinfo=None)
+    start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, start + timedelta(days=1)
+
+
+@reports_bp.route("/revenue", methods=["GET"])
+def revenue():
+    """Sales per hour and package for one day, served from the revenue rollup."""
+    try:
+        start, end = day_range()
+    except ValueError:
+        return jsonify({"status": "error", "message": "date must be YYYY-MM-DD"}), 400
+
+    try:
+        rows = (RevenueRollup.query
+                .filter(RevenueRollup.hour >= start, RevenueRollup.hour < end)
+                .order_by(RevenueRollup.hour, RevenueRollup.amount).all())
+    except Exception as e:
+        current_app.logger.exception(f"Database error occurred: {str(e)}")
+        return jsonify({"status": "error", "message": "Database query failed"}), 500
+
+    hours = [
+        {
+            "hour": row.hour.isoformat(),
+            "package": row.amount,
+            "status": row.status,
+            "transactions": row.transactions,
+            "revenue": row.revenue,
+        }
+        for row in rows
+    ]
+    return jsonify({
+        "status": "success",
+        "date": start.date().isoformat(),
+        "hours": hours,
+        "total_revenue": sum(row.revenue for row in rows),
+        "successful_transactions": sum(row.transactions for row in rows if row.status == "SUCCESS"),
+        "failed_transactions": sum(row.transactions for row in rows if row.status == "FAILED"),
+    }), 200
+
+
+@reports_bp.route("/usage", methods=["GET"])
+def usage():
+    """Voucher redemptions per hour and price for one day, served from the usage rollup."""
+    try:
+        start, end = day_range()
+    except ValueError:
+        return jsonify({"status": "error", "message": "date must be YYYY-MM-DD"}), 400
+
+    rows = (UsageRollup.query
+            .filter(UsageRollup.hour >= start, UsageRollup.hour < end)
+            .order_by(UsageRollup.hour, UsageRollup.price).all())
+    return jsonify({
+        "status": "success",
+        "date": start.date().isoformat(),
+        "hours": [{"hour": row.hour.isoformat(), "price": row.price, "redemptions": row.redemptions}
+                  for row in rows],
+        "total_redemptions": sum(row.redemptions for row in rows),
+    }), 200
+
+
+@reports_bp.route("/packages", methods=["GET"])
+def packages():
+    """All-time sales per package; reads the rollup (hours x packages), never the transactions."""
+    rows = (db.session.query(RevenueRollup.amount,
+                             func.sum(RevenueRollup.transactions), func.sum(RevenueRollup.revenue))
+            .filter(RevenueRollup.status == "SUCCESS")
+            .group_by(RevenueRollup.amount).order_by(RevenueRollup.amount).all())
+    return jsonify({
+        "status": "success",
+        "packages": [{"package": amount, "transactions": count, "revenue": total} for amount, count, total in rows],
+    }), 200
+
+
+@reports_bp.route("/ads", methods=["GET"])
+def ads():
+    """Impressions and clicks per ad and hour for one day, for billing advertisers."""
+    try:
+        start, end = day_range()
+    except ValueError:
+        return jsonify({"status": "error", "message": "date must be YYYY-MM-DD"}), 400
+
+    rows = (AdStat.query
+            .filter(AdStat.hour >= start, AdStat.hour < end)
+            .order_by(AdStat.hour, AdStat.ad).all())
+    totals = {}
+    for row in rows:
+        ad = totals.setdefault(row.ad, {"ad": row.ad, "impressions": 0, "clicks": 0})
+        ad["impressions"] += row.impressions
+        ad["clicks"] += row.clicks
+    return jsonify({
+        "status": "success",
+        "date": start.date().isoformat(),
+        "hours": [{"hour": row.hour.isoformat(), "ad": row.ad, "impressions": row.impressions, "clicks": row.clicks}
+                  for row in rows],
+        "ads": list(totals.values()),
+    }), 200
+
+
+def _columns(row):
+    return {column.name: getattr(row, column.key) for column in row.__table__.columns}
+
+
+@reports_bp.route("/receipts/<receipt_number>", methods=["GET"])
+# Disputes are often about a payment made moments ago
+@read_router.max_lag(5)
+def receipt(receipt_number):
+    """
+    A payment and its voucher by M-Pesa receipt, for disputes. The live
+    tables answer almost every lookup; the monthly archives are searched
+    only when they miss.
+    """
+    try:
+        transaction = PaymentTransaction.query.filter_by(receipt_number=receipt_number).first()
+        archived = {}
+        transaction = _columns(transaction) if transaction else None
+        if transaction is None:
+            found = find_archived(PaymentTransaction, "receipt_number", receipt_number)
+            if found:
+                archived["transaction"], transaction = found
+        # A voucher issued before its receipt arrived is keyed on the checkout id
+        codes = [receipt_number] + ([transaction["checkout_request_id"]] if transaction else [])
+        voucher = Voucher.query.filter(Voucher.code.in_(codes)).first()
+        voucher = _columns(voucher) if voucher else None
+        for code in codes if voucher is None else ():
+            found = find_archived(Voucher, "code", code)
+            if found:
+                archived["voucher"], voucher = found
+                break
+    except Exception as e:
+        current_app.logger.exception(f"Database error occurred: {str(e)}")
+        return jsonify({"status": "error", "message": "Database query failed"}), 500
+
+    if transaction is None and voucher is None:
+        return jsonify({"status": "error", "message": "Receipt not found"}), 404
+    # archived: the YYYYMM archive each record came from, for those no longer in the live tables
+    return jsonify({"status": "success", "transaction": transaction, "voucher": voucher, "archived": archived}), 200
@@ -0,0 +1,56 @@
+import hmac
+import json
+from flask import Blueprint, request, current_app, Response, abort
+from sqlalchemy import func
+from database.models import ChangeLog, db
+from edgesync import apply_pushed_changes, changes_since, pack, unpack
+
+sync_bp = Blueprint("sync", __name__)
+
+
+@sync_bp.before_request
+def check_token():
+    """Edges authenticate with the shared SYNC_TOKEN; without one configured nothing is accepted."""
+    token = current_app.config.get("SYNC_TOKEN")
+    if not token or not hmac.compare_digest(request.headers.get("X-Sync-Token", ""), token):
+        abort(403)
+
+
+def packed(document):
+    return Response(pack(document), mimetype="application/octet-stream")
+
+
+@sync_bp.route("/push", methods=["POST"])
+def push():
+    """Apply a compressed batch of an edge's changes; answers with the last sequence applied."""
+    try:
+        batch = unpack(request.get_data())
+    except Exception as e:
+        current_app.logger.error(f"Unreadable sync batch: {str(e)}")
+        abort(400)
+
+    try:
+        acked, conflicts = apply_pushed_changes(batch["node"], batch["changes"])
+    except Exception as e:
+        current_app.logger.exception(f"Failed to apply sync batch from {batch.get('node')}: {str(e)}")
+        db.session.rollback()
+        abort(500)
+    return packed({"acked": acked, "conflicts": conflicts})
+
+
+@sync_bp.route("/pull", methods=["GET"])
+def pull():
+    """Changes after `since` that did not come from the asking node, oldest first."""
+    since = int(request.args.get("since", 0))
+    limit = min(int(request.args.get("limit", 500)), 5000)
+    node = request.args.get("node")
+
+    # Read the head first so entries committed during this request are not skipped. Appends become
+    # visible in seq order (see edgesync._serialize_appends), so nothing at or below it is still in flight.
+    last_seq = db.session.query(func.max(ChangeLog.seq)).scalar() or 0
+    entries = [e for e in changes_since(since, limit, exclude_origin=node) if e.seq <= last_seq]
+    return packed({
+        "last_seq": last_seq,
+        "changes": [{"seq": e.seq, "origin": e.origin, "entity": e.entity, "key": e.key,
+                     "payload": json.loads(e.payload)} for e in entries],
+    })
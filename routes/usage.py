@@ -0,0 +1,49 @@
+import hmac
+from flask import Blueprint, request, jsonify, current_app, abort
+from config import USAGE_TOKEN, USAGE_CUTOFF_WINDOW
+from usage import usage_aggregator, normalize_mac, recently_cut_off
+
+usage_bp = Blueprint("usage", __name__)
+
+
+@usage_bp.before_request
+def check_token():
+    """
+    The router authenticates with the shared USAGE_TOKEN. Counters can cut a
+    device off, so without a token configured the endpoint accepts nothing.
+    """
+    token = current_app.config.get("USAGE_TOKEN", USAGE_TOKEN)
+    if not token or not hmac.compare_digest(request.headers.get("X-Usage-Token", ""), token):
+        abort(403)
+
+
+@usage_bp.route("/counters", methods=["POST"])
+def push_counters():
+    """
+    Accept byte deltas since the router's previous push:
+    {"counters": [{"mac": "aa:bb:..", "bytes_in": 123, "bytes_out": 45}, ...]}.
+    Deltas are summed in memory and written in batches; the response lists
+    MACs whose bundle ran out recently, for the router to disconnect.
+    """
+    data = request.get_json(silent=True) or {}
+    counters = data.get("counters")
+    if not isinstance(counters, list):
+        return jsonify({"status": "error", "message": "counters must be a list"}), 400
+
+    accepted, rejected = [], 0
+    for counter in counters:
+        try:
+            bytes_in, bytes_out = int(counter.get("bytes_in", 0)), int(counter.get("bytes_out", 0))
+            if bytes_in < 0 or bytes_out < 0:
+                raise ValueError
+            accepted.append((normalize_mac(counter["mac"]), bytes_in, bytes_out))
+        except (AttributeError, KeyError, TypeError, ValueError):
+            rejected += 1
+    usage_aggregator.add(accepted)
+
+    try:
+        cut_off = recently_cut_off(current_app.config.get("USAGE_CUTOFF_WINDOW", USAGE_CUTOFF_WINDOW))
+    except Exception as e:
+        current_app.logger.exception(f"Database error occurred: {str(e)}")
+        cut_off = []
+    return jsonify({"status": "success", "accepted": len(accepted), "rejected": rejected, "cut_off": cut_off}), 200
@@ -1,8 +1,9 @@
 from flask import Blueprint, jsonify, current_app, request
 from database.models import Voucher  # Assuming Voucher is defined in a models.py file
 from flask_sqlalchemy import SQLAlchemy
+from readreplica import read_router
 
-voucher_bp = Blueprint("voucher", __name__)
+voucher_bp = read_router.read_only(Blueprint("voucher", __name__))
 db = SQLAlchemy()
 
 
@@ -27,7 +28,7 @@ def list_vouchers():
                 "id": voucher.id,
                 "code": voucher.code,
                 "is_used": voucher.is_used,
-                "created_at": voucher.created_at.isoformat() if voucher.created_at else None,
+                "created_at": voucher.created_at,
                 "price": voucher.price
 
             }
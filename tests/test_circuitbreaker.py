@@ -0,0 +1,201 @@
+import pytest
+from flask import Flask
+
+import circuitbreaker
+from circuitbreaker import CircuitBreaker, CircuitOpenError, MemoryState, service_unavailable
+
+
+class Clock:
+    """Stands in for the time module so tests move time by hand."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuitbreaker, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def breaker(clock):
+    breaker = CircuitBreaker("test")
+    breaker.state = MemoryState(10)
+    breaker.min_calls, breaker.error_rate = 4, 0.5
+    breaker.slow_call, breaker.slow_rate = 2.0, 0.5
+    breaker.open_seconds, breaker.probes = 5.0, 2
+    breaker.probe_hold = 3.0
+    return breaker
+
+
+def ok():
+    return Response(200)
+
+
+def server_error():
+    return Response(500)
+
+
+def calls(breaker, *funcs):
+    for func in funcs:
+        breaker.call(func)
+
+
+def is_open(breaker):
+    return breaker.state.open_until() is not None
+
+
+def test_stays_closed_until_min_calls(breaker):
+    calls(breaker, server_error, server_error, server_error)
+    assert not is_open(breaker)
+
+    breaker.call(server_error)
+    assert is_open(breaker)
+
+
+def test_trips_at_the_error_rate(breaker):
+    calls(breaker, ok, ok, ok, server_error)
+    assert not is_open(breaker)  # 1/4 failed
+
+    breaker.call(server_error)
+    assert not is_open(breaker)  # 2/5
+
+    breaker.call(server_error)
+    assert is_open(breaker)  # 3/6
+
+
+def test_exceptions_count_as_failures(breaker):
+    def boom():
+        raise ConnectionError("reset")
+
+    for _ in range(4):
+        with pytest.raises(ConnectionError):
+            breaker.call(boom)
+    assert is_open(breaker)
+
+
+def test_custom_failure_predicate(breaker):
+    for _ in range(4):
+        breaker.call(ok, failure=lambda response: response.status_code == 200)
+    assert is_open(breaker)
+
+
+def test_trips_on_slow_calls(breaker, clock):
+    def slow():
+        clock.advance(2.5)
+        return ok()
+
+    calls(breaker, ok, ok, slow)
+    assert not is_open(breaker)
+
+    breaker.call(slow)
+    assert is_open(breaker)  # 2/4 slower than slow_call
+
+
+def test_outcomes_leave_the_window(breaker, clock):
+    calls(breaker, server_error, server_error, server_error)
+    clock.advance(11)
+    calls(breaker, server_error, ok, ok)
+    assert not is_open(breaker)  # the first three failures aged out
+
+
+def test_open_circuit_rejects_without_calling(breaker, clock):
+    calls(breaker, *[server_error] * 4)
+    clock.advance(1)
+    called = []
+
+    with pytest.raises(CircuitOpenError) as raised:
+        breaker.call(lambda: called.append(1) or ok())
+    assert not called
+    assert raised.value.retry_after == pytest.approx(4.0)
+
+
+def test_healthy_probes_close_the_circuit(breaker, clock):
+    calls(breaker, *[server_error] * 4)
+    clock.advance(5)
+
+    breaker.call(ok)
+    assert is_open(breaker)  # one healthy probe of two
+    breaker.call(ok)
+    assert not is_open(breaker)
+
+    # Closed again with a fresh window: three failures are not enough to trip
+    calls(breaker, server_error, server_error, server_error)
+    assert not is_open(breaker)
+
+
+def test_one_probe_at_a_time(breaker, clock):
+    calls(breaker, *[server_error] * 4)
+    clock.advance(5)
+    rejected = []
+
+    def probe():
+        # Another request arrives while the probe is in flight
+        with pytest.raises(CircuitOpenError) as raised:
+            breaker.call(ok)
+        rejected.append(raised.value.retry_after)
+        return ok()
+
+    breaker.call(probe)
+    assert rejected == [1]
+
+
+def test_failed_probe_opens_again(breaker, clock):
+    calls(breaker, *[server_error] * 4)
+    clock.advance(5)
+    breaker.call(ok)
+
+    breaker.call(server_error)
+    assert breaker.state.open_until() == pytest.approx(clock.now + 5)
+    clock.advance(5)
+    breaker.call(ok)
+    assert is_open(breaker)  # the healthy probe before the failure no longer counts
+
+
+def test_slow_probe_opens_again(breaker, clock):
+    calls(breaker, *[server_error] * 4)
+    clock.advance(5)
+
+    def slow():
+        clock.advance(2.5)
+        return ok()
+
+    breaker.call(slow)
+    assert breaker.state.open_until() == pytest.approx(clock.now + 5)
+
+
+def test_hung_probe_gives_up_its_slot():
+    state = MemoryState(10)
+    state.trip(100.0)
+    assert state.claim_probe(100.0, hold=3.0)
+    assert not state.claim_probe(102.9, hold=3.0)
+    assert state.claim_probe(103.0, hold=3.0)
+
+
+def test_disabled_breaker_passes_through(breaker):
+    breaker.enabled = False
+    calls(breaker, *[server_error] * 10)
+    assert not is_open(breaker)
+
+
+def test_service_unavailable_sets_retry_after():
+    with Flask(__name__).app_context():
+        response = service_unavailable(4.2)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
@@ -0,0 +1,256 @@
+# usage.py
+import atexit
+import logging
+import os
+import re
+import threading
+import time
+from datetime import timedelta
+
+from sqlalchemy import select, update
+
+import metrics
+from config import USAGE_FLUSH_INTERVAL
+from database.models import db, Client, DataUsage, Voucher, nairobi_now, nairobi_tz
+from rollups import UPSERT_INSERTS
+
+logger = logging.getLogger(__name__)
+
+# Bundle sizes as the buy page sends them ("3 GB", "500 MB")
+QUOTA = re.compile(r"(\d+(?:\.\d+)?)\s*([GM])B", re.IGNORECASE)
+UNITS = {"G": 1024 ** 3, "M": 1024 ** 2}
+
+# Values per IN list (well under SQLite's bound-parameter limit)
+CHUNK = 500
+
+# Query parameters captive-portal gateways put the device's MAC in when redirecting to the login
+# page (MikroTik and CoovaChilli: mac, openNDS: clientmac)
+PORTAL_MAC_PARAMS = ("mac", "clientmac", "client_mac")
+MAC = re.compile(r"^[0-9a-f]{2}(?:[:-][0-9a-f]{2}){5}$", re.IGNORECASE)
+
+
+def parse_quota(description):
+    """Bundle size in bytes from a transaction description, or None (unlimited) if it names none."""
+    match = QUOTA.search(description or "")
+    if not match:
+        return None
+    return int(float(match.group(1)) * UNITS[match.group(2).upper()])
+
+
+def normalize_mac(mac):
+    return mac.strip().lower().replace("-", ":")
+
+
+def client_mac(value):
+    """A device MAC as sent by a browser or gateway, normalized, or None if it is not a MAC."""
+    if not isinstance(value, str) or not MAC.match(value.strip()):
+        return None
+    return normalize_mac(value)
+
+
+def portal_mac(args):
+    """The device's MAC from the query string of a captive-portal redirect, or None."""
+    for name in PORTAL_MAC_PARAMS:
+        mac = client_mac(args.get(name))
+        if mac:
+            return mac
+    return None
+
+
+def start_session(voucher, transaction, mac):
+    """
+    Bind the device to the voucher and open its usage row with the bundle's
+    quota (caller commits). The router reports bytes per MAC, so a session
+    opened without one is never metered or cut off.
+    """
+    mac = client_mac(mac)
+    if mac:
+        client = Client.query.filter_by(mac_address=mac).first()
+        if client is None:
+            db.session.add(Client(mac_address=mac, voucher_id=voucher.id))
+        else:
+            client.voucher_id = voucher.id
+            client.connected_at = nairobi_now()
+    else:
+        metrics.incr("usage.sessions_without_mac")
+
+    usage = db.session.get(DataUsage, voucher.id)
+    if usage is None:
+        db.session.add(DataUsage(voucher_id=voucher.id, mac_address=mac,
+                                 quota_bytes=parse_quota(transaction.description)))
+    elif mac and usage.mac_address is None:
+        # First login came without a MAC; meter the session from this one on
+        usage.mac_address = mac
+
+
+def _chunks(items, size=CHUNK):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class UsageAggregator:
+    """
+    Sums per-MAC byte deltas from the router in memory and writes them out
+    every USAGE_FLUSH_INTERVAL seconds as one batched upsert, so
+    thousands of counter updates per second cost a handful of statements.
+    A crash loses at most one interval of counts.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def init_app(self, app):
+        app.config.setdefault("USAGE_FLUSH_INTERVAL", USAGE_FLUSH_INTERVAL)
+        # CLI commands don't receive counters
+        if os.environ.get("FLASK_RUN_FROM_CLI") == "true" or app.config["USAGE_FLUSH_INTERVAL"] <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, args=(app, app.config["USAGE_FLUSH_INTERVAL"]),
+                                        name="usage-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self._flush_at_exit, app)
+
+    def add(self, counters):
+        """Queue (mac, bytes_in, bytes_out) deltas; returns how many were taken."""
+        with self._lock:
+            pending = self._pending
+            for mac, bytes_in, bytes_out in counters:
+                totals = pending.get(mac)
+                if totals is None:
+                    pending[mac] = [bytes_in, bytes_out]
+                else:
+                    totals[0] += bytes_in
+                    totals[1] += bytes_out
+        metrics.incr("usage.counters_received", len(counters))
+        return len(counters)
+
+    def _run(self, app, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    self.flush()
+            except Exception as e:
+                logger.error(f"Usage flush failed: {e}")
+
+    def _flush_at_exit(self, app):
+        with app.app_context():
+            self.flush()
+
+    def flush(self):
+        """Write pending deltas and cut off sessions that ran out of quota; returns (macs, cut_off)."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0, []
+            start = time.perf_counter()
+            try:
+                cut_off = self._write(pending)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self._requeue(pending)
+                raise
+            finally:
+                db.session.remove()
+            metrics.incr("usage.flushes")
+            metrics.set_gauge("usage.last_flush_ms", round((time.perf_counter() - start) * 1000, 1))
+            metrics.set_gauge("usage.last_flush_macs", len(pending))
+            return len(pending), cut_off
+
+    def _requeue(self, pending):
+        # Put the batch back so the next flush retries it
+        with self._lock:
+            for mac, (bytes_in, bytes_out) in pending.items():
+                totals = self._pending.setdefault(mac, [0, 0])
+                totals[0] += bytes_in
+                totals[1] += bytes_out
+
+    def _write(self, pending):
+        owners = {}
+        for macs in _chunks(list(pending)):
+            owners.update(db.session.execute(
+                select(Client.mac_address, Client.voucher_id)
+                .where(Client.mac_address.in_(macs), Client.voucher_id.isnot(None))).all())
+        unknown = len(pending) - len(owners)
+        if unknown:
+            metrics.incr("usage.unknown_macs", unknown)
+
+        now = nairobi_now()
+        rows = {}
+        for mac, voucher_id in owners.items():
+            bytes_in, bytes_out = pending[mac]
+            row = rows.get(voucher_id)
+            if row is None:  # two devices on one voucher share its quota
+                rows[voucher_id] = {"voucher_id": voucher_id, "mac_address": mac, "bytes_in": bytes_in,
+                                    "bytes_out": bytes_out, "updated_at": now}
+            else:
+                row["bytes_in"] += bytes_in
+                row["bytes_out"] += bytes_out
+
+        table = DataUsage.__table__
+        insert = UPSERT_INSERTS.get(db.session.get_bind().dialect.name)
+        if not rows:
+            return []
+        if insert is not None:
+            # One upsert run as executemany: compiled once and cached, unlike a multi-row VALUES list
+            statement = insert(table)
+            statement = statement.on_conflict_do_update(
+                index_elements=["voucher_id"],
+                set_={"bytes_in": table.c.bytes_in + statement.excluded.bytes_in,
+                      "bytes_out": table.c.bytes_out + statement.excluded.bytes_out,
+                      "mac_address": statement.excluded.mac_address,
+                      "updated_at": statement.excluded.updated_at})
+            db.session.execute(statement, list(rows.values()))
+        else:
+            for row in rows.values():
+                usage = db.session.get(DataUsage, row["voucher_id"])
+                if usage is None:
+                    db.session.add(DataUsage(**row))
+                else:
+                    usage.bytes_in += row["bytes_in"]
+                    usage.bytes_out += row["bytes_out"]
+                    usage.mac_address, usage.updated_at = row["mac_address"], now
+            db.session.flush()
+
+        cut_off = []
+        for voucher_ids in _chunks(list(rows)):
+            cut_off += db.session.execute(
+                select(DataUsage.voucher_id, DataUsage.mac_address)
+                .where(DataUsage.voucher_id.in_(voucher_ids), DataUsage.cut_off_at.is_(None),
+                       DataUsage.quota_bytes.isnot(None),
+                       DataUsage.bytes_in + DataUsage.bytes_out >= DataUsage.quota_bytes)).all()
+        if cut_off:
+            self._cut_off([voucher_id for voucher_id, _ in cut_off], now)
+        return [mac for _, mac in cut_off]
+
+    @staticmethod
+    def _cut_off(voucher_ids, now):
+        """Mark sessions exhausted and expire their vouchers, so a reconnect is refused."""
+        db.session.execute(update(DataUsage).where(DataUsage.voucher_id.in_(voucher_ids)).values(cut_off_at=now))
+        # Through the ORM so edge sync picks the expiry up
+        for voucher in Voucher.query.filter(Voucher.id.in_(voucher_ids)):
+            if voucher.expiry_time is None or _wall_clock(voucher.expiry_time) > _wall_clock(now):
+                voucher.expiry_time = now
+        metrics.incr("usage.cut_off", len(voucher_ids))
+        logger.info(f"Cut off {len(voucher_ids)} sessions over quota")
+
+
+def _wall_clock(value):
+    """Nairobi wall-clock time without tzinfo; Postgres returns aware values in the session timezone, SQLite naive ones."""
+    if value.tzinfo is not None:
+        return value.astimezone(nairobi_tz).replace(tzinfo=None)
+    return value
+
+
+def recently_cut_off(window):
+    """MACs whose sessions were cut off in the last `window` seconds, for the router to disconnect."""
+    since = nairobi_now() - timedelta(seconds=window)
+    return [mac for (mac,) in db.session.execute(
+        select(DataUsage.mac_address).where(DataUsage.cut_off_at >= since, DataUsage.mac_address.isnot(None)))]
+
+
+usage_aggregator = UsageAggregator()
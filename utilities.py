@@ -1,29 +1,24 @@
 from datetime import datetime
 import base64
-import requests
-import os
 import time
 import logging
-from dotenv import load_dotenv  # Ensure dotenv is loaded
-
-# Load environment variables
-load_dotenv()
+from circuitbreaker import daraja_breaker
+from config import (CONSUMER_KEY, CONSUMER_SECRET, SHORTCODE, TILL_NUMBER, PASSKEY, OAUTH_URL,
+                    CALLBACK_URL, STK_QUERY_URL, DARAJA_TIMEOUT)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load M-Pesa environment variables
-CONSUMER_KEY = os.getenv("CONSUMER_KEY", "CONSUMER_KEY")  
-CONSUMER_SECRET = os.getenv("CONSUMER_SECRET", "CONSUMER_SECRET")
-SHORTCODE = os.getenv("SHORTCODE", "SHORTCODE") 
-TILL_NUMBER = os.getenv("TILL_NUMBER", "TILL_NUMBER")
-PASSKEY = os.getenv("PASSKEY", "PASSKEY")
-OAUTH_URL = os.getenv("OAUTH_URL", "OAUTH_URL")
-CALLBACK_URL = os.getenv("CALLBACK_URL", "CALLBACK_URL")
+# Daraja answers STK queries for a push that is still on the customer's phone with this error code
+STILL_PROCESSING = "500.001.1001"
+
+
+def check_mpesa_config():
+    """Fail on first M-Pesa use, not at import, so workers that never pay still start."""
+    if not SHORTCODE or not PASSKEY or not OAUTH_URL or not CALLBACK_URL or not CONSUMER_KEY or not CONSUMER_SECRET:
+        raise ValueError("🚨 Missing required environment variables!")
 
-if not SHORTCODE or not PASSKEY or not OAUTH_URL or not CALLBACK_URL or not CONSUMER_KEY or not CONSUMER_SECRET:
-    raise ValueError("🚨 Missing required environment variables!")
 
 # Cache for access token
 cached_token = None
@@ -32,14 +27,19 @@ token_expiry = 0
 
 def get_password_and_timestamp():
     """Generate Base64-encoded password for MPesa STK Push."""
+    check_mpesa_config()
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
     password = base64.b64encode(f"{SHORTCODE}{PASSKEY}{timestamp}".encode()).decode("utf-8")
     return password, timestamp
 
 
 def get_access_token():
-    """Generate an OAuth access token with caching and retry mechanism."""
+    """
+    Generate an OAuth access token with caching and retry mechanism.
+    Raises CircuitOpenError without calling Daraja while its circuit is open.
+    """
     global cached_token, token_expiry
+    import requests  # Deferred: only payment workers pay for the requests import
 
     # Use cached token if still valid
     if cached_token and time.time() < token_expiry:
@@ -56,7 +56,7 @@ def get_access_token():
         }
 
         for attempt in range(3):  # Retry up to 3 times
-            response = requests.get(OAUTH_URL, headers=headers, timeout=10)
+            response = daraja_breaker.call(requests.get, OAUTH_URL, headers=headers, timeout=DARAJA_TIMEOUT)
 
             if response.status_code == 200:
                 token_data = response.json()
@@ -68,9 +68,35 @@ def get_access_token():
                 return cached_token
             else:
                 logger.error(f"❌ Error generating access token: {response.status_code}, {response.text}")
-                time.sleep(2 ** attempt)  # Exponential backoff
+                if attempt < 2:
+                    time.sleep(2 ** attempt)  # Exponential backoff
 
     except requests.RequestException as e:
         logger.exception(f"❌ Exception during token generation: {str(e)}")
 
     return None
+
+
+def query_stk_status(checkout_request_id, access_token):
+    """Ask Daraja for the result of an STK push (used when the callback never arrived)."""
+    import requests
+
+    password, timestamp = get_password_and_timestamp()
+    payload = {
+        "BusinessShortCode": SHORTCODE,
+        "Password": password,
+        "Timestamp": timestamp,
+        "CheckoutRequestID": checkout_request_id,
+    }
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json"
+    }
+    response = daraja_breaker.call(requests.post, STK_QUERY_URL, headers=headers, json=payload,
+                                   timeout=DARAJA_TIMEOUT, failure=_query_failed)
+    return response.json()
+
+
+def _query_failed(response):
+    # "Still processing" comes back as a 500 but is a normal answer, not a gateway fault
+    return response.status_code >= 500 and STILL_PROCESSING not in response.text
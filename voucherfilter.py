@@ -0,0 +1,190 @@
+# voucherfilter.py
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+
+from sqlalchemy import case, event
+
+import metrics
+from config import VOUCHER_FILTER_ENABLED, VOUCHER_FILTER_FP_RATE, VOUCHER_FILTER_REBUILD, VOUCHER_FILTER_REFRESH
+from database.models import db, Voucher
+
+logger = logging.getLogger(__name__)
+
+MIN_CAPACITY = 100000
+BUILD_BATCH = 50000
+# Re-read a few ids behind the high-water mark; on PostgreSQL ids can commit out of order
+REFRESH_OVERLAP = 1000
+
+
+class BloomFilter:
+    """Set membership with no false negatives and a bounded false-positive rate."""
+
+    def __init__(self, capacity, fp_rate):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, key):
+        # Double hashing: k positions from one 128-bit digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, key):
+        positions = self._positions(key)
+        with self._lock:  # bit updates are read-modify-write on shared bytes
+            bits = self.bits
+            for position in positions:
+                bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class VoucherFilter:
+    """
+    In-memory Bloom filter of every issued voucher code, so codes that were
+    never issued are rejected without a database query.
+
+    Built on a background thread at startup (until then every code goes to the
+    database), rebuilt periodically, and updated by an after_insert hook on
+    Voucher. Other workers insert vouchers this process never sees, so a miss
+    checks the database for newer ids first, at most once per
+    VOUCHER_FILTER_REFRESH seconds; a code issued by another worker within
+    that window may be turned away until the next refresh.
+    """
+
+    def __init__(self):
+        self.bloom = None
+        self.max_id = 0
+        self._recent = set()  # ids in the last REFRESH_OVERLAP the filter has read
+        self._last_refresh = 0.0
+        self._refresh_lock = threading.Lock()
+        self._listening = False
+
+    def init_app(self, app):
+        app.config.setdefault("VOUCHER_FILTER_ENABLED", VOUCHER_FILTER_ENABLED)
+        app.config.setdefault("VOUCHER_FILTER_FP_RATE", VOUCHER_FILTER_FP_RATE)
+        app.config.setdefault("VOUCHER_FILTER_REBUILD", VOUCHER_FILTER_REBUILD)
+        app.config.setdefault("VOUCHER_FILTER_REFRESH", VOUCHER_FILTER_REFRESH)
+        self.fp_rate = app.config["VOUCHER_FILTER_FP_RATE"]
+        self.refresh_interval = app.config["VOUCHER_FILTER_REFRESH"]
+
+        # CLI commands don't serve logins; skip loading every code for them
+        if not app.config["VOUCHER_FILTER_ENABLED"] or os.environ.get("FLASK_RUN_FROM_CLI") == "true":
+            return
+        if not self._listening:
+            event.listen(Voucher, "after_insert", self._after_insert)
+            self._listening = True
+        threading.Thread(target=self._maintain, args=(app, app.config["VOUCHER_FILTER_REBUILD"]),
+                         name="voucher-filter", daemon=True).start()
+
+    def _after_insert(self, mapper, connection, target):
+        bloom = self.bloom
+        if bloom is not None:
+            bloom.add(target.code)
+            if bloom.count > bloom.capacity:
+                metrics.incr("voucher_filter.over_capacity")
+
+    def _maintain(self, app, interval):
+        while True:
+            try:
+                with app.app_context():
+                    self.rebuild()
+            except Exception as e:
+                logger.error(f"Voucher filter rebuild failed: {e}")
+            if interval <= 0:
+                return
+            time.sleep(interval)
+
+    def rebuild(self):
+        """Build a fresh filter from the voucher table and swap it in."""
+        start = time.perf_counter()
+        total = db.session.query(db.func.count(Voucher.id)).scalar()
+        bloom = BloomFilter(max(MIN_CAPACITY, total * 2), self.fp_rate)
+        last_id = 0
+        while True:
+            rows = (db.session.query(Voucher.id, Voucher.code).filter(Voucher.id > last_id)
+                    .order_by(Voucher.id).limit(BUILD_BATCH).all())
+            if not rows:
+                break
+            for _, code in rows:
+                bloom.add(code)
+            last_id = rows[-1][0]
+        db.session.remove()
+
+        self.bloom, self.max_id, self._recent = bloom, last_id, set()
+        self.refresh(force=True)  # reads the last window, and codes inserted while the scan ran
+        metrics.set_gauge("voucher_filter.bytes", len(bloom.bits))
+        metrics.set_gauge("voucher_filter.codes", bloom.count)
+        logger.info(f"Voucher filter built: {bloom.count} codes, {len(bloom.bits)} bytes, "
+                    f"{time.perf_counter() - start:.1f}s")
+
+    def refresh(self, force=False):
+        """
+        Add vouchers inserted by other processes since the last look. One
+        aggregate over the last REFRESH_OVERLAP ids tells whether anything
+        changed; rows are only read when it did.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_refresh < self.refresh_interval:
+            return False
+        if not self._refresh_lock.acquire(blocking=force):
+            return False  # another request is already refreshing
+        try:
+            self._last_refresh = now
+            floor = self.max_id - REFRESH_OVERLAP
+            total, newer = (db.session.query(db.func.count(Voucher.id),
+                                             db.func.count(case((Voucher.id > self.max_id, 1))))
+                            .filter(Voucher.id > floor).one())
+            metrics.incr("voucher_filter.refreshes")
+            if total == len(self._recent) and not newer:
+                return True
+            # Read only the new ids, or the whole window when one committed late below max_id
+            # (PostgreSQL ids can commit out of order)
+            late = total - newer != len(self._recent)
+            rows = (db.session.query(Voucher.id, Voucher.code)
+                    .filter(Voucher.id > (floor if late else self.max_id)).order_by(Voucher.id).all())
+            bloom = self.bloom
+            for _, code in rows:
+                if code not in bloom:
+                    bloom.add(code)
+            recent = set() if late else self._recent
+            recent.update(voucher_id for voucher_id, _ in rows)
+            if rows:
+                self.max_id = max(self.max_id, rows[-1][0])
+            floor = self.max_id - REFRESH_OVERLAP
+            self._recent = {voucher_id for voucher_id in recent if voucher_id > floor}
+            return True
+        finally:
+            self._refresh_lock.release()
+
+    def might_exist(self, code):
+        """
+        False only when `code` was not issued as of the last refresh, which a
+        miss triggers at most once per VOUCHER_FILTER_REFRESH seconds.
+        """
+        if self.bloom is None or code in self.bloom:
+            return True
+        self.refresh()
+        if code in self.bloom:
+            return True
+        metrics.incr("voucher_filter.rejected")
+        return False
+
+
+voucher_filter = VoucherFilter()